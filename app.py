@@ -9,6 +9,7 @@ from datetime import datetime
 from flask import Flask, jsonify, request
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import threading
 
 # 添加src目录到路径
@@ -84,6 +85,58 @@ def run_update_task():
         logger.info("=" * 60)
 
 
+def run_compact_task():
+    """增量清理一批过期缓存记录（IP更新任务运行期间跳过）"""
+    if task_status['is_running']:
+        return
+    
+    try:
+        from src.ip_detector_v2 import get_detector
+        get_detector().compact_cache()
+    except Exception as e:
+        logger.error(f"清理过期缓存失败: {e}")
+
+
+_warmer = None
+
+
+def get_warmer():
+    """获取缓存预热器（首次调用时创建）"""
+    global _warmer
+    if _warmer is None:
+        from src.cache_warmer import CacheWarmer
+        from src.ip_detector_v2 import get_detector
+        config = get_config()
+        _warmer = CacheWarmer(
+            get_detector(),
+            batch_size=config.cache_warm_batch_size,
+            pause=config.cache_warm_pause,
+            lookback=config.cache_warm_lookback
+        )
+    return _warmer
+
+
+def next_update_time() -> float:
+    """下一次IP更新任务的时间戳（没有定时任务时为一天后）"""
+    run_times = [
+        job.next_run_time.timestamp()
+        for job in scheduler.get_jobs()
+        if job.id.startswith('update_task_') and job.next_run_time
+    ]
+    return min(run_times) if run_times else datetime.now().timestamp() + 86400
+
+
+def run_warm_task():
+    """空闲时预热下一次运行会用到的缓存（IP更新任务运行期间跳过，开始运行时停止）"""
+    if task_status['is_running']:
+        return
+    
+    try:
+        get_warmer().run(next_update_time(), should_stop=lambda: task_status['is_running'])
+    except Exception as e:
+        logger.error(f"缓存预热失败: {e}")
+
+
 # 初始化定时任务调度器
 scheduler = BackgroundScheduler(timezone='Asia/Shanghai')
 
@@ -119,6 +172,32 @@ def init_scheduler():
             except Exception as e:
                 logger.error(f"❌ 添加定时任务失败 {time_str}: {e}")
         
+        config = get_config()
+        
+        # 空闲时预热缓存，每次预热数量有上限
+        if config.cache_warm_enabled and config.cache_warm_interval > 0:
+            scheduler.add_job(
+                run_warm_task,
+                IntervalTrigger(seconds=config.cache_warm_interval),
+                id='cache_warm',
+                name='缓存预热',
+                replace_existing=True,
+                max_instances=1
+            )
+            logger.info(f"✅ 已添加缓存预热任务: 每 {config.cache_warm_interval} 秒")
+        
+        # 空闲时增量清理过期缓存，每次清理量有上限
+        compact_interval = config.cache_compact_interval
+        if compact_interval > 0:
+            scheduler.add_job(
+                run_compact_task,
+                IntervalTrigger(seconds=compact_interval),
+                id='cache_compact',
+                name='缓存增量清理',
+                replace_existing=True
+            )
+            logger.info(f"✅ 已添加缓存清理任务: 每 {compact_interval} 秒")
+        
         # 启动调度器
         scheduler.start()
         logger.info("🚀 定时任务调度器已启动")
@@ -4,17 +4,45 @@ API Provider模块
 """
 
 import time
+import asyncio
 import logging
+import threading
 import requests
-from typing import Dict, Optional, List
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Optional, List
 from abc import ABC, abstractmethod
 
+from .http_client import AIOHTTP_AVAILABLE, AsyncHTTPClient, AsyncResponse, get_http_client
+from .concurrency import AtomicCounters, run_sync
+from .rate_limiter import RateLimitExceeded, RequestBudget, TokenBucket, get_rate_limiter
+
 logger = logging.getLogger(__name__)
 
 
 class BaseAPIProvider(ABC):
     """IP查询API基类"""
     
+    # 是否提供批量查询接口（query_batch/query_batch_async，由子类实现），以及每次批量查询的最大IP数
+    supports_batch = False
+    batch_size = 1
+    
+    # 每分钟请求数上限（同名API共享一个令牌桶），额度不足时最多等待的秒数
+    rate_limit_per_minute = 60
+    rate_limit_wait = 0.5
+    
+    # 延迟分布保留的最近样本数，以及计算分位数所需的最少样本数
+    latency_window = 200
+    latency_min_samples = 10
+    
+    # 动态排序使用的指数加权平均（EWMA）的平滑系数
+    ewma_alpha = 0.2
+    
+    # 单IP查询的地址模板（{ip}），异步查询据此直接发出请求；未设置时在线程中执行同步查询
+    url_template: Optional[str] = None
+    # 同一事件循环上同时进行的异步查询数上限
+    max_concurrency = 16
+    
     def __init__(self, name: str, timeout: int = 3):
         """
         初始化API Provider
@@ -31,6 +59,16 @@ class BaseAPIProvider(ABC):
         self.last_failure_time = None
         self.total_requests = 0
         self.successful_requests = 0
+        # 多线程批量检测共享同一个Provider，计数器更新需要加锁
+        self._stats_lock = threading.Lock()
+        self.rate_limiter: TokenBucket = get_rate_limiter(name, self.rate_limit_per_minute)
+        # 最近成功请求的耗时（秒），用于决定何时发出对冲请求
+        self._latencies = deque(maxlen=self.latency_window)
+        # 耗时和成功率的指数加权平均，无样本时耗时为None
+        self.ewma_latency: Optional[float] = None
+        self.ewma_success = 1.0
+        # 作为对冲目标时的额外请求预算，由APIManager按配置替换
+        self.hedge_budget = RequestBudget(name)
     
     @abstractmethod
     def query(self, ip: str) -> Optional[Dict]:
@@ -58,27 +96,215 @@ class BaseAPIProvider(ABC):
         """
         pass
     
+    async def query_async(self, ip: str, http: AsyncHTTPClient) -> Optional[Dict]:
+        """
+        异步查询IP信息
+        
+        按url_template发出GET请求，响应交给parse_response解析（与同步查询的规则相同）；
+        没有url_template的Provider在线程中执行同步的query
+        
+        Args:
+            ip: IP地址
+            http: 异步HTTP客户端
+            
+        Returns:
+            标准化的位置信息字典，失败返回None
+            
+        Raises:
+            RateLimitExceeded: 额度不足
+        """
+        if self.url_template is None:
+            return await asyncio.to_thread(self.query, ip)
+        
+        self._count_request()
+        try:
+            response = await self._request_async(http, 'GET', self.url_template.format(ip=ip))
+            response.raise_for_status()
+            result = self.parse_response(response)
+        
+        except RateLimitExceeded:
+            raise
+        
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"{self.name} 请求失败: {ip}, {e}")
+            self.mark_failure()
+            return None
+        
+        except Exception as e:
+            logger.error(f"{self.name} 异常: {ip}, {e}")
+            self.mark_failure()
+            return None
+        
+        if result:
+            self.mark_success()
+        else:
+            self.mark_failure()
+        return result
+    
+    async def query_many_async(self, ips: Iterable[str], http: AsyncHTTPClient) -> Dict[str, Optional[Dict]]:
+        """
+        异步并发查询多个IP（同时进行的查询数不超过max_concurrency）
+        
+        Args:
+            ips: IP地址列表
+            http: 异步HTTP客户端
+            
+        Returns:
+            {IP: 位置信息或None}，额度不足的IP为None
+        """
+        ips = list(dict.fromkeys(ips))
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def query_one(ip: str) -> Optional[Dict]:
+            async with semaphore:
+                try:
+                    return await self.query_async(ip, http)
+                except RateLimitExceeded:
+                    return None
+        
+        return dict(zip(ips, await asyncio.gather(*(query_one(ip) for ip in ips))))
+    
     def is_available(self) -> bool:
         """
-        检查API是否可用
+        检查API是否可用（包括限流额度）
         
         Returns:
             bool: API是否可用
         """
-        return self.enabled
+        return self.enabled and self.rate_limiter.wait_time() <= self.rate_limit_wait
+    
+    def is_batch_available(self) -> bool:
+        """检查批量接口是否可用"""
+        return self.enabled and self.supports_batch
+    
+    def _request(self, method: str, url: str, limiter: Optional[TokenBucket] = None,
+                 **kwargs) -> requests.Response:
+        """
+        发送受限流控制的请求，并根据响应头校准限流器
+        
+        Args:
+            method: HTTP方法
+            url: 请求地址
+            limiter: 使用的限流器，默认为本API的限流器
+            
+        Returns:
+            响应对象
+            
+        Raises:
+            RateLimitExceeded: 额度不足（短暂等待后仍不足）或服务端返回429
+        """
+        limiter = limiter or self.rate_limiter
+        if not limiter.acquire(timeout=self.rate_limit_wait):
+            raise RateLimitExceeded(limiter.name, limiter.wait_time())
+        
+        track_latency = limiter is self.rate_limiter
+        
+        kwargs.setdefault('timeout', self.timeout)
+        # 每次请求只消耗一个令牌：不在HTTP客户端内重试（失败时由APIManager换用下一个API），
+        # 否则重试会绕过限流器消耗额度，并使耗时分布包含重试时间
+        kwargs.setdefault('retries', 0)
+        start_time = time.monotonic()
+        try:
+            response = get_http_client().request(method, url, **kwargs)
+        except requests.exceptions.Timeout:
+            # 超时计入平均耗时，使持续变慢的API排到后面
+            if track_latency:
+                self._update_latency_ewma(time.monotonic() - start_time)
+            raise
+        limiter.update_from_headers(response.headers, response.status_code)
+        
+        # 只统计单IP接口的成功响应（批量接口的耗时不代表单IP查询的延迟）
+        if track_latency and response.ok:
+            self.record_latency(time.monotonic() - start_time)
+        
+        if response.status_code == 429:
+            raise RateLimitExceeded(limiter.name, limiter.wait_time())
+        return response
+    
+    async def _request_async(self, http: AsyncHTTPClient, method: str, url: str,
+                             limiter: Optional[TokenBucket] = None, **kwargs) -> AsyncResponse:
+        """
+        发送受限流控制的异步请求（规则与_request相同，等待额度时不阻塞事件循环）
+        
+        Raises:
+            RateLimitExceeded: 额度不足（短暂等待后仍不足）或服务端返回429
+        """
+        limiter = limiter or self.rate_limiter
+        if not await limiter.acquire_async(timeout=self.rate_limit_wait):
+            raise RateLimitExceeded(limiter.name, limiter.wait_time())
+        
+        track_latency = limiter is self.rate_limiter
+        
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('retries', 0)  # 与_request相同，不在HTTP客户端内重试
+        start_time = time.monotonic()
+        try:
+            response = await http.request(method, url, **kwargs)
+        except requests.exceptions.Timeout:
+            if track_latency:
+                self._update_latency_ewma(time.monotonic() - start_time)
+            raise
+        limiter.update_from_headers(response.headers, response.status_code)
+        
+        if track_latency and response.ok:
+            self.record_latency(time.monotonic() - start_time)
+        
+        if response.status_code == 429:
+            raise RateLimitExceeded(limiter.name, limiter.wait_time())
+        return response
+    
+    def record_latency(self, seconds: float):
+        """记录一次成功请求的耗时"""
+        with self._stats_lock:
+            self._latencies.append(seconds)
+        self._update_latency_ewma(seconds)
+    
+    def _update_latency_ewma(self, seconds: float):
+        """更新耗时的指数加权平均"""
+        with self._stats_lock:
+            if self.ewma_latency is None:
+                self.ewma_latency = seconds
+            else:
+                self.ewma_latency += self.ewma_alpha * (seconds - self.ewma_latency)
+    
+    def latency_quantile(self, q: float = 0.9) -> Optional[float]:
+        """
+        最近请求耗时的分位数
+        
+        Args:
+            q: 分位（0-1）
+            
+        Returns:
+            耗时（秒），样本不足时返回None
+        """
+        with self._stats_lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.latency_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+    
+    def _count_request(self):
+        """记录一次请求"""
+        with self._stats_lock:
+            self.total_requests += 1
     
     def mark_success(self):
         """标记成功"""
-        self.failure_count = 0
-        self.last_success_time = time.time()
-        self.successful_requests += 1
+        with self._stats_lock:
+            self.failure_count = 0
+            self.last_success_time = time.time()
+            self.successful_requests += 1
+            self.ewma_success += self.ewma_alpha * (1.0 - self.ewma_success)
         logger.debug(f"API成功: {self.name}")
     
     def mark_failure(self):
         """标记失败"""
-        self.failure_count += 1
-        self.last_failure_time = time.time()
-        logger.debug(f"API失败: {self.name}, 失败次数: {self.failure_count}")
+        with self._stats_lock:
+            self.failure_count += 1
+            self.last_failure_time = time.time()
+            failure_count = self.failure_count
+            self.ewma_success -= self.ewma_alpha * self.ewma_success
+        logger.debug(f"API失败: {self.name}, 失败次数: {failure_count}")
     
     def get_stats(self) -> Dict:
         """
@@ -87,16 +313,30 @@ class BaseAPIProvider(ABC):
         Returns:
             统计信息字典
         """
-        success_rate = (self.successful_requests / self.total_requests * 100) if self.total_requests > 0 else 0
+        with self._stats_lock:
+            total_requests = self.total_requests
+            successful_requests = self.successful_requests
+            failure_count = self.failure_count
+            last_success_time = self.last_success_time
+            last_failure_time = self.last_failure_time
+            ewma_latency = self.ewma_latency
+            ewma_success = self.ewma_success
+        
+        success_rate = (successful_requests / total_requests * 100) if total_requests > 0 else 0
         return {
             'name': self.name,
             'enabled': self.enabled,
-            'total_requests': self.total_requests,
-            'successful_requests': self.successful_requests,
+            'total_requests': total_requests,
+            'successful_requests': successful_requests,
             'success_rate': f"{success_rate:.1f}%",
-            'failure_count': self.failure_count,
-            'last_success_time': self.last_success_time,
-            'last_failure_time': self.last_failure_time
+            'failure_count': failure_count,
+            'last_success_time': last_success_time,
+            'last_failure_time': last_failure_time,
+            'rate_limit': self.rate_limiter.get_stats(),
+            'p90_latency': self.latency_quantile(0.9),
+            'ewma_latency': ewma_latency,
+            'ewma_success': round(ewma_success, 3),
+            'hedge_budget': self.hedge_budget.get_stats()
         }
 
 
@@ -107,51 +347,30 @@ class BaseAPIProvider(ABC):
 
 
 class IPAPIProvider(BaseAPIProvider):
-    """IP-API.COM查询API"""
+    """IP-API.COM查询API（单IP接口45次/分钟，批量接口每次100个IP、15次/分钟）"""
+    
+    supports_batch = True
+    batch_size = 100
+    rate_limit_per_minute = 45
     
     def __init__(self, timeout: int = 3):
         super().__init__('ip_api_com', timeout)
         self.url_template = 'http://ip-api.com/json/{ip}?lang=zh-CN'
-        self.rate_limit_requests = []
-        self.rate_limit_max = 45  # 45次/分钟
-        self.rate_limit_window = 60  # 60秒
+        self.batch_url = 'http://ip-api.com/batch?lang=zh-CN'
+        # 批量接口的限流与单IP接口分开计算（两者的响应头分别返回各自的X-Rl/X-Ttl）
+        self.batch_rate_limiter = get_rate_limiter('ip_api_com_batch', 15)
     
-    def is_available(self) -> bool:
-        """检查API是否可用（包括限流检查）"""
-        if not self.enabled:
-            return False
-        
-        # 检查限流
-        return self._check_rate_limit()
-    
-    def _check_rate_limit(self) -> bool:
-        """检查是否超过限流"""
-        now = time.time()
-        
-        # 清理过期的请求记录
-        self.rate_limit_requests = [
-            t for t in self.rate_limit_requests 
-            if now - t < self.rate_limit_window
-        ]
-        
-        # 检查是否超过限制
-        if len(self.rate_limit_requests) >= self.rate_limit_max:
-            logger.debug(f"IP-API.COM限流: {len(self.rate_limit_requests)}/{self.rate_limit_max}")
-            return False
-        
-        return True
+    def is_batch_available(self) -> bool:
+        """检查批量接口是否可用（包括限流额度）"""
+        return self.enabled and self.batch_rate_limiter.wait_time() <= self.rate_limit_wait
     
     def query(self, ip: str) -> Optional[Dict]:
         """查询IP信息"""
-        if not self._check_rate_limit():
-            return None
-        
-        self.total_requests += 1
-        self.rate_limit_requests.append(time.time())
+        self._count_request()
         
         try:
             url = self.url_template.format(ip=ip)
-            response = requests.get(url, timeout=self.timeout)
+            response = self._request('GET', url)
             response.raise_for_status()
             
             result = self.parse_response(response)
@@ -163,6 +382,9 @@ class IPAPIProvider(BaseAPIProvider):
                 self.mark_failure()
                 return None
         
+        except RateLimitExceeded:
+            raise
+        
         except requests.exceptions.Timeout:
             logger.debug(f"IP-API.COM超时: {ip}")
             self.mark_failure()
@@ -178,26 +400,97 @@ class IPAPIProvider(BaseAPIProvider):
             self.mark_failure()
             return None
     
+    def query_batch(self, ips: List[str]) -> Optional[Dict[str, Optional[Dict]]]:
+        """批量查询IP信息（一次请求最多100个IP）"""
+        self._count_request()
+        
+        try:
+            response = self._request(
+                'POST', self.batch_url, limiter=self.batch_rate_limiter,
+                json=list(ips), timeout=self.timeout * 2
+            )
+            response.raise_for_status()
+            return self._parse_batch(ips, response)
+        
+        except RateLimitExceeded:
+            raise
+        
+        except requests.exceptions.Timeout:
+            logger.debug(f"IP-API.COM批量查询超时: {len(ips)} 个IP")
+            self.mark_failure()
+            return None
+        
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"IP-API.COM批量查询失败: {len(ips)} 个IP, {e}")
+            self.mark_failure()
+            return None
+        
+        except Exception as e:
+            logger.error(f"IP-API.COM批量查询异常: {len(ips)} 个IP, {e}")
+            self.mark_failure()
+            return None
+    
+    async def query_batch_async(self, ips: List[str], http: AsyncHTTPClient) -> Optional[Dict[str, Optional[Dict]]]:
+        """批量查询IP信息（异步版本）"""
+        self._count_request()
+        
+        try:
+            response = await self._request_async(
+                http, 'POST', self.batch_url, limiter=self.batch_rate_limiter,
+                json=list(ips), timeout=self.timeout * 2
+            )
+            response.raise_for_status()
+            return self._parse_batch(ips, response)
+        
+        except RateLimitExceeded:
+            raise
+        
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"IP-API.COM批量查询失败: {len(ips)} 个IP, {e}")
+            self.mark_failure()
+            return None
+        
+        except Exception as e:
+            logger.error(f"IP-API.COM批量查询异常: {len(ips)} 个IP, {e}")
+            self.mark_failure()
+            return None
+    
+    def _parse_batch(self, ips: List[str], response) -> Dict[str, Optional[Dict]]:
+        """解析批量接口的响应，并记录本次批量查询是否成功"""
+        results = {ip: None for ip in ips}
+        for data in response.json():
+            if isinstance(data, dict) and data.get('query') in results:
+                results[data['query']] = self._parse_data(data)
+        
+        if any(results.values()):
+            self.mark_success()
+        else:
+            self.mark_failure()
+        return results
+    
     def parse_response(self, response: requests.Response) -> Optional[Dict]:
         """解析IP-API.COM响应"""
         try:
-            data = response.json()
-            
-            if data.get('status') == 'success':
-                return {
-                    'country': data.get('countryCode', 'Unknown'),
-                    'country_name': data.get('country', 'Unknown'),
-                    'city': data.get('city', 'Unknown'),
-                    'isp': data.get('isp', ''),
-                    'source': 'ip_api_com',
-                    'confidence': 0.95
-                }
-            
-            return None
+            return self._parse_data(response.json())
         
         except Exception as e:
             logger.debug(f"IP-API.COM响应解析失败: {e}")
             return None
+    
+    @staticmethod
+    def _parse_data(data: Dict) -> Optional[Dict]:
+        """解析单个IP的查询结果（单IP接口与批量接口格式相同）"""
+        if data.get('status') == 'success':
+            return {
+                'country': data.get('countryCode', 'Unknown'),
+                'country_name': data.get('country', 'Unknown'),
+                'city': data.get('city', 'Unknown'),
+                'isp': data.get('isp', ''),
+                'source': 'ip_api_com',
+                'confidence': 0.95
+            }
+        
+        return None
 
 
 # 注释：太平洋API已移除（不准确）
@@ -209,17 +502,19 @@ class IPAPIProvider(BaseAPIProvider):
 class IPInfoProvider(BaseAPIProvider):
     """IPInfo.IO API提供商 - 主要API（速度最快，准确度高）"""
     
+    rate_limit_per_minute = 100
+    
     def __init__(self, timeout: int = 5):
         super().__init__('ipinfo', timeout)
         self.url_template = 'https://ipinfo.io/{ip}/json'
     
     def query(self, ip: str) -> Optional[Dict]:
         """查询IP信息"""
-        self.total_requests += 1
+        self._count_request()
         
         try:
             url = self.url_template.format(ip=ip)
-            response = requests.get(url, timeout=self.timeout)
+            response = self._request('GET', url)
             response.raise_for_status()
             
             result = self.parse_response(response)
@@ -231,6 +526,9 @@ class IPInfoProvider(BaseAPIProvider):
                 self.mark_failure()
                 return None
         
+        except RateLimitExceeded:
+            raise
+        
         except requests.exceptions.Timeout:
             logger.debug(f"IPInfo.IO超时: {ip}")
             self.mark_failure()
@@ -265,7 +563,13 @@ class IPInfoProvider(BaseAPIProvider):
             if org.startswith('AS'):
                 asn = org.split(' ')[0]
 
-            return {
+            # 付费版响应带有ASN对象，其中route为该IP所属的网段
+            network = None
+            if isinstance(data.get('asn'), dict):
+                asn = data['asn'].get('asn', asn)
+                network = data['asn'].get('route')
+
+            result = {
                 'country': data.get('country', 'Unknown'),
                 'country_name': data.get('country', 'Unknown'),
                 'city': data.get('city', 'Unknown'),
@@ -279,6 +583,9 @@ class IPInfoProvider(BaseAPIProvider):
                 'source': 'ipinfo',
                 'confidence': 0.95
             }
+            if network:
+                result['network'] = network
+            return result
 
         except Exception as e:
             logger.debug(f"IPInfo.IO响应解析失败: {e}")
@@ -294,11 +601,11 @@ class IPWhoisProvider(BaseAPIProvider):
     
     def query(self, ip: str) -> Optional[Dict]:
         """查询IP信息"""
-        self.total_requests += 1
+        self._count_request()
         
         try:
             url = self.url_template.format(ip=ip)
-            response = requests.get(url, timeout=self.timeout)
+            response = self._request('GET', url)
             response.raise_for_status()
             
             result = self.parse_response(response)
@@ -310,6 +617,9 @@ class IPWhoisProvider(BaseAPIProvider):
                 self.mark_failure()
                 return None
         
+        except RateLimitExceeded:
+            raise
+        
         except requests.exceptions.Timeout:
             logger.debug(f"IPWhois超时: {ip}")
             self.mark_failure()
@@ -356,17 +666,19 @@ class IPWhoisProvider(BaseAPIProvider):
 class IP2LocationProvider(BaseAPIProvider):
     """IP2Location.IO API提供商 - 辅助API"""
     
+    rate_limit_per_minute = 30
+    
     def __init__(self, timeout: int = 5):
         super().__init__('ip2location', timeout)
         self.url_template = 'https://api.ip2location.io/?ip={ip}'
     
     def query(self, ip: str) -> Optional[Dict]:
         """查询IP信息"""
-        self.total_requests += 1
+        self._count_request()
         
         try:
             url = self.url_template.format(ip=ip)
-            response = requests.get(url, timeout=self.timeout)
+            response = self._request('GET', url)
             response.raise_for_status()
             
             result = self.parse_response(response)
@@ -378,6 +690,9 @@ class IP2LocationProvider(BaseAPIProvider):
                 self.mark_failure()
                 return None
         
+        except RateLimitExceeded:
+            raise
+        
         except requests.exceptions.Timeout:
             logger.debug(f"IP2Location超时: {ip}")
             self.mark_failure()
@@ -422,15 +737,98 @@ class IP2LocationProvider(BaseAPIProvider):
             return None
 
 
+class _AsyncQueryContext:
+    """一次异步批量查询共享的HTTP客户端、每个API的并发上限和后台任务"""
+    
+    def __init__(self, http: AsyncHTTPClient, providers: List[BaseAPIProvider]):
+        self.http = http
+        self.limits = {provider.name: asyncio.Semaphore(provider.max_concurrency) for provider in providers}
+        self._tasks = set()
+    
+    async def call(self, provider: BaseAPIProvider, ip: str) -> Optional[Dict]:
+        """在API的并发上限内执行一次查询"""
+        async with self.limits[provider.name]:
+            return await provider.query_async(ip, self.http)
+    
+    def spawn(self, coro) -> asyncio.Task:
+        """创建任务并保留引用，对冲中落后的请求在批量查询期间继续执行"""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    async def close(self):
+        """取消批量查询结束时仍未完成的落后请求"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
 class APIManager:
-    """API管理器 - 管理多个API Provider并实现轮询"""
+    """
+    API管理器 - 管理多个API Provider并实现轮询
+    
+    查询顺序按动态评分排列：成功率和剩余额度的加权平均越高、平均耗时越短的API越靠前，
+    每批查询后重新排序。配置的优先级只在评分相同时决定先后；固定的API始终排在最前面。
+    
+    对冲模式下，当前API在其p90耗时内没有返回时，并行发出下一个API的请求，
+    取最先返回的有效结果。每个API作为对冲目标的额外请求受预算限制。
+    
+    批量查询在一个事件循环上以协程执行（query_many_async），同步的query_batch是其包装，
+    大量查询不再各占一个线程。
+    """
     
-    def __init__(self):
-        """初始化API管理器"""
+    # 剩余额度低于该比例时按比例降低评分
+    QUOTA_LOW_WATERMARK = 0.2
+    # 评分计算中耗时的下限（秒），避免极短耗时主导排序
+    LATENCY_FLOOR = 0.05
+    
+    def __init__(self, hedge: bool = False, hedge_ratio: float = 0.1, hedge_burst: float = 10,
+                 hedge_default_delay: float = 1.0, hedge_min_delay: float = 0.05,
+                 hedge_workers: int = 16, dynamic_ranking: bool = True,
+                 pinned: Optional[Iterable[str]] = None, ewma_alpha: float = 0.2,
+                 rerank_interval: int = 100, async_concurrency: int = 200):
+        """
+        初始化API管理器
+        
+        Args:
+            dynamic_ranking: 是否按动态评分排序（False时只按配置的优先级）
+            pinned: 固定排在最前面的API名称（按优先级排列，不参与动态排序）
+            ewma_alpha: 耗时和成功率加权平均的平滑系数
+            rerank_interval: 单IP查询模式下每多少次查询重新排序一次
+            async_concurrency: 异步批量查询时同时进行的单IP查询数
+            hedge: 是否启用对冲请求
+            hedge_ratio: 每个API的对冲请求数上限（占查询数的比例）
+            hedge_burst: 每个API允许的突发对冲请求数
+            hedge_default_delay: 耗时样本不足时，发出对冲请求前的等待时间（秒）
+            hedge_min_delay: 发出对冲请求前的最短等待时间（秒）
+            hedge_workers: 对冲模式下执行查询的线程数
+        """
         self.providers: List[tuple] = []  # (provider, priority)
         self.api_status = {}  # API状态缓存
+        self._status_lock = threading.Lock()
         self.disable_threshold = 3  # 连续失败3次后禁用
         self.disable_duration = 600  # 禁用10分钟
+        
+        self.hedge = hedge
+        self.hedge_ratio = hedge_ratio
+        self.hedge_burst = hedge_burst
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_workers = hedge_workers
+        self._hedge_executor = None
+        self._hedge_executor_lock = threading.Lock()
+        self.hedge_stats = AtomicCounters({'queries': 0, 'hedged': 0, 'hedge_wins': 0, 'budget_exhausted': 0})
+        
+        self.dynamic_ranking = dynamic_ranking
+        self.pinned = set(pinned or ())
+        self.ewma_alpha = ewma_alpha
+        self.rerank_interval = rerank_interval
+        self.async_concurrency = async_concurrency
+        self._rank_lock = threading.Lock()
+        self._queries_since_rank = AtomicCounters({'queries': 0})
     
     def register_api(self, provider: BaseAPIProvider, priority: int):
         """
@@ -440,9 +838,68 @@ class APIManager:
             provider: API Provider实例
             priority: 优先级（数字越小优先级越高）
         """
-        self.providers.append((provider, priority))
-        self.providers.sort(key=lambda x: x[1])  # 按优先级排序
-        logger.info(f"注册API: {provider.name}, 优先级: {priority}")
+        provider.hedge_budget = RequestBudget(provider.name, self.hedge_ratio, self.hedge_burst)
+        provider.ewma_alpha = self.ewma_alpha
+        with self._rank_lock:
+            self.providers = self.providers + [(provider, priority)]
+        self.rerank()
+        logger.info(f"注册API: {provider.name}, 优先级: {priority}" + (" (固定)" if provider.name in self.pinned else ""))
+    
+    def score(self, provider: BaseAPIProvider) -> float:
+        """
+        API的动态评分（越高越优先）
+        
+        评分 = 成功率加权平均 × 额度系数 / 平均耗时。
+        没有耗时样本时按超时时间的一半估计；剩余额度低于QUOTA_LOW_WATERMARK时额度系数按比例降低，
+        服务端限流期间为0。
+        """
+        latency = provider.ewma_latency
+        if latency is None:
+            latency = provider.timeout / 2
+        quota = min(1.0, provider.rate_limiter.remaining_fraction() / self.QUOTA_LOW_WATERMARK)
+        return provider.ewma_success * quota / max(latency, self.LATENCY_FLOOR)
+
+    def remaining_budget(self) -> float:
+        """
+        可用API中最大的剩余额度比例
+
+        Returns:
+            0-1之间的比例，没有可用API时为0
+        """
+        return max(
+            (provider.rate_limiter.remaining_fraction() for provider, _ in self.providers
+             if self._is_api_available(provider)),
+            default=0.0
+        )
+
+    def rerank(self):
+        """按动态评分重新排列查询顺序"""
+        with self._rank_lock:
+            providers = self.providers
+            if self.dynamic_ranking:
+                scores = {provider.name: self.score(provider) for provider, _ in providers}
+                
+                def rank_key(item):
+                    provider, priority = item
+                    if provider.name in self.pinned:
+                        return (0, priority, 0.0)
+                    return (1, -scores[provider.name], priority)
+            else:
+                def rank_key(item):
+                    return (0, item[1], 0.0)
+            
+            ranked = sorted(providers, key=rank_key)
+            changed = [p.name for p, _ in ranked] != [p.name for p, _ in providers]
+            self.providers = ranked
+            self._queries_since_rank.set('queries', 0)
+        
+        if changed and len(ranked) > 1:
+            logger.info(f"API查询顺序: {' > '.join(provider.name for provider, _ in ranked)}")
+    
+    def _maybe_rerank(self):
+        """单IP查询模式下每rerank_interval次查询重新排序一次"""
+        if self.dynamic_ranking and self._queries_since_rank.incr('queries') >= self.rerank_interval:
+            self.rerank()
     
     def query(self, ip: str) -> Optional[Dict]:
         """
@@ -454,6 +911,10 @@ class APIManager:
         Returns:
             位置信息字典，失败返回None
         """
+        self._maybe_rerank()
+        if self.hedge:
+            return self._query_hedged(ip)
+        
         for provider, priority in self.providers:
             # 检查API是否可用
             if not self._is_api_available(provider):
@@ -472,6 +933,10 @@ class APIManager:
                     logger.debug(f"API查询失败: {provider.name} -> {ip}")
                     self._mark_api_failure(provider)
             
+            except RateLimitExceeded as e:
+                # 额度不足不算失败，换下一个API
+                logger.debug(f"API限流，换用下一个API: {e}")
+            
             except Exception as e:
                 logger.error(f"API查询异常: {provider.name} -> {ip}, {e}")
                 self._mark_api_failure(provider)
@@ -480,18 +945,310 @@ class APIManager:
         logger.warning(f"所有API查询失败: {ip}")
         return None
     
-    def _is_api_available(self, provider: BaseAPIProvider) -> bool:
-        """检查API是否可用"""
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        """获取对冲查询使用的线程池（首次使用时创建）"""
+        with self._hedge_executor_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=self.hedge_workers, thread_name_prefix='api-hedge'
+                )
+            return self._hedge_executor
+    
+    def _hedge_delay(self, provider: BaseAPIProvider) -> float:
+        """发出对冲请求前等待的时间：API最近的p90耗时"""
+        p90 = provider.latency_quantile(0.9)
+        if p90 is None:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, p90)
+    
+    def _hedge_candidates(self, ip: str) -> List[BaseAPIProvider]:
+        """对冲查询的候选API（按当前顺序），并为每个可能的对冲目标存入预算"""
+        candidates = [provider for provider, _ in self.providers if self._is_api_available(provider)]
+        if candidates and self.hedge:
+            self.hedge_stats.incr('queries')
+            for provider in candidates[1:]:
+                provider.hedge_budget.deposit()
+        return candidates
+    
+    def _try_hedge(self, target: BaseAPIProvider, ip: str) -> bool:
+        """当前请求超过p90仍未返回时，尝试向下一个API发出对冲请求"""
+        if target.hedge_budget.try_spend():
+            logger.debug(f"API对冲请求: {target.name} -> {ip}")
+            self.hedge_stats.incr('hedged')
+            return True
+        self.hedge_stats.incr('budget_exhausted')
+        return False
+    
+    def _settle(self, provider: BaseAPIProvider, hedged: bool, ip: str, future) -> Optional[Dict]:
+        """处理一个已完成的查询（Future或asyncio.Task），返回有效结果或None"""
+        try:
+            result = future.result()
+        except RateLimitExceeded as e:
+            # 额度不足不算失败，换下一个API
+            logger.debug(f"API限流，换用下一个API: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"API查询异常: {provider.name} -> {ip}, {e}")
+            self._mark_api_failure(provider)
+            return None
+        
+        if result:
+            logger.info(f"API查询成功: {provider.name} -> {ip}" + (" (对冲)" if hedged else ""))
+            if hedged:
+                self.hedge_stats.incr('hedge_wins')
+            self._mark_api_success(provider)
+            return result
+        
+        logger.debug(f"API查询失败: {provider.name} -> {ip}")
+        self._mark_api_failure(provider)
+        return None
+    
+    def _query_hedged(self, ip: str) -> Optional[Dict]:
+        """
+        对冲查询
+        
+        按顺序依次发出请求：当前API失败时立即换下一个；超过其p90耗时仍未返回时，
+        在预算允许的情况下并行发出下一个API的请求。返回最先得到的有效结果，
+        落后的请求在后台完成，不影响本次结果。
+        """
+        candidates = self._hedge_candidates(ip)
+        executor = self._get_hedge_executor()
+        pending = {}  # {Future: (provider, 是否为对冲请求)}
+        next_index = 0
+        can_hedge = True
+        
+        def launch(hedged: bool):
+            nonlocal next_index
+            provider = candidates[next_index]
+            next_index += 1
+            pending[executor.submit(provider.query, ip)] = (provider, hedged)
+        
+        if candidates:
+            launch(False)
+        while pending:
+            # 以最近发出的请求的p90耗时作为对冲前的等待时间
+            timeout = None
+            if can_hedge and next_index < len(candidates):
+                timeout = self._hedge_delay(candidates[next_index - 1])
+            
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            if not done:
+                # 预算用完时本次只等待已发出的请求
+                if self._try_hedge(candidates[next_index], ip):
+                    launch(True)
+                else:
+                    can_hedge = False
+                continue
+            
+            for future in done:
+                provider, hedged = pending.pop(future)
+                result = self._settle(provider, hedged, ip, future)
+                if result:
+                    return result
+            
+            # 已发出的请求都失败了，立即换下一个API（不消耗对冲预算）
+            if not pending and next_index < len(candidates):
+                launch(False)
+        
+        logger.warning(f"所有API查询失败: {ip}")
+        return None
+    
+    def query_batch(self, ips: Iterable[str], max_workers: int = 5) -> Dict[str, Optional[Dict]]:
+        """
+        批量查询IP信息（同步接口）
+        
+        先按顺序把IP分块交给支持批量接口的API（一次请求查询一块），
+        批量接口未能解析的IP再并发地逐个走单IP轮询。
+        安装了aiohttp时在一个事件循环上执行（见query_many_async），否则使用线程池。
+        
+        Args:
+            ips: IP地址列表
+            max_workers: 没有aiohttp时单IP查询的并发线程数
+            
+        Returns:
+            {IP: 位置信息或None}
+        """
+        if AIOHTTP_AVAILABLE:
+            return run_sync(self.query_many_async(ips))
+        
+        remaining = list(dict.fromkeys(ips))
+        results: Dict[str, Optional[Dict]] = {}
+        
+        for provider, _ in self.providers:
+            if not remaining:
+                break
+            if not provider.supports_batch:
+                continue
+            
+            for i in range(0, len(remaining), provider.batch_size):
+                if not self._is_api_available(provider, batch=True):
+                    logger.debug(f"跳过不可用的批量API: {provider.name}")
+                    break
+                
+                chunk = remaining[i:i + provider.batch_size]
+                try:
+                    chunk_results = provider.query_batch(chunk)
+                except RateLimitExceeded as e:
+                    logger.debug(f"批量API限流，剩余IP换用其他API: {e}")
+                    break
+                except Exception as e:
+                    logger.error(f"批量API查询异常: {provider.name}, {len(chunk)} 个IP, {e}")
+                    chunk_results = None
+                results.update(self._settle_batch(provider, chunk, chunk_results))
+            
+            remaining = [ip for ip in remaining if ip not in results]
+        
+        # 剩余的IP逐个查询
+        if remaining:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(remaining)))) as executor:
+                results.update(zip(remaining, executor.map(self.query, remaining)))
+        
+        # 按本批的耗时、成功率和剩余额度重新排序
+        if self.dynamic_ranking:
+            self.rerank()
+        return results
+    
+    def _settle_batch(self, provider: BaseAPIProvider, chunk: List[str],
+                      chunk_results: Optional[Dict[str, Optional[Dict]]]) -> Dict[str, Dict]:
+        """处理一块批量查询的结果，返回解析成功的IP"""
+        if not chunk_results or not any(chunk_results.values()):
+            self._mark_api_failure(provider)
+            return {}
+        
+        self._mark_api_success(provider)
+        found = {ip: result for ip, result in chunk_results.items() if result}
+        logger.info(f"批量API查询成功: {provider.name}, {len(found)}/{len(chunk)} 个IP")
+        return found
+    
+    async def query_async(self, ip: str) -> Optional[Dict]:
+        """
+        异步轮询查询单个IP（规则与query相同）
+        
+        Args:
+            ip: IP地址
+            
+        Returns:
+            位置信息字典，失败返回None
+        """
+        return (await self.query_many_async([ip]))[ip]
+    
+    async def query_many_async(self, ips: Iterable[str], concurrency: Optional[int] = None) -> Dict[str, Optional[Dict]]:
+        """
+        在一个事件循环上批量查询IP信息
+        
+        先按顺序把IP分块交给支持批量接口的API，剩余的IP作为协程并发地逐个轮询（含对冲）。
+        同时进行的查询总数不超过concurrency，每个API的并发数不超过其max_concurrency，
+        请求额度仍由各API共享的令牌桶控制。
+        
+        Args:
+            ips: IP地址列表
+            concurrency: 同时进行的单IP查询数，默认为async_concurrency
+            
+        Returns:
+            {IP: 位置信息或None}
+        """
+        concurrency = concurrency or self.async_concurrency
+        remaining = list(dict.fromkeys(ips))
+        results: Dict[str, Optional[Dict]] = {}
+        
+        async with AsyncHTTPClient(limit=concurrency) as http:
+            context = _AsyncQueryContext(http, [provider for provider, _ in self.providers])
+            try:
+                for provider, _ in self.providers:
+                    if not remaining:
+                        break
+                    if not provider.supports_batch:
+                        continue
+                    
+                    for i in range(0, len(remaining), provider.batch_size):
+                        if not self._is_api_available(provider, batch=True):
+                            logger.debug(f"跳过不可用的批量API: {provider.name}")
+                            break
+                        
+                        chunk = remaining[i:i + provider.batch_size]
+                        try:
+                            chunk_results = await provider.query_batch_async(chunk, http)
+                        except RateLimitExceeded as e:
+                            logger.debug(f"批量API限流，剩余IP换用其他API: {e}")
+                            break
+                        except Exception as e:
+                            logger.error(f"批量API查询异常: {provider.name}, {len(chunk)} 个IP, {e}")
+                            chunk_results = None
+                        results.update(self._settle_batch(provider, chunk, chunk_results))
+                    
+                    remaining = [ip for ip in remaining if ip not in results]
+                
+                # 剩余的IP作为协程逐个查询
+                gate = asyncio.Semaphore(concurrency)
+                
+                async def query_one(ip: str) -> Optional[Dict]:
+                    async with gate:
+                        return await self._query_one_async(ip, context)
+                
+                results.update(zip(remaining, await asyncio.gather(*(query_one(ip) for ip in remaining))))
+            finally:
+                await context.close()
+        
+        # 按本批的耗时、成功率和剩余额度重新排序
+        if self.dynamic_ranking:
+            self.rerank()
+        return results
+    
+    async def _query_one_async(self, ip: str, context: '_AsyncQueryContext') -> Optional[Dict]:
+        """异步轮询查询单个IP（对冲规则与_query_hedged相同，未启用对冲时依次尝试）"""
+        self._maybe_rerank()
+        candidates = self._hedge_candidates(ip)
+        pending = {}  # {Task: (provider, 是否为对冲请求)}
+        next_index = 0
+        can_hedge = self.hedge
+        
+        def launch(hedged: bool):
+            nonlocal next_index
+            provider = candidates[next_index]
+            next_index += 1
+            pending[context.spawn(context.call(provider, ip))] = (provider, hedged)
+        
+        if candidates:
+            launch(False)
+        while pending:
+            timeout = None
+            if can_hedge and next_index < len(candidates):
+                timeout = self._hedge_delay(candidates[next_index - 1])
+            
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            
+            if not done:
+                if self._try_hedge(candidates[next_index], ip):
+                    launch(True)
+                else:
+                    can_hedge = False
+                continue
+            
+            for task in done:
+                provider, hedged = pending.pop(task)
+                result = self._settle(provider, hedged, ip, task)
+                if result:
+                    return result
+            
+            if not pending and next_index < len(candidates):
+                launch(False)
+        
+        logger.warning(f"所有API查询失败: {ip}")
+        return None
+    
+    def _is_api_available(self, provider: BaseAPIProvider, batch: bool = False) -> bool:
+        """检查API（或其批量接口）是否可用"""
         # 检查Provider自身状态
-        if not provider.is_available():
+        if not (provider.is_batch_available() if batch else provider.is_available()):
             return False
         
         # 检查状态缓存
-        if provider.name in self.api_status:
-            status = self.api_status[provider.name]
+        with self._status_lock:
+            status = self.api_status.get(provider.name)
             
             # 检查是否在禁用期
-            if not status['enabled']:
+            if status and not status['enabled']:
                 if time.time() < status['disabled_until']:
                     return False
                 else:
@@ -504,25 +1261,26 @@ class APIManager:
     
     def _mark_api_success(self, provider: BaseAPIProvider):
         """标记API成功"""
-        if provider.name in self.api_status:
-            status = self.api_status[provider.name]
-            status['failure_count'] = 0
-            status['enabled'] = True
+        with self._status_lock:
+            status = self.api_status.get(provider.name)
+            if status:
+                status['failure_count'] = 0
+                status['enabled'] = True
     
     def _mark_api_failure(self, provider: BaseAPIProvider):
         """标记API失败"""
-        if provider.name not in self.api_status:
-            self.api_status[provider.name] = {
+        with self._status_lock:
+            status = self.api_status.setdefault(provider.name, {
                 'enabled': True,
                 'failure_count': 0,
                 'disabled_until': 0
-            }
-        
-        status = self.api_status[provider.name]
-        status['failure_count'] += 1
-        
-        # 连续失败达到阈值，禁用API
-        if status['failure_count'] >= self.disable_threshold:
+            })
+            status['failure_count'] += 1
+            
+            # 连续失败达到阈值，禁用API（只在启用状态下触发一次）
+            if not status['enabled'] or status['failure_count'] < self.disable_threshold:
+                return
+            
             status['enabled'] = False
             status['disabled_until'] = time.time() + self.disable_duration
             logger.warning(
@@ -538,20 +1296,35 @@ class APIManager:
             统计信息字典
         """
         stats = {}
-        for provider, priority in self.providers:
-            stats[provider.name] = provider.get_stats()
+        for rank, (provider, priority) in enumerate(self.providers, 1):
+            stats[provider.name] = dict(
+                provider.get_stats(),
+                priority=priority,
+                rank=rank,
+                score=round(self.score(provider), 3),
+                pinned=provider.name in self.pinned
+            )
         return stats
     
+    def get_hedge_stats(self) -> Dict:
+        """
+        获取对冲请求统计
+        
+        Returns:
+            {'queries', 'hedged', 'hedge_wins', 'budget_exhausted'}
+        """
+        return self.hedge_stats.snapshot()
+    
     def health_check(self):
         """健康检查 - 重置长时间禁用的API"""
         now = time.time()
         
-        for provider, _ in self.providers:
-            if provider.name in self.api_status:
-                status = self.api_status[provider.name]
+        with self._status_lock:
+            for provider, _ in self.providers:
+                status = self.api_status.get(provider.name)
                 
                 # 如果禁用时间已过，重新启用
-                if not status['enabled'] and now >= status['disabled_until']:
+                if status and not status['enabled'] and now >= status['disabled_until']:
                     status['enabled'] = True
                     status['failure_count'] = 0
                     logger.info(f"健康检查: API重新启用 - {provider.name}")
\ No newline at end of file
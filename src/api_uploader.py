@@ -8,6 +8,7 @@
 import requests
 import json
 from typing import List, Dict, Optional
+from .http_client import get_http_client
 from .config import (
     SUBSCRIPTION_API_URL,
     SUBSCRIPTION_API_PATH,
@@ -36,6 +37,7 @@ class APIUploader:
         
         # 构建完整的API端点
         self.api_endpoint = f"{self.api_url.rstrip('/')}{self.api_path}/api/preferred-ips"
+        self.http = get_http_client()
         
         print(f"[API上传器] 初始化完成")
         print(f"[API上传器] API端点: {self.api_endpoint}")
@@ -49,7 +51,7 @@ class APIUploader:
         """
         try:
             print(f"[API上传器] 正在获取当前优选IP列表...")
-            response = requests.get(
+            response = self.http.get(
                 self.api_endpoint,
                 timeout=API_TIMEOUT
             )
@@ -103,7 +105,7 @@ class APIUploader:
         try:
             print(f"[API上传器] 正在上传 {len(ips)} 个优选IP...")
             
-            response = requests.post(
+            response = self.http.post(
                 self.api_endpoint,
                 json=ips,
                 headers={'Content-Type': 'application/json'},
@@ -184,7 +186,7 @@ class APIUploader:
         try:
             print(f"[API上传器] 正在删除 {ip}:{port}...")
             
-            response = requests.delete(
+            response = self.http.delete(
                 self.api_endpoint,
                 json={'ip': ip, 'port': port},
                 headers={'Content-Type': 'application/json'},
@@ -217,7 +219,7 @@ class APIUploader:
         try:
             print(f"[API上传器] 正在清空所有优选IP...")
             
-            response = requests.delete(
+            response = self.http.delete(
                 self.api_endpoint,
                 json={'all': True},
                 headers={'Content-Type': 'application/json'},
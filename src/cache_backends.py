@@ -0,0 +1,720 @@
+"""
+缓存存储后端模块
+为检测缓存提供可替换的持久化存储：每条记录一个JSON文件、单文件SQLite数据库，
+或多个服务副本共享的Redis（网络键值存储）
+"""
+
+import ssl
+import json
+import time
+import heapq
+import socket
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(ABC):
+    """缓存存储后端基类，记录为 (值字典, 过期时间戳)"""
+
+    name = 'base'
+    # 是否由多个进程/副本共享（共享存储中的记录可能被其他副本修改，不能只依赖本地副本）
+    shared = False
+
+    @abstractmethod
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        """
+        批量读取记录
+
+        Args:
+            keys: 缓存键列表
+
+        Returns:
+            键到记录值的映射（不存在的键不出现在结果中）
+        """
+        pass
+
+    @abstractmethod
+    def set_many(self, records: Dict[str, Tuple[Dict, float]]):
+        """
+        批量写入记录
+
+        Args:
+            records: 键到 (记录值, 过期时间戳) 的映射
+        """
+        pass
+
+    @abstractmethod
+    def delete_many(self, keys: Iterable[str]):
+        """批量删除记录"""
+        pass
+
+    @abstractmethod
+    def clear(self):
+        """清除全部记录"""
+        pass
+
+    @abstractmethod
+    def scan(self) -> Iterator[Tuple[str, Dict]]:
+        """遍历全部记录，产出 (键, 记录值)"""
+        pass
+
+    @abstractmethod
+    def scan_records(self) -> Iterator[Tuple[str, Dict, float]]:
+        """遍历全部记录，产出 (键, 记录值, 过期时间戳)"""
+        pass
+
+    @abstractmethod
+    def delete_expired(self, now: Optional[float] = None) -> int:
+        """
+        删除已过期的记录
+
+        Returns:
+            删除的记录数
+        """
+        pass
+
+    @abstractmethod
+    def count(self) -> int:
+        """存储的记录总数"""
+        pass
+
+    def compact(self, limit: int, now: Optional[float] = None) -> Tuple[int, int]:
+        """
+        增量清理：按过期时间从早到晚删除最多limit条已过期的记录
+
+        默认实现退化为一次完整的delete_expired，子类应按过期时间索引实现有界清理
+
+        Args:
+            limit: 本次最多删除的记录数
+            now: 当前时间戳
+
+        Returns:
+            (删除的记录数, 回收的近似字节数)
+        """
+        return self.delete_expired(now), 0
+
+    def oldest_expiry(self) -> Optional[float]:
+        """最早的过期时间戳（没有记录或不支持时返回None）"""
+        return None
+
+    def get(self, key: str) -> Optional[Dict]:
+        """读取单条记录"""
+        return self.get_many([key]).get(key)
+
+    def set(self, key: str, value: Dict, expires_at: float):
+        """写入单条记录"""
+        self.set_many({key: (value, expires_at)})
+
+    @contextmanager
+    def transaction(self):
+        """事务上下文（默认无事务语义）"""
+        yield
+
+    def close(self):
+        """释放资源"""
+        pass
+
+
+class JSONFileBackend(CacheBackend):
+    """每条记录一个JSON文件的存储后端（旧版格式）"""
+
+    name = 'json'
+
+    def __init__(self, cache_dir: str = 'cache/ip_detection'):
+        """
+        初始化JSON文件后端
+
+        Args:
+            cache_dir: 缓存目录
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # 过期时间索引：{键: 过期时间} + 按过期时间排序的小顶堆 [(过期时间, 键)]
+        # 本进程写入的记录直接入索引，已有文件由compact每次分批读取补齐
+        self._expiry: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._unindexed: Optional[Iterator[Path]] = None
+        self._index_complete = False
+        self._index_lock = threading.Lock()
+
+    def _index(self, key: str, expires_at: float):
+        """记录键的过期时间（调用方需持有索引锁）"""
+        self._expiry[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key))
+
+    def _get_file(self, key: str) -> Path:
+        """获取记录文件路径"""
+        # 使用键作为文件名，避免特殊字符
+        safe_key = key.replace('.', '_').replace(':', '_').replace('/', '_')
+        return self.cache_dir / f"{safe_key}.json"
+
+    def _read_file(self, cache_file: Path) -> Optional[Dict]:
+        """读取记录文件，失败返回None"""
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.debug(f"读取缓存文件失败: {cache_file}, {e}")
+            return None
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        results = {}
+        for key in keys:
+            cache_file = self._get_file(key)
+            if cache_file.exists():
+                value = self._read_file(cache_file)
+                if value is not None:
+                    results[key] = value
+
+        return results
+
+    def set_many(self, records: Dict[str, Tuple[Dict, float]]):
+        for key, (value, expires_at) in records.items():
+            cache_file = self._get_file(key)
+            try:
+                with open(cache_file, 'w', encoding='utf-8') as f:
+                    json.dump(dict(value, _key=key, _expires_at=expires_at), f, ensure_ascii=False, indent=2)
+            except Exception as e:
+                logger.error(f"保存缓存文件失败: {cache_file}, {e}")
+                continue
+
+            with self._index_lock:
+                self._index(key, expires_at)
+
+    def delete_many(self, keys: Iterable[str]):
+        for key in keys:
+            try:
+                self._get_file(key).unlink()
+            except FileNotFoundError:
+                pass
+            with self._index_lock:
+                self._expiry.pop(key, None)
+
+    def clear(self):
+        for cache_file in self.cache_dir.glob("*.json"):
+            cache_file.unlink()
+
+        with self._index_lock:
+            self._expiry.clear()
+            self._heap = []
+            self._unindexed = None
+            self._index_complete = True
+
+    def scan(self) -> Iterator[Tuple[str, Dict]]:
+        for cache_file in self.cache_dir.glob("*.json"):
+            value = self._read_file(cache_file)
+            if value is not None and '_key' in value:
+                yield value['_key'], value
+
+    def scan_records(self) -> Iterator[Tuple[str, Dict, float]]:
+        for key, value in self.scan():
+            expires_at = value.get('_expires_at', 0.0)
+            value = {k: v for k, v in value.items() if k not in ('_key', '_expires_at')}
+            yield key, value, expires_at
+
+    def delete_expired(self, now: Optional[float] = None) -> int:
+        now = now or time.time()
+        deleted = 0
+        expiry = {}
+
+        # 完整扫描时顺便重建过期时间索引
+        for cache_file in self.cache_dir.glob("*.json"):
+            value = self._read_file(cache_file)
+            if value is None or '_key' not in value:
+                continue
+            expires_at = value.get('_expires_at', now)
+            if expires_at < now:
+                cache_file.unlink()
+                deleted += 1
+            else:
+                expiry[value['_key']] = expires_at
+
+        with self._index_lock:
+            self._expiry = expiry
+            self._heap = [(expires_at, key) for key, expires_at in expiry.items()]
+            heapq.heapify(self._heap)
+            self._unindexed = None
+            self._index_complete = True
+
+        return deleted
+
+    def _index_some(self, limit: int):
+        """读取最多limit个尚未进入索引的文件（调用方需持有索引锁）"""
+        if self._index_complete:
+            return
+        if self._unindexed is None:
+            self._unindexed = self.cache_dir.glob("*.json")
+
+        for _ in range(limit):
+            cache_file = next(self._unindexed, None)
+            if cache_file is None:
+                self._unindexed = None
+                self._index_complete = True
+                return
+
+            value = self._read_file(cache_file)
+            if value is not None and '_key' in value and value['_key'] not in self._expiry:
+                self._index(value['_key'], value.get('_expires_at', 0.0))
+
+    def compact(self, limit: int, now: Optional[float] = None) -> Tuple[int, int]:
+        now = now or time.time()
+        deleted = 0
+        reclaimed = 0
+
+        with self._index_lock:
+            self._index_some(limit)
+
+            while self._heap and deleted < limit and self._heap[0][0] < now:
+                expires_at, key = heapq.heappop(self._heap)
+                # 记录被重写后堆中会留下旧的过期时间，跳过
+                if self._expiry.get(key) != expires_at:
+                    continue
+
+                del self._expiry[key]
+                cache_file = self._get_file(key)
+                try:
+                    reclaimed += cache_file.stat().st_size
+                    cache_file.unlink()
+                except FileNotFoundError:
+                    continue
+                deleted += 1
+
+        return deleted, reclaimed
+
+    def oldest_expiry(self) -> Optional[float]:
+        with self._index_lock:
+            # 索引尚未建立完成时，未读取的文件可能已过期
+            if not self._index_complete:
+                return 0.0
+            while self._heap and self._expiry.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def count(self) -> int:
+        return sum(1 for _ in self.cache_dir.glob("*.json"))
+
+
+class SQLiteBackend(CacheBackend):
+    """单文件SQLite存储后端（WAL模式，过期时间带索引）"""
+
+    name = 'sqlite'
+
+    def __init__(self, db_path: str = 'cache/ip_detection.db', table: str = 'detection_cache'):
+        """
+        初始化SQLite后端
+
+        Args:
+            db_path: 数据库文件路径
+            table: 表名
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+
+        # 单连接 + 可重入锁：多线程共享，事务期间独占
+        self._lock = threading.RLock()
+        self._tx_depth = 0
+        self._conn = sqlite3.connect(
+            str(self.db_path),
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=30
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table} ('
+            f'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_{self.table}_expires_at ON {self.table}(expires_at)'
+        )
+
+    @contextmanager
+    def transaction(self):
+        """事务上下文，可嵌套，只有最外层提交"""
+        with self._lock:
+            if self._tx_depth == 0:
+                self._conn.execute('BEGIN')
+            self._tx_depth += 1
+
+            try:
+                yield
+            except Exception:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    self._conn.execute('ROLLBACK')
+                raise
+            else:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    self._conn.execute('COMMIT')
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        keys = list(keys)
+        results = {}
+
+        # SQLite单条语句参数数量有限，分块查询
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f'SELECT key, value FROM {self.table} WHERE key IN ({placeholders})',
+                    chunk
+                ).fetchall()
+
+                for key, value in rows:
+                    try:
+                        results[key] = json.loads(value)
+                    except ValueError as e:
+                        logger.debug(f"缓存记录解析失败: {key}, {e}")
+
+        return results
+
+    def set_many(self, records: Dict[str, Tuple[Dict, float]]):
+        if not records:
+            return
+
+        rows = [
+            (key, json.dumps(value, ensure_ascii=False), expires_at)
+            for key, (value, expires_at) in records.items()
+        ]
+        with self.transaction():
+            self._conn.executemany(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)',
+                rows
+            )
+
+    def delete_many(self, keys: Iterable[str]):
+        with self.transaction():
+            self._conn.executemany(
+                f'DELETE FROM {self.table} WHERE key = ?',
+                [(key,) for key in keys]
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f'DELETE FROM {self.table}')
+
+    def scan(self) -> Iterator[Tuple[str, Dict]]:
+        with self._lock:
+            rows = self._conn.execute(f'SELECT key, value FROM {self.table}').fetchall()
+
+        for key, value in rows:
+            try:
+                yield key, json.loads(value)
+            except ValueError as e:
+                logger.debug(f"缓存记录解析失败: {key}, {e}")
+
+    def scan_records(self) -> Iterator[Tuple[str, Dict, float]]:
+        with self._lock:
+            rows = self._conn.execute(f'SELECT key, value, expires_at FROM {self.table}').fetchall()
+
+        for key, value, expires_at in rows:
+            try:
+                yield key, json.loads(value), expires_at
+            except ValueError as e:
+                logger.debug(f"缓存记录解析失败: {key}, {e}")
+
+    def delete_expired(self, now: Optional[float] = None) -> int:
+        now = now or time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                f'DELETE FROM {self.table} WHERE expires_at < ?',
+                (now,)
+            )
+            return cursor.rowcount
+
+    def compact(self, limit: int, now: Optional[float] = None) -> Tuple[int, int]:
+        now = now or time.time()
+        with self.transaction():
+            # 沿过期时间索引只取最早过期的limit条，代价与表大小无关
+            rows = self._conn.execute(
+                f'SELECT key, length(key) + length(CAST(value AS BLOB)) FROM {self.table} '
+                f'WHERE expires_at < ? ORDER BY expires_at LIMIT ?',
+                (now, limit)
+            ).fetchall()
+            self._conn.executemany(
+                f'DELETE FROM {self.table} WHERE key = ?',
+                [(key,) for key, _ in rows]
+            )
+
+        return len(rows), sum(size for _, size in rows)
+
+    def oldest_expiry(self) -> Optional[float]:
+        with self._lock:
+            return self._conn.execute(f'SELECT MIN(expires_at) FROM {self.table}').fetchone()[0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisError(Exception):
+    """Redis返回的错误"""
+    pass
+
+
+class RedisBackend(CacheBackend):
+    """
+    Redis存储后端，多个服务副本共享检测结果和失败记录
+
+    使用内置的精简RESP客户端（无需额外依赖）。每条记录一个键
+    （命名空间:表名:键），值为JSON，过期由Redis按键TTL自动删除；
+    批量读写在一次网络往返内完成（MGET / 管道化的SET、DEL）。
+    """
+
+    name = 'redis'
+    shared = True
+
+    # 单次批量命令的最大键数
+    CHUNK_SIZE = 500
+
+    def __init__(self, url: str, table: str = 'detection_cache', namespace: str = 'cf-ip',
+                 timeout: float = 5.0):
+        """
+        初始化Redis后端
+
+        Args:
+            url: 连接地址，redis://[[用户名]:密码@]主机[:端口][/库号]，rediss:// 使用TLS
+            table: 表名（作为键前缀的一部分，同一Redis可存放多类记录）
+            namespace: 键命名空间
+            timeout: 连接和读写超时（秒）
+        """
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.tls = parsed.scheme == 'rediss'
+        self.timeout = timeout
+        self.table = table
+        self.prefix = f"{namespace}:{table}:"
+
+        # 单连接，命令按管道整批发送、整批读取，多线程共享时串行
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+
+    # ---- RESP协议 ----
+
+    def _connect(self):
+        """建立连接并完成认证和选库"""
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if self.tls:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        self._sock = sock
+        self._reader = sock.makefile('rb')
+
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.username, self.password) if self.username else ('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        for reply in self._send(setup):
+            if isinstance(reply, RedisError):
+                self._disconnect()
+                raise reply
+
+    def _disconnect(self):
+        """关闭连接"""
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    @staticmethod
+    def _encode(command: Tuple) -> bytes:
+        """编码一条命令"""
+        parts = [f"*{len(command)}\r\n".encode()]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(f"${len(data)}\r\n".encode())
+            parts.append(data)
+            parts.append(b"\r\n")
+        return b''.join(parts)
+
+    def _read_reply(self):
+        """读取一条回复（错误回复以RedisError对象返回）"""
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis连接已关闭")
+
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            return RedisError(payload.decode('utf-8'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"无法解析的Redis回复: {line[:32]!r}")
+
+    def _send(self, commands: List[Tuple]) -> List:
+        """发送一批命令并读取全部回复（调用方需持有锁）"""
+        if not commands:
+            return []
+        self._sock.sendall(b''.join(self._encode(command) for command in commands))
+        return [self._read_reply() for _ in commands]
+
+    def _pipeline(self, commands: List[Tuple]) -> List:
+        """
+        在一次网络往返内执行一批命令，连接断开时重连并重试一次
+
+        Returns:
+            各命令的回复（错误回复为RedisError对象）
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._send(commands)
+                except (OSError, ConnectionError):
+                    self._disconnect()
+                    if attempt:
+                        raise
+
+    def _execute(self, *command):
+        """执行单条命令，错误回复抛出RedisError"""
+        reply = self._pipeline([command])[0]
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    # ---- 存储接口 ----
+
+    def _decode(self, key: str, raw: Optional[str]) -> Optional[Tuple[Dict, float]]:
+        """解析存储的值，返回 (记录值, 过期时间戳)"""
+        if raw is None:
+            return None
+        try:
+            stored = json.loads(raw)
+            return stored['value'], stored['expires_at']
+        except (ValueError, KeyError, TypeError) as e:
+            logger.debug(f"缓存记录解析失败: {key}, {e}")
+            return None
+
+    def _get_records(self, keys: List[str]) -> Iterator[Tuple[str, Dict, float]]:
+        """分块MGET读取记录"""
+        for i in range(0, len(keys), self.CHUNK_SIZE):
+            chunk = keys[i:i + self.CHUNK_SIZE]
+            values = self._execute('MGET', *(self.prefix + key for key in chunk))
+            for key, raw in zip(chunk, values):
+                record = self._decode(key, raw)
+                if record is not None:
+                    yield key, record[0], record[1]
+
+    def _scan_keys(self) -> List[str]:
+        """遍历本表的全部键（SCAN，不阻塞Redis）"""
+        keys = []
+        cursor = '0'
+        while True:
+            cursor, batch = self._execute('SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 1000)
+            keys.extend(key[len(self.prefix):] for key in batch)
+            if cursor == '0':
+                return keys
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        return {key: value for key, value, _ in self._get_records(list(keys))}
+
+    def set_many(self, records: Dict[str, Tuple[Dict, float]]):
+        if not records:
+            return
+
+        now = time.time()
+        commands = []
+        for key, (value, expires_at) in records.items():
+            ttl_ms = int((expires_at - now) * 1000)
+            if ttl_ms <= 0:
+                commands.append(('DEL', self.prefix + key))
+                continue
+            payload = json.dumps({'value': value, 'expires_at': expires_at}, ensure_ascii=False)
+            commands.append(('SET', self.prefix + key, payload, 'PX', ttl_ms))
+
+        for i in range(0, len(commands), self.CHUNK_SIZE):
+            for reply in self._pipeline(commands[i:i + self.CHUNK_SIZE]):
+                if isinstance(reply, RedisError):
+                    logger.error(f"保存缓存记录失败: {reply}")
+
+    def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        for i in range(0, len(keys), self.CHUNK_SIZE):
+            self._execute('DEL', *(self.prefix + key for key in keys[i:i + self.CHUNK_SIZE]))
+
+    def clear(self):
+        self.delete_many(self._scan_keys())
+
+    def scan(self) -> Iterator[Tuple[str, Dict]]:
+        for key, value, _ in self._get_records(self._scan_keys()):
+            yield key, value
+
+    def scan_records(self) -> Iterator[Tuple[str, Dict, float]]:
+        return self._get_records(self._scan_keys())
+
+    def delete_expired(self, now: Optional[float] = None) -> int:
+        # 过期记录由Redis按键TTL自动删除
+        return 0
+
+    def count(self) -> int:
+        return len(self._scan_keys())
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+def create_backend(backend: str = 'sqlite', cache_dir: str = 'cache/ip_detection',
+                   db_path: str = 'cache/ip_detection.db', table: str = 'detection_cache') -> CacheBackend:
+    """
+    按名称创建存储后端
+
+    Args:
+        backend: 后端名称 ('sqlite' 或 'json')，或Redis连接地址 (redis://... / rediss://...)
+        cache_dir: JSON文件后端的存储目录
+        db_path: SQLite数据库文件路径
+        table: 表名（同一数据库文件或Redis可存放多类记录）
+
+    Returns:
+        CacheBackend实例
+    """
+    if backend.startswith(('redis://', 'rediss://')):
+        return RedisBackend(backend, table)
+
+    backend = backend.lower()
+    if backend == 'json':
+        return JSONFileBackend(cache_dir)
+
+    if backend != 'sqlite':
+        logger.warning(f"未知的缓存后端: {backend}，使用sqlite")
+
+    return SQLiteBackend(db_path, table)
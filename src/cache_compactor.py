@@ -0,0 +1,137 @@
+"""
+缓存增量清理模块
+每次只清理有限数量的过期记录（按过期时间从早到晚），清理代价不随缓存规模增长，
+可由服务的定时调度器周期调用，也可在每次运行结束时调用一次
+"""
+
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .cache_backends import CacheBackend
+from .concurrency import AtomicCounters
+
+logger = logging.getLogger(__name__)
+
+
+class CacheCompactor:
+    """
+    过期记录增量清理器
+
+    管理多个存储后端，每次tick按各后端最早的过期时间排序，
+    共享batch_size的删除额度，最早过期的存储优先清理。
+    """
+
+    def __init__(self, batch_size: int = 500):
+        """
+        初始化清理器
+
+        Args:
+            batch_size: 每次tick最多删除的记录数
+        """
+        self.batch_size = batch_size
+        self._stores: List[Tuple[str, CacheBackend]] = []
+        self._lock = threading.Lock()
+        self.stats = AtomicCounters({'ticks': 0, 'entries': 0, 'bytes': 0})
+
+    def register(self, name: str, backend: Optional[CacheBackend]):
+        """
+        注册需要清理的存储后端
+
+        Args:
+            name: 存储名称（用于日志和统计）
+            backend: 存储后端，None时忽略
+        """
+        if backend is not None:
+            self._stores.append((name, backend))
+
+    def tick(self, now: Optional[float] = None) -> Dict:
+        """
+        执行一次有界清理
+
+        Args:
+            now: 当前时间戳
+
+        Returns:
+            本次清理结果 {'entries', 'bytes', 'stores', 'oldest_expiry', 'elapsed'}
+        """
+        # 同一时间只有一个tick在运行，调度器和运行结束时的调用不会叠加
+        if not self._lock.acquire(blocking=False):
+            return {'entries': 0, 'bytes': 0, 'stores': {}, 'oldest_expiry': None, 'elapsed': 0.0}
+
+        try:
+            return self._tick(now or time.time())
+        finally:
+            self._lock.release()
+
+    def _tick(self, now: float) -> Dict:
+        start_time = time.time()
+        budget = self.batch_size
+        reclaimed_total = 0
+        per_store = {}
+
+        # 按最早过期时间排序，过期最久的存储先清理
+        due = []
+        for name, backend in self._stores:
+            try:
+                oldest = backend.oldest_expiry()
+            except Exception as e:
+                logger.error(f"读取缓存过期索引失败: {name}, {e}")
+                continue
+            if oldest is not None and oldest < now:
+                due.append((oldest, name, backend))
+        due.sort(key=lambda item: item[0])
+
+        for _, name, backend in due:
+            if budget <= 0:
+                break
+            try:
+                entries, reclaimed = backend.compact(budget, now)
+            except Exception as e:
+                logger.error(f"增量清理缓存失败: {name}, {e}")
+                continue
+            if entries:
+                per_store[name] = entries
+            budget -= entries
+            reclaimed_total += reclaimed
+
+        entries = self.batch_size - budget
+        self.stats.incr('ticks')
+        self.stats.incr('entries', entries)
+        self.stats.incr('bytes', reclaimed_total)
+
+        result = {
+            'entries': entries,
+            'bytes': reclaimed_total,
+            'stores': per_store,
+            'oldest_expiry': self.oldest_expiry(),
+            'elapsed': time.time() - start_time
+        }
+        if entries:
+            logger.info(
+                f"增量清理过期缓存: {entries} 条, {reclaimed_total / 1024:.1f}KB, "
+                f"{per_store}, 耗时 {result['elapsed'] * 1000:.0f}毫秒"
+            )
+        return result
+
+    def oldest_expiry(self) -> Optional[float]:
+        """所有存储中最早的过期时间戳"""
+        expiries = []
+        for _, backend in self._stores:
+            try:
+                oldest = backend.oldest_expiry()
+            except Exception:
+                continue
+            if oldest is not None:
+                expiries.append(oldest)
+        return min(expiries) if expiries else None
+
+    def get_stats(self) -> Dict:
+        """
+        获取累计统计信息
+
+        Returns:
+            统计信息字典
+        """
+        return self.stats.snapshot()
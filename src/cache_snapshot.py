@@ -0,0 +1,218 @@
+"""
+缓存快照模块
+将检测缓存、失败记录、端点历史和Cloudflare IP段缓存导出为一个压缩的版本化快照文件，
+并在启动时恢复，供每次都从空 cache/ 目录启动的CI环境（GitHub Actions）预热缓存
+
+用法:
+    python -m src.cache_snapshot export cache/snapshot.json.gz
+    python -m src.cache_snapshot import cache/snapshot.json.gz
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 'cf-ip-cache-snapshot'
+SNAPSHOT_VERSION = 1
+
+
+def _section_stores(detector) -> Dict:
+    """快照分区对应的存储对象（未启用的分区为None）"""
+    return {
+        'detection': detector.cache if detector.cache.enabled else None,
+        'failures': detector.failure_cache,
+        'history': detector.cache.history
+    }
+
+
+def export_snapshot(path: str, detector=None) -> Dict[str, int]:
+    """
+    导出缓存快照
+
+    Args:
+        path: 快照文件路径（gzip压缩的JSON）
+        detector: IPDetectorV2实例，None则使用全局检测器
+
+    Returns:
+        各分区导出的记录数
+    """
+    from .cf_ranges import get_range_provider
+
+    if detector is None:
+        from .ip_detector_v2 import get_detector
+        detector = get_detector()
+
+    start_time = time.time()
+    sections = {}
+    counts = {}
+
+    for name, store in _section_stores(detector).items():
+        records = store.export_records() if store else []
+        sections[name] = [[key, value, expires_at] for key, value, expires_at in records]
+        counts[name] = len(records)
+
+    cf_ranges = get_range_provider().export_state()
+    if cf_ranges:
+        sections['cf_ranges'] = cf_ranges
+    counts['cf_ranges'] = 1 if cf_ranges else 0
+
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created_at': time.time(),
+        'sections': sections
+    }
+
+    # 先写临时文件再替换，避免中断时留下损坏的快照
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + '.tmp')
+    with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(temp_path, path)
+
+    logger.info(
+        f"缓存快照已导出: {path} ({path.stat().st_size / 1024:.1f}KB, "
+        f"耗时 {time.time() - start_time:.2f}秒), {counts}"
+    )
+    return counts
+
+
+def load_snapshot(path: str) -> Optional[Dict]:
+    """
+    读取并校验快照文件
+
+    Args:
+        path: 快照文件路径
+
+    Returns:
+        快照内容，文件不存在或无效返回None
+    """
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"缓存快照无法读取: {path}, {e}")
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT:
+        logger.warning(f"不是有效的缓存快照: {path}")
+        return None
+
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        logger.warning(f"不支持的缓存快照版本: {snapshot.get('version')}（当前 {SNAPSHOT_VERSION}）")
+        return None
+
+    if not isinstance(snapshot.get('sections'), dict):
+        logger.warning(f"缓存快照内容无效: {path}")
+        return None
+
+    return snapshot
+
+
+def _valid_records(records) -> Tuple[List[Tuple[str, Dict, float]], int]:
+    """过滤结构无效和已过期的记录，返回 (有效记录, 丢弃数)"""
+    if not isinstance(records, list):
+        return [], 0
+
+    now = time.time()
+    valid = []
+    for record in records:
+        if (
+            isinstance(record, list) and len(record) == 3
+            and isinstance(record[0], str) and isinstance(record[1], dict)
+            and isinstance(record[2], (int, float)) and record[2] >= now
+        ):
+            valid.append((record[0], record[1], record[2]))
+
+    return valid, len(records) - len(valid)
+
+
+def import_snapshot(path: str, detector=None) -> Optional[Dict[str, int]]:
+    """
+    恢复缓存快照：校验后与现有缓存合并，过期记录直接丢弃
+
+    Args:
+        path: 快照文件路径
+        detector: IPDetectorV2实例，None则使用全局检测器
+
+    Returns:
+        各分区导入的记录数，快照不存在或无效返回None
+    """
+    from .cf_ranges import get_range_provider
+
+    snapshot = load_snapshot(path)
+    if snapshot is None:
+        return None
+
+    if detector is None:
+        from .ip_detector_v2 import get_detector
+        detector = get_detector()
+
+    start_time = time.time()
+    sections = snapshot['sections']
+    counts = {}
+    dropped = 0
+
+    for name, store in _section_stores(detector).items():
+        records, invalid = _valid_records(sections.get(name, []))
+        dropped += invalid
+        counts[name] = 0
+
+        if not store or not records:
+            continue
+
+        try:
+            counts[name] = store.import_records(records)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"缓存快照分区无效，已跳过: {name}, {e}")
+
+    cf_ranges = sections.get('cf_ranges')
+    counts['cf_ranges'] = int(isinstance(cf_ranges, dict) and get_range_provider().import_state(cf_ranges))
+
+    age = time.time() - snapshot.get('created_at', 0)
+    logger.info(
+        f"缓存快照已恢复: {path} (快照时间 {age / 3600:.1f} 小时前, "
+        f"耗时 {time.time() - start_time:.2f}秒), 导入 {counts}, 丢弃过期/无效 {dropped} 条"
+    )
+    return counts
+
+
+def main() -> int:
+    """命令行入口"""
+    from .config import get_config
+
+    config = get_config()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ('export', 'import'):
+        print("用法: python -m src.cache_snapshot export|import [快照文件路径]")
+        return 1
+
+    path = sys.argv[2] if len(sys.argv) > 2 else getattr(config, 'cache_snapshot_file', '') or 'cache/snapshot.json.gz'
+
+    from .ip_detector_v2 import close_detector
+    try:
+        if sys.argv[1] == 'export':
+            export_snapshot(path)
+            return 0
+        return 0 if import_snapshot(path) is not None else 1
+    finally:
+        close_detector()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
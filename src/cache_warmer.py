@@ -0,0 +1,222 @@
+"""
+缓存预热模块
+记录数据源每次运行中出现的端点，在两次定时任务之间的空闲时间里，
+逐个重新检测下一次运行可能出现、但缓存结果届时将会过期的端点，
+使定时运行时大部分端点直接命中缓存
+"""
+
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .cache_backends import CacheBackend, create_backend
+
+logger = logging.getLogger(__name__)
+
+
+class SightingLog:
+    """
+    端点出现记录
+
+    每个端点记录出现过的运行次数和最后一次出现的时间。
+    同一端点在run_gap内的多次检测视为同一次运行（定时任务之间间隔数小时）。
+    """
+
+    def __init__(self, retention: int = 7 * 86400, run_gap: int = 3600,
+                 persistent: bool = True, backend: str = 'sqlite',
+                 cache_dir: str = 'cache/ip_detection/sightings',
+                 db_path: str = 'cache/ip_detection.db'):
+        """
+        初始化端点出现记录
+
+        Args:
+            retention: 端点最后一次出现后记录的保留时间（秒）
+            run_gap: 区分两次运行的最短间隔（秒）
+            persistent: 是否持久化
+            backend: 持久化后端 ('sqlite' 或 'json')
+            cache_dir: JSON后端的存储目录
+            db_path: SQLite数据库文件路径（与检测缓存共用，独立的表）
+        """
+        self.retention = retention
+        self.run_gap = run_gap
+
+        self._records = {}  # {ip:port: {'runs': int, 'last_seen': float}}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+        self.backend: Optional[CacheBackend] = None
+        if persistent:
+            self.backend = create_backend(backend, cache_dir=cache_dir, db_path=db_path, table='endpoint_sightings')
+            self._load()
+
+    def _load(self):
+        """从持久化存储加载未过期的出现记录"""
+        try:
+            self.backend.delete_expired()
+            for key, record in self.backend.scan():
+                self._records[key] = {'runs': record['runs'], 'last_seen': record['last_seen']}
+        except Exception as e:
+            logger.error(f"加载端点出现记录失败: {e}")
+
+    def observe(self, ip: str, port: int = 443):
+        """
+        记录端点在本次运行中出现
+
+        Args:
+            ip: IP地址
+            port: 端口号
+        """
+        key = f"{ip}:{port}"
+        now = time.time()
+
+        with self._lock:
+            record = self._records.get(key)
+            if record is None:
+                record = {'runs': 1, 'last_seen': now}
+            elif now - record['last_seen'] >= self.run_gap:
+                record = {'runs': record['runs'] + 1, 'last_seen': now}
+            else:
+                record = dict(record, last_seen=now)
+            self._records[key] = record
+            self._dirty.add(key)
+
+    def recent(self, since: float) -> List[Tuple[str, int, Dict]]:
+        """
+        最近出现过的端点
+
+        Args:
+            since: 只返回在此时间之后出现过的端点
+
+        Returns:
+            [(IP, 端口, 出现记录)] 列表
+        """
+        with self._lock:
+            items = [(key, dict(record)) for key, record in self._records.items() if record['last_seen'] >= since]
+
+        results = []
+        for key, record in items:
+            ip, _, port = key.rpartition(':')
+            results.append((ip, int(port), record))
+        return results
+
+    def flush(self):
+        """将变更的记录写入持久化存储"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            records = {
+                key: (self._records[key], self._records[key]['last_seen'] + self.retention)
+                for key in dirty
+            }
+
+        if not records or not self.backend:
+            return
+
+        try:
+            self.backend.set_many(records)
+        except Exception as e:
+            logger.error(f"保存端点出现记录失败: {len(records)} 条, {e}")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._records)
+
+    def close(self):
+        """写入未保存的变更并关闭存储后端"""
+        self.flush()
+        if self.backend:
+            self.backend.close()
+
+
+class CacheWarmer:
+    """
+    空闲时间缓存预热
+
+    候选端点：最近若干天数据源中出现过、且缓存结果在下一次运行前会过期（或已不在缓存中）的端点。
+    出现次数多的端点优先，同等情况下先过期的优先。每次只预热有限数量，
+    端点之间暂停，并在主任务开始时立即让出，不与定时运行争抢API额度。
+    """
+
+    def __init__(self, detector, batch_size: int = 20, pause: float = 1.0, lookback: int = 3 * 86400):
+        """
+        初始化缓存预热
+
+        Args:
+            detector: IPDetectorV2实例
+            batch_size: 每次预热的最大端点数
+            pause: 两个端点之间的暂停时间（秒）
+            lookback: 只预热在此时间范围内出现过的端点（秒）
+        """
+        self.detector = detector
+        self.batch_size = batch_size
+        self.pause = pause
+        self.lookback = lookback
+
+    def plan(self, until: float) -> List[Tuple[str, int]]:
+        """
+        选出需要预热的端点
+
+        Args:
+            until: 下一次运行的时间戳，缓存结果在此之前过期的端点需要预热
+
+        Returns:
+            按优先级排序的 [(IP, 端口)] 列表
+        """
+        sightings = self.detector.sightings
+        if sightings is None:
+            return []
+
+        candidates = []
+        for ip, port, record in sightings.recent(time.time() - self.lookback):
+            if self.detector.failure_cache.should_skip(ip, port):
+                continue
+            min_tier = self.detector._cache_min_tier(self.detector.is_cloudflare_ip(ip))
+            fresh_until = self.detector.cache.fresh_until(ip, port, min_tier) or 0.0
+            if fresh_until < until:
+                candidates.append((-record['runs'], fresh_until, ip, port))
+
+        candidates.sort()
+        return [(ip, port) for _, _, ip, port in candidates]
+
+    def run(self, until: float, should_stop: Optional[Callable[[], bool]] = None) -> Dict:
+        """
+        预热一批端点
+
+        Args:
+            until: 下一次运行的时间戳
+            should_stop: 返回True时立即停止（如主任务开始运行）
+
+        Returns:
+            {'candidates', 'warmed', 'failed', 'elapsed'}
+        """
+        start_time = time.time()
+        candidates = self.plan(until)
+        warmed = failed = 0
+
+        for i, (ip, port) in enumerate(candidates[:self.batch_size]):
+            if should_stop and should_stop():
+                logger.info("主任务开始运行，停止缓存预热")
+                break
+            if i and self.pause > 0:
+                time.sleep(self.pause)
+
+            if self.detector.warm(ip, port):
+                warmed += 1
+            else:
+                failed += 1
+
+        if self.detector.sightings:
+            self.detector.sightings.flush()
+
+        result = {
+            'candidates': len(candidates),
+            'warmed': warmed,
+            'failed': failed,
+            'elapsed': time.time() - start_time
+        }
+        if candidates:
+            logger.info(
+                f"缓存预热: 预热 {warmed} 个, 失败 {failed} 个, "
+                f"剩余待预热 {len(candidates) - warmed - failed} 个, 耗时 {result['elapsed']:.1f}秒"
+            )
+        return result
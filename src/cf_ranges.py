@@ -0,0 +1,479 @@
+"""
+Cloudflare IP段索引模块
+将Cloudflare官方IP段预编译为有序整数区间，使用二分查找判断IP归属
+支持从官方地址定时刷新IP段列表，并持久化到本地文件
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+import ipaddress
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+# Cloudflare官方IPv4段（https://www.cloudflare.com/ips-v4）
+CLOUDFLARE_IPV4_RANGES = [
+    '173.245.48.0/20',
+    '103.21.244.0/22',
+    '103.22.200.0/22',
+    '103.31.4.0/22',
+    '141.101.64.0/18',
+    '108.162.192.0/18',
+    '190.93.240.0/20',
+    '188.114.96.0/20',
+    '197.234.240.0/22',
+    '198.41.128.0/17',
+    '162.158.0.0/15',
+    '104.16.0.0/13',
+    '104.24.0.0/14',
+    '172.64.0.0/13',
+    '131.0.72.0/22',
+]
+
+# 不在官方列表中、但历史检测器按104.16.0.0/12归为Cloudflare的IPv4段（WARP等）
+# 单独维护，每次构建索引（包括远程刷新后）都会并入，保证这些IP的归类不随刷新改变
+LEGACY_IPV4_RANGES = [
+    '104.28.0.0/14',
+]
+
+# Cloudflare官方IPv6段（https://www.cloudflare.com/ips-v6）
+CLOUDFLARE_IPV6_RANGES = [
+    '2400:cb00::/32',
+    '2606:4700::/32',
+    '2803:f800::/32',
+    '2405:b500::/32',
+    '2405:8100::/32',
+    '2a06:98c0::/29',
+    '2c0f:f248::/32',
+]
+
+
+def _compile_intervals(cidrs: Iterable[str], version: int) -> Tuple[List[int], List[int]]:
+    """
+    将CIDR列表编译为合并后的有序整数区间
+
+    Args:
+        cidrs: CIDR字符串列表
+        version: IP版本（4或6）
+
+    Returns:
+        (区间起点列表, 区间终点列表)，两者一一对应且按起点升序
+    """
+    intervals = []
+    for cidr in cidrs:
+        try:
+            network = ipaddress.ip_network(cidr.strip(), strict=False)
+        except ValueError:
+            logger.warning(f"无效的Cloudflare IP段: {cidr}")
+            continue
+
+        if network.version != version:
+            continue
+
+        intervals.append((int(network.network_address), int(network.broadcast_address)))
+
+    intervals.sort()
+
+    # 合并重叠或相邻的区间
+    starts: List[int] = []
+    ends: List[int] = []
+    for start, end in intervals:
+        if ends and start <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+
+    return starts, ends
+
+
+class CloudflareRangeIndex:
+    """Cloudflare IP段索引 - 构建后只读，可在多线程间共享（始终包含LEGACY_IPV4_RANGES）"""
+
+    def __init__(self, ipv4_ranges: Optional[Iterable[str]] = None,
+                 ipv6_ranges: Optional[Iterable[str]] = None):
+        """
+        初始化索引
+
+        Args:
+            ipv4_ranges: IPv4 CIDR列表，None则使用内置列表
+            ipv6_ranges: IPv6 CIDR列表，None则使用内置列表
+        """
+        self.ipv4_ranges = list(CLOUDFLARE_IPV4_RANGES if ipv4_ranges is None else ipv4_ranges)
+        self.ipv6_ranges = list(CLOUDFLARE_IPV6_RANGES if ipv6_ranges is None else ipv6_ranges)
+
+        self._intervals: Dict[int, Tuple[List[int], List[int]]] = {
+            4: _compile_intervals(self.ipv4_ranges + LEGACY_IPV4_RANGES, 4),
+            6: _compile_intervals(self.ipv6_ranges, 6),
+        }
+
+    def contains(self, ip: str) -> bool:
+        """
+        判断单个IP是否属于Cloudflare
+
+        Args:
+            ip: IP地址
+
+        Returns:
+            bool: 是否为Cloudflare IP，无效IP返回False
+        """
+        try:
+            ip_obj = ipaddress.ip_address(ip.strip())
+        except (ValueError, AttributeError):
+            return False
+
+        starts, ends = self._intervals[ip_obj.version]
+        value = int(ip_obj)
+        pos = bisect.bisect_right(starts, value) - 1
+        return pos >= 0 and value <= ends[pos]
+
+    def contains_many(self, ips: Iterable[str]) -> List[bool]:
+        """
+        批量判断IP是否属于Cloudflare
+
+        先将候选IP转换为整数并排序，再与区间列表做一次归并扫描，
+        结果顺序与输入顺序一致。
+
+        Args:
+            ips: IP地址列表
+
+        Returns:
+            List[bool]: 与输入一一对应的判断结果
+        """
+        ips = list(ips)
+        results = [False] * len(ips)
+
+        by_version: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        for i, ip in enumerate(ips):
+            try:
+                ip_obj = ipaddress.ip_address(ip.strip())
+            except (ValueError, AttributeError):
+                continue
+            by_version[ip_obj.version].append((int(ip_obj), i))
+
+        for version, candidates in by_version.items():
+            starts, ends = self._intervals[version]
+            if not candidates or not starts:
+                continue
+
+            candidates.sort()
+            pos = 0
+            for value, i in candidates:
+                while pos < len(ends) and ends[pos] < value:
+                    pos += 1
+                if pos == len(ends):
+                    break
+                results[i] = starts[pos] <= value
+
+        return results
+
+    def __len__(self) -> int:
+        """合并后的区间总数"""
+        return sum(len(starts) for starts, _ in self._intervals.values())
+
+
+class CloudflareRangeProvider:
+    """
+    Cloudflare IP段提供者
+
+    启动时从本地缓存文件加载IP段（不存在则使用内置列表），
+    后台线程按计划使用条件请求刷新官方列表，成功后整体替换内存中的索引。
+    查询只读取当前索引引用，不会等待刷新完成。
+    """
+
+    SOURCE_URLS = {
+        'ipv4': 'https://www.cloudflare.com/ips-v4',
+        'ipv6': 'https://www.cloudflare.com/ips-v6',
+    }
+
+    def __init__(self, cache_file: str = 'cache/cf_ranges.json',
+                 refresh_interval: int = 86400, timeout: int = 10):
+        """
+        初始化IP段提供者
+
+        Args:
+            cache_file: 本地缓存文件路径
+            refresh_interval: 刷新间隔（秒）
+            timeout: 请求超时时间（秒）
+        """
+        self.cache_file = Path(cache_file)
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+
+        # 条件请求所需的校验信息
+        self.validators: Dict[str, Dict[str, str]] = {'ipv4': {}, 'ipv6': {}}
+        self.updated_at = 0.0
+        self.source = 'bundled'
+
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._index = self._load_cached_index()
+
+    @property
+    def index(self) -> CloudflareRangeIndex:
+        """当前生效的索引（只读引用，刷新时整体替换）"""
+        return self._index
+
+    def _load_cached_index(self) -> CloudflareRangeIndex:
+        """从本地缓存文件加载索引，失败则使用内置列表"""
+        if self.cache_file.exists():
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+
+                ipv4 = cached.get('ipv4') or []
+                ipv6 = cached.get('ipv6') or []
+                if ipv4:
+                    self.validators = cached.get('validators', self.validators)
+                    self.updated_at = cached.get('updated_at', 0.0)
+                    self.source = 'cache'
+                    logger.debug(f"从缓存加载Cloudflare IP段: {len(ipv4)} 个IPv4, {len(ipv6)} 个IPv6")
+                    return CloudflareRangeIndex(ipv4, ipv6)
+
+            except Exception as e:
+                logger.warning(f"读取Cloudflare IP段缓存失败: {self.cache_file}, {e}")
+
+        return CloudflareRangeIndex()
+
+    def _fetch_list(self, family: str) -> Tuple[Optional[List[str]], Dict[str, str]]:
+        """
+        条件请求获取一个IP段列表
+
+        Returns:
+            (新的CIDR列表, 新的校验信息)；未变化（304）时列表为None
+
+        Raises:
+            requests.RequestException: 请求失败
+            ValueError: 响应内容无效
+        """
+        headers = {}
+        validator = self.validators.get(family, {})
+        if validator.get('etag'):
+            headers['If-None-Match'] = validator['etag']
+        if validator.get('last_modified'):
+            headers['If-Modified-Since'] = validator['last_modified']
+
+        response = get_http_client().get(self.SOURCE_URLS[family], headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return None, validator
+        response.raise_for_status()
+
+        cidrs = []
+        for line in response.text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            ipaddress.ip_network(line, strict=False)  # 无效内容直接抛出ValueError
+            cidrs.append(line)
+
+        if not cidrs:
+            raise ValueError(f"{family} 列表为空")
+
+        return cidrs, {
+            'etag': response.headers.get('ETag', ''),
+            'last_modified': response.headers.get('Last-Modified', ''),
+        }
+
+    def refresh(self) -> bool:
+        """
+        刷新IP段列表
+
+        Returns:
+            bool: 刷新是否成功（包括内容未变化）
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            logger.debug("Cloudflare IP段正在刷新中，跳过")
+            return False
+
+        try:
+            current = self._index
+            ipv4, ipv4_validator = self._fetch_list('ipv4')
+            ipv6, ipv6_validator = self._fetch_list('ipv6')
+
+            if ipv4 is None and ipv6 is None:
+                logger.debug("Cloudflare IP段未变化")
+            else:
+                # 构建完成后一次性替换引用，查询线程看到的始终是完整索引
+                self._index = CloudflareRangeIndex(
+                    ipv4 if ipv4 is not None else current.ipv4_ranges,
+                    ipv6 if ipv6 is not None else current.ipv6_ranges
+                )
+                self.source = 'remote'
+                logger.info(
+                    f"Cloudflare IP段已更新: {len(self._index.ipv4_ranges)} 个IPv4, "
+                    f"{len(self._index.ipv6_ranges)} 个IPv6"
+                )
+
+            # 两个列表都成功后才更新校验信息，避免半更新状态下后续请求返回304
+            self.validators = {'ipv4': ipv4_validator, 'ipv6': ipv6_validator}
+            self.updated_at = time.time()
+            self._save_cache()
+            return True
+
+        except Exception as e:
+            logger.warning(f"刷新Cloudflare IP段失败，继续使用{self.source}列表: {e}")
+            return False
+
+        finally:
+            self._refresh_lock.release()
+
+    def _save_cache(self):
+        """原子写入本地缓存文件"""
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.cache_file.with_suffix('.tmp')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'ipv4': self._index.ipv4_ranges,
+                    'ipv6': self._index.ipv6_ranges,
+                    'validators': self.validators,
+                    'updated_at': self.updated_at
+                }, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.cache_file)
+
+        except Exception as e:
+            logger.warning(f"保存Cloudflare IP段缓存失败: {e}")
+
+    def export_state(self) -> Optional[Dict]:
+        """
+        导出当前生效的IP段列表（用于快照），使用内置列表时返回None
+        """
+        if self.source == 'bundled':
+            return None
+
+        return {
+            'ipv4': self._index.ipv4_ranges,
+            'ipv6': self._index.ipv6_ranges,
+            'validators': self.validators,
+            'updated_at': self.updated_at
+        }
+
+    def import_state(self, state: Dict) -> bool:
+        """
+        导入快照中的IP段列表，只有比当前列表更新时才替换
+
+        Returns:
+            是否替换了当前列表
+        """
+        ipv4 = state.get('ipv4') or []
+        ipv6 = state.get('ipv6') or []
+        updated_at = state.get('updated_at', 0.0)
+        if not ipv4 or updated_at <= self.updated_at:
+            return False
+
+        self._index = CloudflareRangeIndex(ipv4, ipv6)
+        self.validators = state.get('validators') or {}
+        self.updated_at = updated_at
+        self.source = 'snapshot'
+        self._save_cache()
+        logger.info(f"从快照恢复Cloudflare IP段: {len(ipv4)} 个IPv4, {len(ipv6)} 个IPv6")
+        return True
+
+    def is_stale(self) -> bool:
+        """本地列表是否已超过刷新间隔"""
+        return time.time() - self.updated_at >= self.refresh_interval
+
+    def start_auto_refresh(self):
+        """启动后台定时刷新线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._refresh_loop,
+            name='cf-ranges-refresh',
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """停止后台刷新线程"""
+        self._stop_event.set()
+
+    def _refresh_loop(self):
+        """后台刷新循环"""
+        while not self._stop_event.is_set():
+            if self.is_stale() and not self.refresh():
+                # 离线或请求失败时，10分钟后再试
+                self._stop_event.wait(min(600, self.refresh_interval))
+                continue
+
+            wait = max(60.0, self.updated_at + self.refresh_interval - time.time())
+            self._stop_event.wait(wait)
+
+
+# 全局提供者实例
+_provider: Optional[CloudflareRangeProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_range_provider() -> CloudflareRangeProvider:
+    """
+    获取全局Cloudflare IP段提供者（首次调用时按配置启动后台刷新）
+
+    Returns:
+        CloudflareRangeProvider实例
+    """
+    global _provider
+
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                from .config import Config
+                config = Config()
+
+                provider = CloudflareRangeProvider(
+                    cache_file=getattr(config, 'cf_ranges_cache_file', 'cache/cf_ranges.json'),
+                    refresh_interval=getattr(config, 'cf_ranges_refresh_interval', 86400)
+                )
+                if getattr(config, 'cf_ranges_auto_refresh', True):
+                    provider.start_auto_refresh()
+
+                _provider = provider
+
+    return _provider
+
+
+def get_cf_range_index() -> CloudflareRangeIndex:
+    """
+    获取当前生效的Cloudflare IP段索引
+
+    Returns:
+        CloudflareRangeIndex实例
+    """
+    return get_range_provider().index
+
+
+def is_cloudflare_ip(ip: str) -> bool:
+    """
+    判断IP是否属于Cloudflare（便捷函数）
+
+    Args:
+        ip: IP地址
+
+    Returns:
+        bool: 是否为Cloudflare IP
+    """
+    return get_cf_range_index().contains(ip)
+
+
+def classify_cloudflare_ips(ips: Iterable[str]) -> List[bool]:
+    """
+    批量判断IP是否属于Cloudflare（便捷函数）
+
+    Args:
+        ips: IP地址列表
+
+    Returns:
+        List[bool]: 与输入一一对应的判断结果
+    """
+    return get_cf_range_index().contains_many(ips)
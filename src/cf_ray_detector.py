@@ -9,6 +9,8 @@ from typing import Dict, List, Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import urllib3
 
+from .http_client import get_http_client
+
 # 禁用SSL警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -166,13 +168,16 @@ def get_cloudflare_colo(ip: str, port: int = 443, timeout: int = 5) -> Dict:
                 headers = {
                     'Host': host,
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                    'Accept': '*/*',
-                    'Connection': 'close'
+                    'Accept': '*/*'
                 }
                 
-                # 发起请求
-                response = requests.get(
+                # 发起请求（共享连接池，同一节点的多个Host尝试复用连接；
+                # 逐个探测大量不同IP，不按主机熔断，换Host本身就是重试）
+                response = get_http_client().get(
                     url,
+                    name='cf_ray',
+                    circuit=False,
+                    retries=0,
                     headers=headers,
                     timeout=timeout,
                     verify=False,  # 禁用SSL验证
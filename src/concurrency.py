@@ -0,0 +1,223 @@
+"""
+并发工具模块
+提供分段锁、原子计数器和请求合并，供检测器、缓存和API Provider在多线程下共享状态，
+以及从同步代码中运行协程的辅助函数
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple, TypeVar, Union
+
+Number = Union[int, float]
+T = TypeVar('T')
+
+
+class StripedLock:
+    """
+    分段锁：按键哈希映射到固定数量的锁上
+
+    不同键的操作大多落在不同的锁上，可以并行执行；
+    同一个键的操作总是使用同一把锁，保证读-改-写的原子性。
+    """
+
+    def __init__(self, stripes: int = 64):
+        """
+        初始化分段锁
+
+        Args:
+            stripes: 锁的数量
+        """
+        self._locks = [threading.Lock() for _ in range(max(1, stripes))]
+
+    def _index(self, key) -> int:
+        return hash(key) % len(self._locks)
+
+    def lock_for(self, key) -> threading.Lock:
+        """获取键对应的锁"""
+        return self._locks[self._index(key)]
+
+    @contextmanager
+    def hold(self, key):
+        """持有单个键对应的锁"""
+        with self.lock_for(key):
+            yield
+
+    @contextmanager
+    def hold_many(self, keys: Iterable):
+        """
+        同时持有多个键对应的锁
+
+        按锁序号升序获取，避免多个线程交叉持锁导致死锁
+        """
+        indexes = sorted({self._index(key) for key in keys})
+        acquired = []
+        try:
+            for index in indexes:
+                self._locks[index].acquire()
+                acquired.append(index)
+            yield
+        finally:
+            for index in reversed(acquired):
+                self._locks[index].release()
+
+
+class AtomicCounters:
+    """线程安全的计数器集合，读取时返回一致的快照"""
+
+    def __init__(self, initial: Dict[str, Number] = None):
+        """
+        初始化计数器
+
+        Args:
+            initial: 计数器名称到初始值的映射
+        """
+        self._lock = threading.Lock()
+        self._values: Dict[str, Number] = dict(initial or {})
+
+    def incr(self, name: str, amount: Number = 1) -> Number:
+        """
+        增加计数
+
+        Args:
+            name: 计数器名称
+            amount: 增加量
+
+        Returns:
+            增加后的值
+        """
+        with self._lock:
+            value = self._values.get(name, 0) + amount
+            self._values[name] = value
+            return value
+
+    def set(self, name: str, value: Number):
+        """设置计数器的值"""
+        with self._lock:
+            self._values[name] = value
+
+    def reset(self, name: str):
+        """将计数器归零"""
+        self.set(name, 0)
+
+    def snapshot(self) -> Dict[str, Number]:
+        """返回所有计数器的快照"""
+        with self._lock:
+            return dict(self._values)
+
+    def __getitem__(self, name: str) -> Number:
+        with self._lock:
+            return self._values.get(name, 0)
+
+
+class SingleFlight:
+    """
+    请求合并：同一个键同时只执行一次调用
+
+    第一个调用者执行函数，执行期间到达的相同键调用等待并共享同一个结果（或异常），
+    执行结束后键被移除，之后的调用重新执行。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[object, Future] = {}
+
+    def do(self, key, fn: Callable[[], T]) -> Tuple[T, bool]:
+        """
+        执行或等待键对应的调用
+
+        Args:
+            key: 合并键
+            fn: 无参调用
+
+        Returns:
+            (结果, 是否为共享的结果)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def claim(self, keys: Iterable) -> Tuple[Dict[object, Future], Dict[object, Future]]:
+        """
+        一次登记一批键（批量执行时使用）
+
+        未在执行中的键由调用方执行，执行结束后必须对每个键调用resolve；
+        已在执行中的键返回其Future，调用方可等待并共享结果。
+
+        Args:
+            keys: 合并键
+
+        Returns:
+            ({由调用方执行的键: Future}, {已在执行中的键: Future})
+        """
+        owned: Dict[object, Future] = {}
+        waiting: Dict[object, Future] = {}
+        with self._lock:
+            for key in keys:
+                future = self._calls.get(key)
+                if future is None:
+                    owned[key] = self._calls[key] = Future()
+                elif key not in owned:
+                    waiting[key] = future
+        return owned, waiting
+
+    def resolve(self, key, result=None, error: Optional[BaseException] = None):
+        """
+        结束claim登记的键，把结果（或异常）交给等待的调用者
+
+        Args:
+            key: 合并键
+            result: 结果
+            error: 执行失败时的异常
+        """
+        with self._lock:
+            future = self._calls.pop(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def in_flight(self) -> int:
+        """正在执行的调用数"""
+        with self._lock:
+            return len(self._calls)
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """
+    在同步代码中运行协程并返回结果
+
+    当前线程没有运行中的事件循环时直接asyncio.run；
+    已在事件循环中（如被异步代码间接调用）时在一个新线程中运行，避免嵌套事件循环。
+
+    Args:
+        coro: 协程对象
+
+    Returns:
+        协程的返回值
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
@@ -61,6 +61,23 @@ class Config:
         # Cloudflare IP优先级配置
         self.prefer_cfray_for_cf_ips: bool = os.getenv('PREFER_CFRAY_FOR_CF_IPS', 'true').lower() == 'true'
         
+        # 抽样复核配置（低成本层级先给出结果，高成本层级抽样复核）
+        self.verification_enabled: bool = os.getenv('VERIFICATION_ENABLED', 'true').lower() == 'true'
+        self.verification_sample_rate: float = float(os.getenv('VERIFICATION_SAMPLE_RATE', '0.05'))
+        self.verification_min_confidence: float = float(os.getenv('VERIFICATION_MIN_CONFIDENCE', '0.8'))
+        self.verification_max_rate: float = float(os.getenv('VERIFICATION_MAX_RATE', '1.0'))
+        self.verification_ramp: float = float(os.getenv('VERIFICATION_RAMP', '4.0'))
+        self.verification_geoip_confidence: float = float(os.getenv('VERIFICATION_GEOIP_CONFIDENCE', '0.8'))
+        
+        # 检测层级规划配置（按各层级实测的耗时、成功率和剩余额度为每批检测确定层级顺序）
+        self.tier_planner_enabled: bool = os.getenv('TIER_PLANNER_ENABLED', 'true').lower() == 'true'
+        self.tier_planner_alpha: float = float(os.getenv('TIER_PLANNER_ALPHA', '0.2'))
+        
+        # Cloudflare IP段列表配置（定时从官方地址刷新并缓存到本地）
+        self.cf_ranges_auto_refresh: bool = os.getenv('CF_RANGES_AUTO_REFRESH', 'true').lower() == 'true'
+        self.cf_ranges_refresh_interval: int = int(os.getenv('CF_RANGES_REFRESH_INTERVAL', '86400'))  # 24小时
+        self.cf_ranges_cache_file: str = os.getenv('CF_RANGES_CACHE_FILE', 'cache/cf_ranges.json')
+        
         # ==================== IP检测V2配置 ====================
         # 第三方API配置
         self.api_enabled: bool = os.getenv('ENABLE_API_FALLBACK', 'true').lower() == 'true'
@@ -81,19 +98,74 @@ class Config:
         self.api_timeout: int = int(os.getenv('API_TIMEOUT', '5'))
         self.api_max_retries: int = int(os.getenv('API_MAX_RETRIES', '2'))
         
+        # API动态排序配置（按耗时、成功率和剩余额度的加权平均排序，优先级只用于同分时的先后）
+        self.api_dynamic_ranking: bool = os.getenv('API_DYNAMIC_RANKING', 'true').lower() == 'true'
+        self.api_ranking_alpha: float = float(os.getenv('API_RANKING_ALPHA', '0.2'))
+        self.api_pinned_providers: str = os.getenv('API_PINNED_PROVIDERS', '')  # 逗号分隔，如 ip_api_com
+        
+        # API异步批量查询时同时进行的单IP查询数（在一个事件循环上执行，不占用线程）
+        self.api_async_concurrency: int = int(os.getenv('API_ASYNC_CONCURRENCY', '200'))
+        
+        # API对冲请求配置（当前API超过其p90耗时未返回时，并行请求下一个API）
+        self.api_hedge_enabled: bool = os.getenv('API_HEDGE_ENABLED', 'true').lower() == 'true'
+        self.api_hedge_ratio: float = float(os.getenv('API_HEDGE_RATIO', '0.1'))
+        self.api_hedge_burst: int = int(os.getenv('API_HEDGE_BURST', '10'))
+        self.api_hedge_default_delay: float = float(os.getenv('API_HEDGE_DEFAULT_DELAY', '1.0'))
+        self.api_hedge_min_delay: float = float(os.getenv('API_HEDGE_MIN_DELAY', '0.05'))
+        
+        # 共享HTTP客户端配置（连接池、重试退避、按主机熔断）
+        self.http_pool_size: int = int(os.getenv('HTTP_POOL_SIZE', '0'))  # 0表示按最大并发数自动设置
+        self.http_pool_hosts: int = int(os.getenv('HTTP_POOL_HOSTS', '32'))
+        self.http_retry_backoff: float = float(os.getenv('HTTP_RETRY_BACKOFF', '0.5'))
+        self.http_circuit_threshold: int = int(os.getenv('HTTP_CIRCUIT_THRESHOLD', '5'))
+        self.http_circuit_reset: int = int(os.getenv('HTTP_CIRCUIT_RESET', '30'))
+        
+        # HTTP录制/回放配置（用于离线基准测试和回归测试，设置回放文件时忽略录制文件）
+        self.http_record_file: str = os.getenv('HTTP_RECORD_FILE', '')
+        self.http_replay_file: str = os.getenv('HTTP_REPLAY_FILE', '')
+        self.http_replay_profile: str = os.getenv('HTTP_REPLAY_PROFILE', '')
+        
         # API优先级配置（数字越小优先级越高）
         self.api_ipinfo_widget_priority: int = int(os.getenv('API_IPINFO_WIDGET_PRIORITY', '1'))
         self.api_ipapi_priority: int = int(os.getenv('API_IPAPI_PRIORITY', '2'))
         self.api_ipwhois_priority: int = int(os.getenv('API_IPWHOIS_PRIORITY', '3'))
         self.api_ip2location_priority: int = int(os.getenv('API_IP2LOCATION_PRIORITY', '4'))
         
+        # 检测缓存存储配置（sqlite: 单文件数据库，json: 每条记录一个文件，redis://...: 多副本共享）
+        self.cache_backend: str = os.getenv('CACHE_BACKEND', 'sqlite').strip()
+        self.cache_db_path: str = os.getenv('CACHE_DB_PATH', 'cache/ip_detection.db')
+        
+        # 检测缓存内存层配置（LRU淘汰）
+        self.cache_memory_max_entries: int = int(os.getenv('CACHE_MEMORY_MAX_ENTRIES', '10000'))
+        self.cache_memory_max_bytes: int = int(os.getenv('CACHE_MEMORY_MAX_BYTES', str(16 * 1024 * 1024)))  # 16MB
+        self.cache_memory_sweep_interval: int = int(os.getenv('CACHE_MEMORY_SWEEP_INTERVAL', '300'))  # 5分钟
+        
         # 缓存过期时间配置（秒）
         self.cache_ttl_cf_ray: int = int(os.getenv('CACHE_EXPIRE_CFRAY', '86400'))  # 24小时
         self.cache_ttl_api: int = int(os.getenv('CACHE_EXPIRE_API', '43200'))  # 12小时
         self.cache_ttl_geoip: int = int(os.getenv('CACHE_EXPIRE_GEOIP', '604800'))  # 7天
+        self.cache_adaptive_ttl: bool = os.getenv('CACHE_ADAPTIVE_TTL', 'true').lower() == 'true'
+        self.cache_adaptive_ttl_min_factor: float = float(os.getenv('CACHE_ADAPTIVE_TTL_MIN_FACTOR', '0.25'))
+        self.cache_adaptive_ttl_max_factor: float = float(os.getenv('CACHE_ADAPTIVE_TTL_MAX_FACTOR', '4'))
+        self.cache_snapshot_file: str = os.getenv('CACHE_SNAPSHOT_FILE', '')
+        self.cache_stale_grace: int = int(os.getenv('CACHE_STALE_GRACE', '86400'))  # 1天
+        self.cache_refresh_workers: int = int(os.getenv('CACHE_REFRESH_WORKERS', '4'))
+        self.cache_compact_batch_size: int = int(os.getenv('CACHE_COMPACT_BATCH_SIZE', '500'))
+        self.cache_compact_interval: int = int(os.getenv('CACHE_COMPACT_INTERVAL', '300'))  # 5分钟
+        self.cache_warm_enabled: bool = os.getenv('CACHE_WARM_ENABLED', 'true').lower() == 'true'
+        self.cache_warm_interval: int = int(os.getenv('CACHE_WARM_INTERVAL', '600'))  # 10分钟
+        self.cache_warm_batch_size: int = int(os.getenv('CACHE_WARM_BATCH_SIZE', '20'))
+        self.cache_warm_pause: float = float(os.getenv('CACHE_WARM_PAUSE', '1'))
+        self.cache_warm_lookback: int = int(os.getenv('CACHE_WARM_LOOKBACK', '259200'))  # 3天
+        self.cache_prefix_enabled: bool = os.getenv('CACHE_PREFIX_ENABLED', 'true').lower() == 'true'
+        self.cache_prefix_min_length_v4: int = int(os.getenv('CACHE_PREFIX_MIN_LENGTH_V4', '16'))
+        self.cache_prefix_min_length_v6: int = int(os.getenv('CACHE_PREFIX_MIN_LENGTH_V6', '32'))
         
         # 失败处理配置
         self.failure_retry_delay: int = int(os.getenv('FAILURE_RETRY_DELAY', '3600'))  # 1小时
+        self.failure_max_retry_delay: int = int(os.getenv('FAILURE_MAX_RETRY_DELAY', '604800'))  # 7天
+        self.failure_backoff_jitter: float = float(os.getenv('FAILURE_BACKOFF_JITTER', '0.2'))
+        self.failure_persistent: bool = os.getenv('FAILURE_PERSISTENT', 'true').lower() == 'true'
         self.api_disable_threshold: int = int(os.getenv('API_DISABLE_THRESHOLD', '3'))
         self.api_disable_duration: int = int(os.getenv('API_DISABLE_DURATION', '600'))  # 10分钟
         
@@ -3,42 +3,338 @@
 提供IP检测结果的缓存管理功能
 """
 
+import os
 import time
 import json
+import random
 import logging
-from pathlib import Path
-from typing import Dict, Optional
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .cache_backends import CacheBackend, create_backend
+from .concurrency import AtomicCounters, StripedLock
+from .endpoint_history import EndpointHistory
+from .prefix_cache import PrefixTable
 
 logger = logging.getLogger(__name__)
 
+# 检测层级排名（数字越大越可信）
+TIER_RANK = {
+    'geoip': 1,
+    'api': 2,
+    'cf_ray': 3
+}
 
-class DetectionCache:
-    """检测结果缓存管理器"""
+# 可按网段缓存的检测层级（同一网段内的IP结果相同；CF-RAY结果只对单个端点有效）
+PREFIX_TIERS = ('api', 'geoip')
+
+# 网段记录的键前缀（与端点记录共用写入缓冲和快照格式）
+PREFIX_KEY = 'net:'
+
+# 旧版缓存文件后缀（每个IP、每种类型一个文件）
+LEGACY_FILE_SUFFIXES = tuple(f"_{tier}.json" for tier in TIER_RANK)
+
+
+class LRUMemoryCache:
+    """
+    有界内存缓存（LRU淘汰）
     
-    def __init__(self, cache_dir: str = 'cache/ip_detection', enabled: bool = True):
+    按条目数和近似字节数限制容量，读取时惰性检查过期，
+    并在读写时按间隔定期清扫全部过期条目。每个实例有自己的锁，
+    多线程场景使用ShardedMemoryCache分片以减少锁竞争
+    """
+    
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 16 * 1024 * 1024,
+                 sweep_interval: int = 300):
         """
-        初始化缓存管理器
+        初始化内存缓存
         
         Args:
-            cache_dir: 缓存目录
-            enabled: 是否启用缓存
+            max_entries: 最大条目数
+            max_bytes: 最大近似字节数（按JSON序列化长度估算）
+            sweep_interval: 定期清扫过期条目的间隔（秒）
         """
-        self.enabled = enabled
-        self.cache_dir = Path(cache_dir)
-        
-        if self.enabled:
-            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
         
-        # 内存缓存
-        self.memory_cache = {}
+        # {key: (value, expires_at, size)}，按访问顺序排列，最近使用的在末尾
+        self._data: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._last_sweep = time.time()
+        self._lock = threading.Lock()
         
-        # 缓存统计
         self.stats = {
             'hits': 0,
             'misses': 0,
-            'sets': 0,
+            'evictions': 0,
             'expired': 0
         }
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        读取条目
+        
+        Args:
+            key: 缓存键
+            
+        Returns:
+            条目值，不存在或已过期返回None
+        """
+        with self._lock:
+            self._maybe_sweep()
+            
+            item = self._data.get(key)
+            if item is None:
+                self.stats['misses'] += 1
+                return None
+            
+            value, expires_at, _ = item
+            if expires_at < time.time():
+                # 惰性过期
+                self._remove(key)
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            
+            self._data.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+    
+    def put(self, key: str, value: Dict, expires_at: float):
+        """
+        写入条目，超出容量时淘汰最久未使用的条目
+        
+        Args:
+            key: 缓存键
+            value: 条目值
+            expires_at: 过期时间戳
+        """
+        size = self._estimate_size(key, value)
+        
+        with self._lock:
+            self._maybe_sweep()
+            
+            if key in self._data:
+                self._remove(key)
+            
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.stats['evictions'] += 1
+    
+    def pop(self, key: str):
+        """删除条目"""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+    
+    def clear(self):
+        """清空全部条目"""
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+    
+    def sweep(self) -> int:
+        """
+        清扫全部过期条目
+        
+        Returns:
+            清扫的条目数
+        """
+        with self._lock:
+            return self._sweep()
+    
+    def _sweep(self) -> int:
+        """清扫过期条目（调用方需持有锁）"""
+        now = time.time()
+        self._last_sweep = now
+        
+        expired = [key for key, (_, expires_at, _) in self._data.items() if expires_at < now]
+        for key in expired:
+            self._remove(key)
+        
+        self.stats['expired'] += len(expired)
+        return len(expired)
+    
+    def _maybe_sweep(self):
+        """距上次清扫超过间隔时执行清扫（调用方需持有锁）"""
+        if time.time() - self._last_sweep >= self.sweep_interval:
+            self._sweep()
+    
+    def _remove(self, key: str):
+        """移除条目并更新字节计数"""
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+    
+    @staticmethod
+    def _estimate_size(key: str, value: Dict) -> int:
+        """估算条目占用字节数"""
+        try:
+            return len(key) + len(json.dumps(value, ensure_ascii=False, default=str))
+        except (TypeError, ValueError):
+            return len(key) + 256
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+    
+    def get_stats(self) -> Dict:
+        """
+        获取统计信息
+        
+        Returns:
+            统计信息字典
+        """
+        with self._lock:
+            stats = dict(self.stats, size=len(self._data), bytes=self._bytes)
+        
+        return _format_memory_stats(stats, self.max_entries, self.max_bytes)
+
+
+class ShardedMemoryCache:
+    """
+    分片内存缓存：按键哈希分布到多个LRUMemoryCache分片
+    
+    每个分片独立加锁，容量平均分配，多线程读写不同键时互不阻塞
+    """
+    
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 16 * 1024 * 1024,
+                 sweep_interval: int = 300, shards: int = 16):
+        """
+        初始化分片内存缓存
+        
+        Args:
+            max_entries: 总最大条目数
+            max_bytes: 总最大近似字节数
+            sweep_interval: 定期清扫过期条目的间隔（秒）
+            shards: 分片数量
+        """
+        shards = max(1, min(shards, max_entries))
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._shards = [
+            LRUMemoryCache(
+                max_entries=max(1, max_entries // shards),
+                max_bytes=max(1, max_bytes // shards),
+                sweep_interval=sweep_interval
+            )
+            for _ in range(shards)
+        ]
+    
+    def _shard(self, key: str) -> LRUMemoryCache:
+        return self._shards[hash(key) % len(self._shards)]
+    
+    def get(self, key: str) -> Optional[Dict]:
+        return self._shard(key).get(key)
+    
+    def put(self, key: str, value: Dict, expires_at: float):
+        self._shard(key).put(key, value, expires_at)
+    
+    def pop(self, key: str):
+        self._shard(key).pop(key)
+    
+    def clear(self):
+        for shard in self._shards:
+            shard.clear()
+    
+    def sweep(self) -> int:
+        return sum(shard.sweep() for shard in self._shards)
+    
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._shard(key)
+    
+    def get_stats(self) -> Dict:
+        """
+        获取所有分片的汇总统计信息
+        
+        Returns:
+            统计信息字典
+        """
+        totals = {'size': 0, 'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+        for shard in self._shards:
+            with shard._lock:
+                shard_stats = dict(shard.stats, size=len(shard._data), bytes=shard._bytes)
+            for name in totals:
+                totals[name] += shard_stats[name]
+        
+        stats = _format_memory_stats(totals, self.max_entries, self.max_bytes)
+        stats['shards'] = len(self._shards)
+        return stats
+
+
+def _format_memory_stats(stats: Dict, max_entries: int, max_bytes: int) -> Dict:
+    """格式化内存缓存统计信息"""
+    total_requests = stats['hits'] + stats['misses']
+    hit_rate = (stats['hits'] / total_requests * 100) if total_requests > 0 else 0
+    
+    return {
+        'size': stats['size'],
+        'bytes': stats['bytes'],
+        'max_entries': max_entries,
+        'max_bytes': max_bytes,
+        'hits': stats['hits'],
+        'misses': stats['misses'],
+        'hit_rate': f"{hit_rate:.1f}%",
+        'evictions': stats['evictions'],
+        'expired': stats['expired']
+    }
+
+
+class DetectionCache:
+    """
+    检测结果缓存管理器
+    
+    每个端点（ip:port）一条缓存记录，记录内按检测层级保存结果，
+    每个层级有各自的TTL。查询时返回满足最低层级要求的最优有效结果。
+    
+    stale_grace > 0 时启用 stale-while-revalidate：过期不超过宽限期的结果
+    仍被保留，lookup() 在没有新鲜结果时返回它并标记为过期，由调用方后台刷新。
+    
+    传入EndpointHistory时使用自适应TTL：长期不变的端点TTL变长，频繁变化的变短。
+    
+    API/GeoIP结果带有所属网段（network字段）时，同时按网段缓存，
+    之后该网段内任意IP的查询通过最长前缀匹配直接命中。
+    """
+    
+    def __init__(self, cache_dir: str = 'cache/ip_detection', enabled: bool = True,
+                 backend: str = 'sqlite', db_path: str = 'cache/ip_detection.db',
+                 default_ttl: Optional[Dict[str, int]] = None,
+                 memory_max_entries: int = 10000, memory_max_bytes: int = 16 * 1024 * 1024,
+                 memory_sweep_interval: int = 300, stale_grace: int = 0,
+                 history: Optional[EndpointHistory] = None, prefix_cache: bool = True,
+                 prefix_min_length: Optional[Dict[int, int]] = None):
+        """
+        初始化缓存管理器
+        
+        Args:
+            cache_dir: 缓存目录（JSON后端的存储目录，旧版缓存文件也从此目录一次性迁移）
+            enabled: 是否启用缓存
+            backend: 持久化后端 ('sqlite' 或 'json')
+            db_path: SQLite数据库文件路径
+            default_ttl: 各检测层级的TTL（秒），None则使用默认值
+            memory_max_entries: 内存缓存最大条目数
+            memory_max_bytes: 内存缓存最大近似字节数
+            memory_sweep_interval: 内存缓存定期清扫间隔（秒）
+            stale_grace: 过期结果的宽限期（秒），0表示过期即失效
+            history: 端点历史，用于计算自适应TTL，None则使用固定TTL
+            prefix_cache: 是否按网段缓存API/GeoIP结果
+            prefix_min_length: 各地址族 (4/6) 可缓存的最短前缀长度，None则使用默认值
+        """
+        self.enabled = enabled
+        self.cache_dir = cache_dir
+        self.stale_grace = max(0, stale_grace)
+        self.history = history if enabled else None
         
         # 默认TTL（秒）
         self.default_ttl = {
@@ -46,60 +342,164 @@ class DetectionCache:
             'api': 43200,         # API: 12小时
             'geoip': 604800       # GeoIP: 7天
         }
+        if default_ttl:
+            self.default_ttl.update(default_ttl)
+        
+        self.backend: Optional[CacheBackend] = None
+        if self.enabled:
+            self.backend = create_backend(backend, cache_dir=cache_dir, db_path=db_path)
+            self._migrate_legacy_files()
+        
+        # 网段缓存（全部加载到内存的最长前缀匹配表）
+        self.prefixes = PrefixTable(prefix_min_length)
+        self._prefix_lock = threading.Lock()
+        self.prefix_backend: Optional[CacheBackend] = None
+        if self.enabled and prefix_cache:
+            self.prefix_backend = create_backend(
+                backend, cache_dir=os.path.join(cache_dir, 'prefixes'), db_path=db_path, table='prefix_cache'
+            )
+            self._load_prefixes()
+        
+        # 内存缓存 {ip:port: 端点记录}，分片有界LRU
+        self.memory_cache = ShardedMemoryCache(
+            max_entries=memory_max_entries,
+            max_bytes=memory_max_bytes,
+            sweep_interval=memory_sweep_interval
+        )
+        
+        # 端点记录的读-改-写使用分段锁，不同端点可并行写入
+        self._key_locks = StripedLock()
+        
+        # 批量写入缓冲（batch()上下文内的写入在退出时一次性提交）
+        self._pending = {}
+        self._batch_depth = 0
+        self._batch_lock = threading.Lock()
+        
+        # 缓存统计
+        self.stats = AtomicCounters({
+            'hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'expired': 0,       # 超过保留期限被丢弃的层级数（读取过期结果不计入）
+            'stale_hits': 0,
+            'prefix_hits': 0
+        })
     
-    def get(self, ip: str, port: int = 443, cache_type: str = 'cf_ray') -> Optional[Dict]:
+    def get(self, ip: str, port: int = 443, cache_type: Optional[str] = None,
+            min_tier: Optional[str] = None) -> Optional[Dict]:
         """
         获取缓存
         
         Args:
             ip: IP地址
             port: 端口号
-            cache_type: 缓存类型 ('cf_ray', 'api', 'geoip')
+            cache_type: 只接受指定层级的结果 ('cf_ray', 'api', 'geoip')，None则不限
+            min_tier: 最低可接受层级，如 'cf_ray' 表示只接受CF-RAY结果
+            
+        Returns:
+            满足条件的最优有效位置信息，未命中返回None
+        """
+        return self.lookup(ip, port, cache_type, min_tier, allow_stale=False)[0]
+    
+    def lookup(self, ip: str, port: int = 443, cache_type: Optional[str] = None,
+               min_tier: Optional[str] = None, allow_stale: bool = True) -> Tuple[Optional[Dict], bool]:
+        """
+        获取缓存，没有新鲜结果时可返回宽限期内的过期结果
+        
+        Args:
+            ip: IP地址
+            port: 端口号
+            cache_type: 只接受指定层级的结果，None则不限
+            min_tier: 最低可接受层级
+            allow_stale: 是否接受宽限期内的过期结果
             
         Returns:
-            缓存的位置信息，未命中返回None
+            (位置信息, 是否为过期结果)，未命中返回 (None, False)
         """
         if not self.enabled:
-            return None
+            return None, False
+        
+        entry = self._load_entry(self._make_key(ip, port))
+        data, stale = self._select(entry, cache_type, min_tier, allow_stale) if entry else (None, False)
         
-        key = self._make_key(ip, port, cache_type)
+        if data is None or stale:
+            # 端点没有新鲜结果时，查找包含该IP的网段
+            prefix_data = self._lookup_prefix(ip, cache_type, min_tier)
+            if prefix_data is not None:
+                return prefix_data, False
         
-        # 先查内存缓存
-        if key in self.memory_cache:
-            cached = self.memory_cache[key]
+        if data is None:
+            self.stats.incr('misses')
+            return None, False
+        
+        self.stats.incr('stale_hits' if stale else 'hits')
+        logger.debug(f"缓存命中: {ip}:{port} ({data.get('source', '')}{', 已过期' if stale else ''})")
+        return data, stale
+    
+    def get_many(self, endpoints: Iterable[Tuple[str, int]], cache_type: Optional[str] = None,
+                 min_tier: Optional[str] = None, allow_stale: bool = True) -> Dict[str, Tuple[Dict, bool]]:
+        """
+        批量获取缓存，与lookup相同，没有新鲜结果时可返回宽限期内的过期结果
+        
+        Args:
+            endpoints: (ip, port) 元组列表
+            cache_type: 只接受指定层级的结果，None则不限
+            min_tier: 最低可接受层级
+            allow_stale: 是否接受宽限期内的过期结果
             
-            if not self._is_expired(cached):
-                self.stats['hits'] += 1
-                logger.debug(f"内存缓存命中: {ip}:{port}")
-                return cached['data']
-            else:
-                # 过期，删除
-                del self.memory_cache[key]
-                self.stats['expired'] += 1
+        Returns:
+            "ip:port" 到 (位置信息, 是否为过期结果) 的映射（只包含命中的条目）
+        """
+        if not self.enabled:
+            return {}
         
-        # 再查文件缓存
-        cache_file = self._get_cache_file(ip, port, cache_type)
-        if cache_file.exists():
-            try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    cached = json.load(f)
-                
-                if not self._is_expired(cached):
-                    # 加载到内存缓存
-                    self.memory_cache[key] = cached
-                    self.stats['hits'] += 1
-                    logger.debug(f"文件缓存命中: {ip}:{port}")
-                    return cached['data']
-                else:
-                    # 过期，删除文件
-                    cache_file.unlink()
-                    self.stats['expired'] += 1
+        keys = [self._make_key(ip, port) for ip, port in endpoints]
+        entries = self._load_entries(keys)
+        
+        results = {}
+        for key in keys:
+            entry = entries.get(key)
+            data, stale = self._select(entry, cache_type, min_tier, allow_stale) if entry else (None, False)
+            if data is None or stale:
+                prefix_data = self._lookup_prefix(key.rsplit(':', 1)[0], cache_type, min_tier, count=False)
+                if prefix_data is not None:
+                    data, stale = prefix_data, False
+            if data is not None:
+                results[key] = (data, stale)
+        
+        stale_hits = sum(1 for _, stale in results.values() if stale)
+        self.stats.incr('hits', len(results) - stale_hits)
+        self.stats.incr('stale_hits', stale_hits)
+        self.stats.incr('misses', len(keys) - len(results))
+        return results
+    
+    def fresh_until(self, ip: str, port: int = 443, min_tier: Optional[str] = None) -> Optional[float]:
+        """
+        端点缓存结果保持新鲜的截止时间（用于预热时判断哪些端点即将过期）
+        
+        Args:
+            ip: IP地址
+            port: 端口号
+            min_tier: 最低可接受层级
             
-            except Exception as e:
-                logger.debug(f"读取缓存文件失败: {cache_file}, {e}")
+        Returns:
+            满足层级要求的结果中最晚的过期时间戳，没有缓存时返回None
+        """
+        if not self.enabled:
+            return None
         
-        self.stats['misses'] += 1
-        return None
+        entry = self._load_entry(self._make_key(ip, port))
+        if not entry:
+            return None
+        
+        min_rank = TIER_RANK.get(min_tier, 0) if min_tier else 0
+        return max(
+            (
+                item['timestamp'] + item['ttl'] for tier, item in entry['tiers'].items()
+                if TIER_RANK.get(tier, 0) >= min_rank
+            ),
+            default=None
+        )
     
     def set(self, ip: str, data: Dict, port: int = 443, 
             cache_type: str = 'cf_ray', ttl: Optional[int] = None):
@@ -110,75 +510,557 @@ class DetectionCache:
             ip: IP地址
             data: 位置信息数据
             port: 端口号
-            cache_type: 缓存类型 ('cf_ray', 'api', 'geoip')
-            ttl: 过期时间（秒），None则使用默认值
+            cache_type: 检测层级 ('cf_ray', 'api', 'geoip')
+            ttl: 过期时间（秒），None则使用该层级的默认值
         """
-        if not self.enabled:
+        self.set_many({(ip, port): data}, cache_type, ttl)
+    
+    def set_many(self, items: Dict, cache_type: str = 'cf_ray', ttl: Optional[int] = None):
+        """
+        批量设置缓存（在一个事务内写入）
+        
+        Args:
+            items: (ip, port) 到位置信息的映射
+            cache_type: 检测层级 ('cf_ray', 'api', 'geoip')
+            ttl: 过期时间（秒），None则使用该层级的默认值（启用端点历史时按稳定性调整）
+        """
+        if not self.enabled or not items:
+            return
+        
+        base_ttl = self.default_ttl.get(cache_type, 3600)
+        now = time.time()
+        keys = [self._make_key(ip, port) for ip, port in items]
+        records = {}
+        expired = 0
+        
+        with self._key_locks.hold_many(keys):
+            entries = self._load_entries(keys)
+            
+            for key, data in zip(keys, items.values()):
+                # 生成新的端点记录（不修改已共享的旧记录），同一端点的其他层级保留（含宽限期内的过期结果）
+                old_entry = entries.get(key) or {'tiers': {}}
+                tiers = {
+                    tier: item for tier, item in old_entry['tiers'].items()
+                    if not self._is_expired(item, self.stale_grace)
+                }
+                expired += len(old_entry['tiers']) - len(tiers)
+                if ttl is not None:
+                    item_ttl = ttl
+                elif self.history:
+                    item_ttl = self.history.observe(key, cache_type, data, base_ttl)
+                else:
+                    item_ttl = base_ttl
+                
+                tiers[cache_type] = {
+                    'data': data,
+                    'timestamp': now,
+                    'ttl': item_ttl
+                }
+                entry = {'tiers': tiers}
+                
+                # 写入内存缓存
+                expires_at = self._entry_expires_at(entry)
+                self.memory_cache.put(key, entry, expires_at)
+                records[key] = (entry, expires_at)
+                
+                network = data.get('network')
+                if network and cache_type in PREFIX_TIERS and self.prefix_backend:
+                    records.update(self._put_prefix(network, cache_type, data, now, item_ttl))
+            
+            with self._batch_lock:
+                if self._batch_depth > 0:
+                    # 批量模式：缓冲到退出batch()时统一提交
+                    self._pending.update(records)
+                    records = {}
+        
+        self.stats.incr('sets', len(items))
+        if expired:
+            self.stats.incr('expired', expired)
+        self._write_records(records)
+    
+    @contextmanager
+    def batch(self):
+        """
+        批量写入上下文：上下文内的所有写入在退出时用一个事务提交
+        
+        用法:
+            with cache.batch():
+                for ip in ips:
+                    cache.set(ip, data)
+        """
+        with self._batch_lock:
+            self._batch_depth += 1
+        
+        try:
+            yield self
+        finally:
+            with self._batch_lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    records, self._pending = self._pending, {}
+                else:
+                    records = {}
+            
+            self._write_records(records)
+    
+    def _load_prefixes(self):
+        """从持久化存储加载全部未过期的网段记录"""
+        try:
+            self.prefix_backend.delete_expired()
+            for network, value, expires_at in self.prefix_backend.scan_records():
+                self.prefixes.put(network, {'tiers': value.get('tiers', {})}, expires_at)
+        except Exception as e:
+            logger.error(f"加载网段缓存失败: {e}")
             return
         
-        if ttl is None:
-            ttl = self.default_ttl.get(cache_type, 3600)
+        if len(self.prefixes):
+            logger.info(f"已加载网段缓存: {len(self.prefixes)} 个网段")
+    
+    def _put_prefix(self, network: str, cache_type: str, data: Dict, now: float, ttl: int) -> Dict:
+        """
+        把结果合并到网段记录
         
-        key = self._make_key(ip, port, cache_type)
+        Returns:
+            待持久化的 {net:网段: (网段记录, 保留期限)}，网段无效或过宽时为空
+        """
+        net = self.prefixes.parse(network)
+        if net is None:
+            return {}
+        network = str(net)
         
-        cached = {
-            'data': data,
-            'timestamp': time.time(),
-            'ttl': ttl,
-            'cache_type': cache_type
+        # 网段结果对网段内所有IP通用，不保存具体IP
+        item = {
+            'data': {k: v for k, v in data.items() if k != 'ip'},
+            'timestamp': now,
+            'ttl': ttl
         }
         
-        # 写入内存缓存
-        self.memory_cache[key] = cached
+        with self._prefix_lock:
+            old_entry = self.prefixes.get(network) or {'tiers': {}}
+            tiers = {
+                tier: old_item for tier, old_item in old_entry['tiers'].items()
+                if not self._is_expired(old_item)
+            }
+            tiers[cache_type] = item
+            entry = {'tiers': tiers}
+            expires_at = self._entry_expires_at(entry)
+            self.prefixes.put(network, entry, expires_at)
         
-        # 写入文件缓存
-        try:
-            cache_file = self._get_cache_file(ip, port, cache_type)
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cached, f, ensure_ascii=False, indent=2)
+        return {PREFIX_KEY + network: (entry, expires_at)}
+    
+    def _lookup_prefix(self, ip: str, cache_type: Optional[str], min_tier: Optional[str],
+                       count: bool = True) -> Optional[Dict]:
+        """最长前缀匹配查找包含该IP的网段的新鲜结果"""
+        if not self.prefix_backend:
+            return None
+        
+        match = self.prefixes.lookup(ip)
+        if match is None:
+            return None
+        
+        network, entry = match
+        data = self._select(entry, cache_type, min_tier)[0]
+        if data is None:
+            return None
+        
+        self.stats.incr('prefix_hits')
+        if count:
+            self.stats.incr('hits')
+        logger.debug(f"网段缓存命中: {ip} ∈ {network} ({data.get('source', '')})")
+        return dict(data, ip=ip)
+    
+    def _load_entry(self, key: str) -> Optional[Dict]:
+        """读取单个端点记录（内存 → 持久化存储）"""
+        return self._load_entries([key]).get(key)
+    
+    def _load_entries(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        """
+        批量读取端点记录，先查内存缓存，未命中的一次性从持久化存储读取
+        
+        全部层级超过保留期限的记录视为不存在，并从持久化存储中删除（计入过期统计）
+        """
+        entries = {}
+        missing = []
+        dropped = []
+        expired = 0
+        
+        for key in keys:
+            entry = self.memory_cache.get(key)
+            if entry is not None:
+                entries[key] = entry
+            else:
+                missing.append(key)
+        
+        if missing:
+            # 批量模式下尚未提交的记录可能已被内存缓存淘汰
+            with self._batch_lock:
+                pending = {key: self._pending[key][0] for key in missing if key in self._pending}
+            
+            try:
+                stored = self.backend.get_many([key for key in missing if key not in pending])
+            except Exception as e:
+                logger.debug(f"读取持久化缓存失败: {e}")
+                stored = {}
+            
+            stored.update(pending)
+            for key, entry in stored.items():
+                entry = {'tiers': entry.get('tiers', {})}
+                expires_at = self._entry_expires_at(entry)
+                if expires_at < time.time():
+                    if key not in pending:
+                        dropped.append(key)
+                        expired += len(entry['tiers'])
+                    continue
+                self.memory_cache.put(key, entry, expires_at)
+                entries[key] = entry
             
-            self.stats['sets'] += 1
-            logger.debug(f"缓存已保存: {ip}:{port}, TTL: {ttl}秒")
+            # 超过保留期限的记录直接删除，每条记录只计一次过期
+            if dropped:
+                try:
+                    self.backend.delete_many(dropped)
+                except Exception as e:
+                    logger.debug(f"删除过期缓存失败: {e}")
+        
+        if expired:
+            self.stats.incr('expired', expired)
+        return entries
+    
+    def _select(self, entry: Dict, cache_type: Optional[str], min_tier: Optional[str],
+                allow_stale: bool = False) -> Tuple[Optional[Dict], bool]:
+        """
+        从端点记录中选出满足条件的最优层级结果（记录本身只读）
+        
+        优先返回新鲜结果；没有新鲜结果且allow_stale时返回宽限期内最优的过期结果
         
+        Returns:
+            (位置信息, 是否为过期结果)
+        """
+        min_rank = TIER_RANK.get(min_tier, 0) if min_tier else 0
+        best_rank = stale_rank = -1
+        best = stale = None
+        
+        for tier, item in entry['tiers'].items():
+            rank = TIER_RANK.get(tier, 0)
+            if cache_type and tier != cache_type:
+                continue
+            if rank < min_rank:
+                continue
+            if self._is_expired(item):
+                if allow_stale and rank > stale_rank and not self._is_expired(item, self.stale_grace):
+                    stale_rank = rank
+                    stale = item['data']
+                continue
+            if rank > best_rank:
+                best_rank = rank
+                best = item['data']
+        
+        if best is not None:
+            return best, False
+        if stale is not None:
+            return stale, True
+        return None, False
+    
+    def _entry_expires_at(self, entry: Dict) -> float:
+        """端点记录的保留期限（最晚过期层级的过期时间加宽限期）"""
+        return max(
+            (item['timestamp'] + item['ttl'] + self.stale_grace for item in entry['tiers'].values()),
+            default=0.0
+        )
+    
+    def _write_records(self, records: Dict):
+        """写入持久化存储（端点历史随之写入，net:开头的网段记录写入网段存储）"""
+        if not records:
+            return
+        
+        if self.history:
+            self.history.flush()
+        
+        prefix_records = {
+            key[len(PREFIX_KEY):]: record for key, record in records.items()
+            if key.startswith(PREFIX_KEY)
+        }
+        if prefix_records:
+            records = {key: record for key, record in records.items() if not key.startswith(PREFIX_KEY)}
+            try:
+                self.prefix_backend.set_many(prefix_records)
+            except Exception as e:
+                logger.error(f"保存网段缓存失败: {len(prefix_records)} 条, {e}")
+        
+        if not records:
+            return
+        
+        try:
+            self.backend.set_many(records)
+            logger.debug(f"缓存已保存: {len(records)} 条")
         except Exception as e:
-            logger.error(f"保存缓存文件失败: {ip}:{port}, {e}")
+            logger.error(f"保存持久化缓存失败: {len(records)} 条, {e}")
+    
+    def _migrate_legacy_files(self):
+        """
+        一次性迁移旧版缓存文件（每个IP、每种类型一个JSON文件）
+        
+        有效记录按端点合并写入当前后端，已过期或没有IP字段的记录直接丢弃；
+        写入成功后才删除旧文件，写入失败时保留旧文件，下次启动重试
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        
+        with os.scandir(self.cache_dir) as dir_entries:
+            legacy_files = [
+                e.path for e in dir_entries
+                if e.name.endswith(LEGACY_FILE_SUFFIXES) and e.is_file()
+            ]
+        
+        if not legacy_files:
+            return
+        
+        now = time.time()
+        entries = {}
+        
+        for path in legacy_files:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+                
+                if now - cached['timestamp'] > cached['ttl']:
+                    continue
+                
+                # 文件名格式: 1_2_3_4_443_cf_ray.json（IPv6地址无法从文件名还原，IP只取记录中的字段）
+                ip = cached['data'].get('ip')
+                if not ip:
+                    logger.debug(f"旧版缓存文件缺少IP字段，跳过: {path}")
+                    continue
+                name = os.path.basename(path)
+                cache_type = cached.get('cache_type') or next(
+                    tier for tier in TIER_RANK if name.endswith(f"_{tier}.json")
+                )
+                port = name[:-len(f"_{cache_type}.json")].rsplit('_', 1)[-1]
+                
+                entry = entries.setdefault(self._make_key(ip, port), {'tiers': {}})
+                entry['tiers'][cache_type] = {
+                    'data': cached['data'],
+                    'timestamp': cached['timestamp'],
+                    'ttl': cached['ttl']
+                }
+            
+            except Exception as e:
+                logger.debug(f"迁移缓存文件失败: {path}, {e}")
+        
+        if entries:
+            try:
+                self.backend.set_many({
+                    key: (entry, self._entry_expires_at(entry))
+                    for key, entry in entries.items()
+                })
+            except Exception as e:
+                logger.error(f"迁移旧版缓存文件失败，保留旧文件待下次启动重试: {e}")
+                return
+        
+        for path in legacy_files:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.debug(f"删除旧版缓存文件失败: {path}, {e}")
+        
+        logger.info(
+            f"已迁移旧版缓存文件: {len(entries)} 个端点的有效记录 "
+            f"(共 {len(legacy_files)} 个文件)"
+        )
+    
+    def export_records(self) -> List[Tuple[str, Dict, float]]:
+        """
+        导出全部未过期的端点记录和网段记录（用于快照）
+        
+        Returns:
+            [(键, 记录, 保留期限)] 列表，网段记录的键为 net:网段
+        """
+        if not self.enabled:
+            return []
+        
+        # 先提交批量缓冲，保证导出完整
+        with self._batch_lock:
+            records, self._pending = self._pending, {}
+        self._write_records(records)
+        
+        now = time.time()
+        exported = [
+            (key, {'tiers': value.get('tiers', {})}, expires_at)
+            for key, value, expires_at in self.backend.scan_records()
+            if expires_at >= now
+        ]
+        exported.extend(
+            (PREFIX_KEY + network, value, expires_at)
+            for network, value, expires_at in self.prefixes.items()
+            if expires_at >= now
+        )
+        return exported
+    
+    def import_records(self, records: Iterable[Tuple[str, Dict, float]]) -> int:
+        """
+        批量导入端点记录和网段记录（用于快照恢复）
+        
+        与现有记录按层级合并，同一层级保留较新的结果，超出保留期限的层级丢弃，
+        全部在一个事务内写入
+        
+        Args:
+            records: [(键, 记录, 保留期限)] 列表
+            
+        Returns:
+            导入（新增或更新）的端点数和网段数
+        """
+        if not self.enabled:
+            return 0
+        
+        records = list(records)
+        imported = self._import_prefixes(
+            (key[len(PREFIX_KEY):], value) for key, value, _ in records if key.startswith(PREFIX_KEY)
+        )
+        
+        incoming = {}
+        for key, value, _ in records:
+            if key.startswith(PREFIX_KEY):
+                continue
+            tiers = {
+                tier: item for tier, item in value.get('tiers', {}).items()
+                if tier in TIER_RANK and not self._is_expired(item, self.stale_grace)
+            }
+            if tiers:
+                incoming.setdefault(key, {}).update(tiers)
+        
+        if not incoming:
+            return imported
+        
+        keys = list(incoming)
+        updates = {}
+        
+        with self._key_locks.hold_many(keys):
+            existing = self.backend.get_many(keys)
+            
+            for key, tiers in incoming.items():
+                merged = dict(existing.get(key, {}).get('tiers', {}))
+                changed = False
+                for tier, item in tiers.items():
+                    current = merged.get(tier)
+                    if current is None or item['timestamp'] > current['timestamp']:
+                        merged[tier] = item
+                        changed = True
+                
+                if changed:
+                    entry = {'tiers': merged}
+                    updates[key] = (entry, self._entry_expires_at(entry))
+                    self.memory_cache.pop(key)
+            
+            self._write_records(updates)
+        
+        return imported + len(updates)
+    
+    def _import_prefixes(self, records: Iterable[Tuple[str, Dict]]) -> int:
+        """按层级合并导入网段记录，返回新增或更新的网段数"""
+        if not self.prefix_backend:
+            return 0
+        
+        updates = {}
+        with self._prefix_lock:
+            for network, value in records:
+                net = self.prefixes.parse(network)
+                if net is None:
+                    continue
+                network = str(net)
+                
+                merged = dict((self.prefixes.get(network) or {}).get('tiers', {}))
+                changed = False
+                for tier, item in value.get('tiers', {}).items():
+                    if tier not in PREFIX_TIERS or self._is_expired(item, self.stale_grace):
+                        continue
+                    current = merged.get(tier)
+                    if current is None or item['timestamp'] > current['timestamp']:
+                        merged[tier] = item
+                        changed = True
+                
+                if changed:
+                    entry = {'tiers': merged}
+                    expires_at = self._entry_expires_at(entry)
+                    self.prefixes.put(network, entry, expires_at)
+                    updates[network] = (entry, expires_at)
+        
+        if updates:
+            try:
+                self.prefix_backend.set_many(updates)
+            except Exception as e:
+                logger.error(f"保存网段缓存失败: {len(updates)} 条, {e}")
+        
+        return len(updates)
     
     def clear(self, cache_type: Optional[str] = None):
         """
         清除缓存
         
         Args:
-            cache_type: 缓存类型，None则清除所有
+            cache_type: 检测层级，None则清除所有
         """
         if not self.enabled:
             return
         
-        # 清除内存缓存
-        if cache_type:
-            keys_to_delete = [
-                k for k, v in self.memory_cache.items() 
-                if v.get('cache_type') == cache_type
-            ]
-            for key in keys_to_delete:
-                del self.memory_cache[key]
-        else:
-            self.memory_cache.clear()
-        
-        # 清除文件缓存
         try:
-            if cache_type:
-                pattern = f"*_{cache_type}.json"
+            if not cache_type:
+                self.memory_cache.clear()
+                self.backend.clear()
+                self.prefixes.clear()
+                if self.prefix_backend:
+                    self.prefix_backend.clear()
             else:
-                pattern = "*.json"
-            
-            for cache_file in self.cache_dir.glob(pattern):
-                cache_file.unlink()
+                # 只移除指定层级，端点的其他层级结果保留
+                self.memory_cache.clear()
+                updates = {}
+                deletes = []
+                for key, entry in self.backend.scan():
+                    tiers = entry.get('tiers', {})
+                    if cache_type not in tiers:
+                        continue
+                    del tiers[cache_type]
+                    entry = {'tiers': tiers}
+                    if tiers:
+                        updates[key] = (entry, self._entry_expires_at(entry))
+                    else:
+                        deletes.append(key)
+                
+                with self.backend.transaction():
+                    self.backend.set_many(updates)
+                    self.backend.delete_many(deletes)
+                
+                if cache_type in PREFIX_TIERS:
+                    self._clear_prefix_tier(cache_type)
             
             logger.info(f"缓存已清除: {cache_type or '全部'}")
         
         except Exception as e:
             logger.error(f"清除缓存失败: {e}")
     
+    def _clear_prefix_tier(self, cache_type: str):
+        """从网段记录中移除指定层级"""
+        if not self.prefix_backend:
+            return
+        
+        updates = {}
+        deletes = []
+        with self._prefix_lock:
+            for network, entry, _ in self.prefixes.items():
+                tiers = dict(entry['tiers'])
+                if tiers.pop(cache_type, None) is None:
+                    continue
+                if tiers:
+                    entry = {'tiers': tiers}
+                    expires_at = self._entry_expires_at(entry)
+                    self.prefixes.put(network, entry, expires_at)
+                    updates[network] = (entry, expires_at)
+                else:
+                    self.prefixes.pop(network)
+                    deletes.append(network)
+        
+        with self.prefix_backend.transaction():
+            self.prefix_backend.set_many(updates)
+            self.prefix_backend.delete_many(deletes)
+    
     def clean_expired(self):
         """清理过期缓存"""
         if not self.enabled:
@@ -186,28 +1068,16 @@ class DetectionCache:
         
         cleaned_count = 0
         
-        # 清理内存缓存
-        expired_keys = [
-            k for k, v in self.memory_cache.items() 
-            if self._is_expired(v)
-        ]
-        for key in expired_keys:
-            del self.memory_cache[key]
-            cleaned_count += 1
+        # 清理内存缓存（所有层级都已过期的记录）
+        cleaned_count += self.memory_cache.sweep()
         
-        # 清理文件缓存
+        # 清理持久化缓存（所有层级都已过期的记录）
         try:
-            for cache_file in self.cache_dir.glob("*.json"):
-                try:
-                    with open(cache_file, 'r', encoding='utf-8') as f:
-                        cached = json.load(f)
-                    
-                    if self._is_expired(cached):
-                        cache_file.unlink()
-                        cleaned_count += 1
-                
-                except Exception as e:
-                    logger.debug(f"清理缓存文件失败: {cache_file}, {e}")
+            cleaned_count += self.backend.delete_expired()
+            
+            if self.prefix_backend:
+                cleaned_count += self.prefixes.sweep()
+                self.prefix_backend.delete_expired()
             
             if cleaned_count > 0:
                 logger.info(f"清理过期缓存: {cleaned_count} 条")
@@ -222,112 +1092,293 @@ class DetectionCache:
         Returns:
             统计信息字典
         """
-        total_requests = self.stats['hits'] + self.stats['misses']
-        hit_rate = (self.stats['hits'] / total_requests * 100) if total_requests > 0 else 0
+        stats = self.stats.snapshot()
+        total_requests = stats['hits'] + stats['misses']
+        hit_rate = (stats['hits'] / total_requests * 100) if total_requests > 0 else 0
         
         return {
             'enabled': self.enabled,
+            'backend': self.backend.name if self.backend else None,
             'memory_cache_size': len(self.memory_cache),
-            'hits': self.stats['hits'],
-            'misses': self.stats['misses'],
+            'hits': stats['hits'],
+            'misses': stats['misses'],
             'hit_rate': f"{hit_rate:.1f}%",
-            'sets': self.stats['sets'],
-            'expired': self.stats['expired']
+            'sets': stats['sets'],
+            'expired': stats['expired'],
+            'stale_hits': stats['stale_hits'],
+            'prefix_hits': stats['prefix_hits'],
+            'prefixes': len(self.prefixes),
+            'history': self.history.get_stats() if self.history else None,
+            'memory': self.memory_cache.get_stats()
         }
     
-    def _make_key(self, ip: str, port: int, cache_type: str) -> str:
-        """生成缓存键"""
-        return f"{ip}:{port}:{cache_type}"
+    def close(self):
+        """提交未写入的缓冲并关闭存储后端"""
+        if not self.backend:
+            return
+        
+        with self._batch_lock:
+            records, self._pending = self._pending, {}
+        self._write_records(records)
+        if self.history:
+            self.history.close()
+        if self.prefix_backend:
+            self.prefix_backend.close()
+        self.backend.close()
     
-    def _get_cache_file(self, ip: str, port: int, cache_type: str) -> Path:
-        """获取缓存文件路径"""
-        # 使用IP和端口作为文件名，避免特殊字符
-        safe_ip = ip.replace('.', '_').replace(':', '_')
-        filename = f"{safe_ip}_{port}_{cache_type}.json"
-        return self.cache_dir / filename
+    def _make_key(self, ip: str, port: int) -> str:
+        """生成缓存键（每个端点一条记录）"""
+        return f"{ip}:{port}"
     
-    def _is_expired(self, cached: Dict) -> bool:
-        """检查缓存是否过期"""
+    def _is_expired(self, cached: Dict, grace: float = 0) -> bool:
+        """检查缓存是否过期（grace为额外的宽限期）"""
         age = time.time() - cached['timestamp']
-        return age > cached['ttl']
+        return age > cached['ttl'] + grace
 
 
 class FailureCache:
-    """失败记录缓存 - 记录检测失败的IP，避免重复尝试"""
+    """
+    失败记录缓存 - 记录检测失败的端点，按指数退避跳过重复尝试
     
-    def __init__(self, retry_delay: int = 3600):
+    每个端点 (ip:port) 一条记录，第n次连续失败后跳过
+    retry_delay * 2^(n-1) 秒（带随机抖动，上限max_retry_delay）。
+    记录持久化到存储后端，定时任务的多次运行之间共享；
+    使用共享后端（Redis）时每次读写都以存储中的记录为准，多个服务副本共享失败状态。
+    """
+    
+    def __init__(self, retry_delay: int = 3600, max_retry_delay: int = 604800,
+                 jitter: float = 0.2, persistent: bool = True, backend: str = 'sqlite',
+                 cache_dir: str = 'cache/ip_detection/failures',
+                 db_path: str = 'cache/ip_detection.db'):
         """
         初始化失败记录缓存
         
         Args:
-            retry_delay: 重试延迟（秒），默认1小时
+            retry_delay: 首次失败后的重试延迟（秒），默认1小时
+            max_retry_delay: 重试延迟上限（秒），默认7天
+            jitter: 重试延迟的随机抖动比例（0.2表示±20%）
+            persistent: 是否持久化失败记录
+            backend: 持久化后端 ('sqlite' 或 'json')
+            cache_dir: JSON后端的存储目录
+            db_path: SQLite数据库文件路径（与检测缓存共用，独立的表）
         """
-        self.failures = {}  # {ip: {'count': int, 'last_failure': float, 'retry_after': float}}
+        self.failures = {}  # {ip:port: {'count': int, 'last_failure': float, 'retry_after': float}}
         self.retry_delay = retry_delay
-        self.max_failures = 3  # 失败3次后才记录
+        self.max_retry_delay = max_retry_delay
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        
+        self.backend: Optional[CacheBackend] = None
+        if persistent:
+            self.backend = create_backend(backend, cache_dir=cache_dir, db_path=db_path, table='failure_cache')
+            self._load()
+    
+    def _load(self):
+        """从持久化存储加载未过期的失败记录"""
+        try:
+            self.backend.delete_expired()
+            for key, record in self.backend.scan():
+                self.failures[key] = {
+                    'count': record['count'],
+                    'last_failure': record['last_failure'],
+                    'retry_after': record['retry_after']
+                }
+        except Exception as e:
+            logger.error(f"加载失败记录失败: {e}")
+            return
+        
+        if self.failures:
+            logger.info(f"已加载失败记录: {len(self.failures)} 个端点")
+    
+    def _backoff_delay(self, count: int) -> float:
+        """第count次连续失败后的重试延迟（指数退避 + 随机抖动）"""
+        delay = min(self.retry_delay * 2 ** min(count - 1, 32), self.max_retry_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
     
-    def record_failure(self, ip: str):
+    def record_failure(self, ip: str, port: int = 443):
         """
         记录失败
         
         Args:
             ip: IP地址
+            port: 端口号
         """
+        key = self._make_key(ip, port)
+        self._sync(key)
         now = time.time()
         
-        if ip not in self.failures:
-            self.failures[ip] = {
-                'count': 1,
+        with self._lock:
+            count = self.failures.get(key, {}).get('count', 0) + 1
+            failure = self.failures[key] = {
+                'count': count,
                 'last_failure': now,
-                'retry_after': now + self.retry_delay
+                'retry_after': now + self._backoff_delay(count)
             }
-        else:
-            self.failures[ip]['count'] += 1
-            self.failures[ip]['last_failure'] = now
-            self.failures[ip]['retry_after'] = now + self.retry_delay
         
-        logger.debug(f"记录失败: {ip}, 失败次数: {self.failures[ip]['count']}")
+        self._persist(key, failure)
+        logger.debug(
+            f"记录失败: {key}, 失败次数: {count}, "
+            f"{failure['retry_after'] - now:.0f}秒后重试"
+        )
     
-    def should_skip(self, ip: str) -> bool:
+    def should_skip(self, ip: str, port: int = 443) -> bool:
         """
-        检查是否应该跳过此IP
+        检查是否应该跳过此端点
         
         Args:
             ip: IP地址
+            port: 端口号
             
         Returns:
             bool: 是否应该跳过
         """
-        if ip not in self.failures:
-            return False
-        
-        failure = self.failures[ip]
+        key = self._make_key(ip, port)
+        self._sync(key)
         
-        # 失败次数未达到阈值
-        if failure['count'] < self.max_failures:
-            return False
-        
-        # 检查是否到了重试时间
-        now = time.time()
-        if now >= failure['retry_after']:
-            # 重置失败记录，允许重试
-            del self.failures[ip]
-            logger.debug(f"重试时间到，清除失败记录: {ip}")
-            return False
+        with self._lock:
+            failure = self.failures.get(key)
+            if failure is None:
+                return False
+            
+            # 到了重试时间则允许重试，失败次数保留用于下一次退避
+            if time.time() >= failure['retry_after']:
+                return False
+            
+            count = failure['count']
         
-        logger.debug(f"跳过失败IP: {ip}, 失败次数: {failure['count']}")
+        logger.debug(f"跳过失败端点: {key}, 失败次数: {count}")
         return True
     
-    def clear_failure(self, ip: str):
+    def clear_failure(self, ip: str, port: int = 443):
         """
         清除失败记录（检测成功时调用）
         
         Args:
             ip: IP地址
+            port: 端口号
+        """
+        key = self._make_key(ip, port)
+        
+        with self._lock:
+            removed = self.failures.pop(key, None)
+        
+        # 共享后端的记录在should_skip时已同步到本地，本地没有即存储中也没有
+        if removed is not None:
+            if self.backend:
+                try:
+                    self.backend.delete_many([key])
+                except Exception as e:
+                    logger.error(f"删除失败记录失败: {key}, {e}")
+            logger.debug(f"清除失败记录: {key}")
+    
+    def _sync(self, key: str):
+        """共享后端：用存储中的记录更新本地副本（其他副本可能已记录或清除失败）"""
+        if not self.backend or not self.backend.shared:
+            return
+        
+        try:
+            record = self.backend.get(key)
+        except Exception as e:
+            logger.debug(f"读取共享失败记录失败: {key}, {e}")
+            return
+        
+        with self._lock:
+            if record is None:
+                self.failures.pop(key, None)
+            else:
+                self.failures[key] = {
+                    'count': record['count'],
+                    'last_failure': record['last_failure'],
+                    'retry_after': record['retry_after']
+                }
+    
+    def clean_expired(self) -> int:
+        """
+        清理长期未再失败的记录（超过重试时间再加上延迟上限）
+        
+        Returns:
+            清理的记录数
+        """
+        now = time.time()
+        
+        with self._lock:
+            expired = [
+                key for key, failure in self.failures.items()
+                if self._expires_at(failure) < now
+            ]
+            for key in expired:
+                del self.failures[key]
+        
+        if self.backend:
+            try:
+                self.backend.delete_expired(now)
+            except Exception as e:
+                logger.error(f"清理失败记录失败: {e}")
+        
+        return len(expired)
+    
+    def export_records(self) -> List[Tuple[str, Dict, float]]:
+        """
+        导出全部失败记录（用于快照）
+        
+        Returns:
+            [(键, 失败记录, 保留期限)] 列表
+        """
+        with self._lock:
+            return [(key, dict(failure), self._expires_at(failure)) for key, failure in self.failures.items()]
+    
+    def import_records(self, records: Iterable[Tuple[str, Dict, float]]) -> int:
+        """
+        批量导入失败记录（用于快照恢复），同一端点保留最近一次失败的记录
+        
+        Args:
+            records: [(键, 失败记录, 保留期限)] 列表
+            
+        Returns:
+            导入（新增或更新）的记录数
         """
-        if ip in self.failures:
-            del self.failures[ip]
-            logger.debug(f"清除失败记录: {ip}")
+        now = time.time()
+        updates = {}
+        
+        with self._lock:
+            for key, record, expires_at in records:
+                if expires_at < now:
+                    continue
+                current = self.failures.get(key)
+                if current is not None and current['last_failure'] >= record['last_failure']:
+                    continue
+                failure = self.failures[key] = {
+                    'count': record['count'],
+                    'last_failure': record['last_failure'],
+                    'retry_after': record['retry_after']
+                }
+                updates[key] = (failure, self._expires_at(failure))
+        
+        if updates and self.backend:
+            try:
+                self.backend.set_many(updates)
+            except Exception as e:
+                logger.error(f"保存失败记录失败: {len(updates)} 条, {e}")
+        
+        return len(updates)
+    
+    def _persist(self, key: str, failure: Dict):
+        """写入持久化存储"""
+        if not self.backend:
+            return
+        
+        try:
+            self.backend.set(key, failure, self._expires_at(failure))
+        except Exception as e:
+            logger.error(f"保存失败记录失败: {key}, {e}")
+    
+    def _expires_at(self, failure: Dict) -> float:
+        """记录的保留期限：超过后不再参与退避计算"""
+        return failure['retry_after'] + self.max_retry_delay
+    
+    def _make_key(self, ip: str, port: int) -> str:
+        """生成记录键（每个端点一条记录）"""
+        return f"{ip}:{port}"
     
     def get_stats(self) -> Dict:
         """
@@ -336,17 +1387,27 @@ class FailureCache:
         Returns:
             统计信息字典
         """
+        now = time.time()
+        with self._lock:
+            failures = {key: dict(info) for key, info in self.failures.items()}
+        
         return {
-            'total_failures': len(self.failures),
+            'total_failures': len(failures),
+            'skipping': sum(1 for info in failures.values() if info['retry_after'] > now),
             'failures': {
-                ip: {
+                key: {
                     'count': info['count'],
                     'last_failure': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info['last_failure'])),
                     'retry_after': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info['retry_after']))
                 }
-                for ip, info in self.failures.items()
+                for key, info in failures.items()
             }
         }
+    
+    def close(self):
+        """关闭存储后端"""
+        if self.backend:
+            self.backend.close()
 
 
 if __name__ == '__main__':
@@ -358,7 +1419,7 @@ if __name__ == '__main__':
     
     # 测试DetectionCache
     print("测试DetectionCache:")
-    cache = DetectionCache(cache_dir='cache/test_detection')
+    cache = DetectionCache(cache_dir='cache/test_detection', db_path='cache/test_detection.db')
     
     # 设置缓存
     test_data = {
@@ -369,7 +1430,7 @@ if __name__ == '__main__':
     cache.set('104.16.132.229', test_data, cache_type='cf_ray')
     
     # 获取缓存
-    result = cache.get('104.16.132.229', cache_type='cf_ray')
+    result = cache.get('104.16.132.229', min_tier='cf_ray')
     print(f"缓存结果: {result}")
     
     # 统计信息
@@ -377,15 +1438,17 @@ if __name__ == '__main__':
     
     # 测试FailureCache
     print("\n测试FailureCache:")
-    failure_cache = FailureCache(retry_delay=5)
+    failure_cache = FailureCache(retry_delay=2, jitter=0, persistent=False)
     
     # 记录失败
     test_ip = '1.2.3.4'
-    for i in range(4):
-        failure_cache.record_failure(test_ip)
-        print(f"失败{i+1}次, 是否跳过: {failure_cache.should_skip(test_ip)}")
+    failure_cache.record_failure(test_ip)
+    print(f"失败1次, 是否跳过: {failure_cache.should_skip(test_ip)}")
     
     # 等待重试时间
-    print("等待5秒...")
-    time.sleep(5)
-    print(f"5秒后是否跳过: {failure_cache.should_skip(test_ip)}")
\ No newline at end of file
+    print("等待2秒...")
+    time.sleep(2)
+    print(f"2秒后是否跳过: {failure_cache.should_skip(test_ip)}")
+    
+    failure_cache.record_failure(test_ip)
+    print(f"失败2次, 退避后的统计: {failure_cache.get_stats()}")
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+端点历史模块
+记录每个端点每个检测层级的结果变化情况，据此为缓存计算自适应TTL
+"""
+
+import time
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .cache_backends import CacheBackend, create_backend
+
+logger = logging.getLogger(__name__)
+
+# 参与比较的位置字段：这些字段不变即视为结果稳定
+FINGERPRINT_FIELDS = ('country', 'city', 'colo')
+
+
+class EndpointHistory:
+    """
+    端点结果稳定性历史
+
+    每次端点的检测结果写入缓存时，与上一次结果比较：
+    结果未变则TTL倍率翻倍（上限max_factor），结果变化则倍率减半（下限min_factor）。
+    历史与检测缓存分开存放，缓存条目过期后历史仍然保留。
+    """
+
+    def __init__(self, min_factor: float = 0.25, max_factor: float = 4.0,
+                 retention: int = 30 * 86400, persistent: bool = True, backend: str = 'sqlite',
+                 cache_dir: str = 'cache/ip_detection/history',
+                 db_path: str = 'cache/ip_detection.db'):
+        """
+        初始化端点历史
+
+        Args:
+            min_factor: TTL倍率下限（频繁变化的端点）
+            max_factor: TTL倍率上限（长期稳定的端点）
+            retention: 历史记录在最后一次更新后的保留时间（秒）
+            persistent: 是否持久化历史记录
+            backend: 持久化后端 ('sqlite' 或 'json')
+            cache_dir: JSON后端的存储目录
+            db_path: SQLite数据库文件路径（与检测缓存共用，独立的表）
+        """
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.retention = retention
+
+        self._records = {}  # {ip:port|tier: {'factor', 'fingerprint', 'observations', 'changes', 'updated'}}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+        self.backend: Optional[CacheBackend] = None
+        if persistent:
+            self.backend = create_backend(backend, cache_dir=cache_dir, db_path=db_path, table='endpoint_history')
+            self._load()
+
+    def _load(self):
+        """从持久化存储加载历史记录"""
+        try:
+            self.backend.delete_expired()
+            for key, record in self.backend.scan():
+                self._records[key] = {
+                    'factor': record['factor'],
+                    'fingerprint': record['fingerprint'],
+                    'observations': record['observations'],
+                    'changes': record['changes'],
+                    'updated': record['updated']
+                }
+        except Exception as e:
+            logger.error(f"加载端点历史失败: {e}")
+
+    def observe(self, endpoint: str, tier: str, data: Dict, base_ttl: int) -> int:
+        """
+        记录一次检测结果并返回该结果应使用的TTL
+
+        Args:
+            endpoint: 端点键 (ip:port)
+            tier: 检测层级
+            data: 位置信息
+            base_ttl: 该层级的基准TTL（秒）
+
+        Returns:
+            自适应后的TTL（秒）
+        """
+        key = f"{endpoint}|{tier}"
+        fingerprint = '|'.join(str(data.get(field) or '') for field in FINGERPRINT_FIELDS)
+
+        with self._lock:
+            record = self._records.get(key)
+
+            if record is None:
+                record = {'factor': 1.0, 'fingerprint': fingerprint, 'observations': 1, 'changes': 0}
+            elif record['fingerprint'] == fingerprint:
+                record = dict(record, factor=min(record['factor'] * 2, self.max_factor),
+                              observations=record['observations'] + 1)
+            else:
+                logger.debug(f"端点结果变化: {key}, {record['fingerprint']} -> {fingerprint}")
+                record = dict(record, factor=max(record['factor'] / 2, self.min_factor),
+                              fingerprint=fingerprint, observations=record['observations'] + 1,
+                              changes=record['changes'] + 1)
+
+            record['updated'] = time.time()
+            self._records[key] = record
+            self._dirty.add(key)
+
+        return int(base_ttl * record['factor'])
+
+    def get(self, endpoint: str, tier: str) -> Optional[Dict]:
+        """获取端点某一层级的历史记录"""
+        with self._lock:
+            record = self._records.get(f"{endpoint}|{tier}")
+            return dict(record) if record else None
+
+    def flush(self):
+        """将变更的历史记录写入持久化存储"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            records = {
+                key: (self._records[key], self._records[key]['updated'] + self.retention)
+                for key in dirty
+            }
+
+        if not records or not self.backend:
+            return
+
+        try:
+            self.backend.set_many(records)
+        except Exception as e:
+            logger.error(f"保存端点历史失败: {len(records)} 条, {e}")
+
+    def export_records(self) -> List[Tuple[str, Dict, float]]:
+        """
+        导出全部历史记录（用于快照）
+
+        Returns:
+            [(键, 历史记录, 保留期限)] 列表
+        """
+        with self._lock:
+            return [
+                (key, dict(record), record['updated'] + self.retention)
+                for key, record in self._records.items()
+            ]
+
+    def import_records(self, records: Iterable[Tuple[str, Dict, float]]) -> int:
+        """
+        批量导入历史记录（用于快照恢复），同一键保留较新的记录
+
+        Args:
+            records: [(键, 历史记录, 保留期限)] 列表
+
+        Returns:
+            导入（新增或更新）的记录数
+        """
+        now = time.time()
+        imported = 0
+
+        with self._lock:
+            for key, record, expires_at in records:
+                if expires_at < now:
+                    continue
+                current = self._records.get(key)
+                if current is not None and current['updated'] >= record['updated']:
+                    continue
+                self._records[key] = {
+                    'factor': min(max(record['factor'], self.min_factor), self.max_factor),
+                    'fingerprint': record['fingerprint'],
+                    'observations': record['observations'],
+                    'changes': record['changes'],
+                    'updated': record['updated']
+                }
+                self._dirty.add(key)
+                imported += 1
+
+        self.flush()
+        return imported
+
+    def get_stats(self) -> Dict:
+        """
+        获取统计信息
+
+        Returns:
+            统计信息字典
+        """
+        with self._lock:
+            records = list(self._records.values())
+
+        return {
+            'endpoints': len(records),
+            'stable': sum(1 for r in records if r['factor'] >= self.max_factor),
+            'volatile': sum(1 for r in records if r['factor'] <= self.min_factor),
+            'changes': sum(r['changes'] for r in records)
+        }
+
+    def close(self):
+        """写入未保存的变更并关闭存储后端"""
+        self.flush()
+        if self.backend:
+            self.backend.close()
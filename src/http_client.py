@@ -0,0 +1,532 @@
+"""
+共享HTTP客户端模块
+所有模块共用一个带连接池的Session：按主机复用keep-alive连接，
+统一的重试/退避策略，按主机熔断，并记录每个主机的请求指标。
+异步客户端（aiohttp）与同步客户端共用重试策略、熔断器和指标
+"""
+
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .concurrency import AtomicCounters
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """主机熔断中，请求未发出（继承ConnectionError，原有的异常处理无需修改）"""
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"{host} 熔断中, {retry_after:.0f}秒后重试")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    单个主机的熔断器
+
+    连续失败达到阈值后打开，冷却期内直接拒绝请求；
+    冷却结束后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, host: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        """
+        初始化熔断器
+
+        Args:
+            host: 主机名（用于日志）
+            failure_threshold: 打开熔断的连续失败次数
+            reset_timeout: 熔断冷却时间（秒）
+        """
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """当前是否允许发出请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            # 半开状态只放行一个探测请求
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def retry_after(self) -> float:
+        """距离熔断冷却结束的秒数"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        """记录一次成功"""
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"{self.host} 恢复正常，关闭熔断")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """记录一次失败"""
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                logger.warning(f"{self.host} 连续失败 {self._failures} 次，熔断 {self.reset_timeout:.0f}秒")
+
+
+class RetryPolicy:
+    """
+    统一的重试策略
+
+    连接错误、超时和网关类错误（502/503/504）按指数退避重试，退避时间带随机抖动。
+    默认只重试幂等方法；非幂等请求需由调用方显式指定重试次数。
+    """
+
+    RETRY_STATUSES = frozenset({502, 503, 504})
+    IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+    def __init__(self, max_retries: int = 2, backoff: float = 0.5, max_backoff: float = 10.0):
+        """
+        初始化重试策略
+
+        Args:
+            max_retries: 最大重试次数（不含第一次请求）
+            backoff: 首次重试的基础退避时间（秒），之后每次翻倍
+            max_backoff: 单次退避时间上限（秒）
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def retries_for(self, method: str) -> int:
+        """某个方法默认的重试次数"""
+        return self.max_retries if method.upper() in self.IDEMPOTENT_METHODS else 0
+
+    def delay(self, attempt: int) -> float:
+        """第attempt次重试前的等待时间（全抖动：0到退避上限之间随机）"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    @staticmethod
+    def is_retryable_error(error: Exception) -> bool:
+        """异常是否值得重试"""
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)) \
+            and not isinstance(error, (CircuitOpenError, requests.exceptions.SSLError))
+
+
+class HTTPClient:
+    """
+    共享HTTP客户端
+
+    所有模块通过同一个Session发出请求：每个主机一个连接池，池大小与配置的并发数一致，
+    连接保持keep-alive复用。重试、熔断和指标统一在这里处理，按主机（或调用方指定的name）区分。
+    """
+
+    def __init__(self, pool_size: int = 10, pool_hosts: int = 32, max_retries: int = 2,
+                 backoff: float = 0.5, failure_threshold: int = 5, reset_timeout: float = 30,
+                 user_agent: Optional[str] = None):
+        """
+        初始化HTTP客户端
+
+        Args:
+            pool_size: 每个主机连接池的最大连接数
+            pool_hosts: 保留连接池的主机数
+            max_retries: 幂等请求的默认重试次数
+            backoff: 重试的基础退避时间（秒）
+            failure_threshold: 主机熔断的连续失败次数
+            reset_timeout: 熔断冷却时间（秒）
+            user_agent: 默认User-Agent
+        """
+        self.pool_size = pool_size
+        self.retry = RetryPolicy(max_retries, backoff)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.session = requests.Session()
+        # 重试由RetryPolicy统一处理，适配器本身不重试
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size,
+                              max_retries=0, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if user_agent:
+            self.session.headers['User-Agent'] = user_agent
+
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._metrics: Dict[str, AtomicCounters] = {}
+        self._lock = threading.Lock()
+        
+        # 录制/回放（见http_replay模块）：录制时写入真实响应，回放时请求改发到回放服务器
+        self.recorder = None
+        self.replay = None
+
+    def _breaker(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def _counters(self, name: str) -> AtomicCounters:
+        with self._lock:
+            counters = self._metrics.get(name)
+            if counters is None:
+                counters = self._metrics[name] = AtomicCounters({
+                    'requests': 0, 'errors': 0, 'retries': 0, 'rejected': 0, 'latency_total': 0.0
+                })
+            return counters
+
+    def request(self, method: str, url: str, name: Optional[str] = None,
+                retries: Optional[int] = None, circuit: bool = True, **kwargs) -> requests.Response:
+        """
+        发送请求
+
+        Args:
+            method: HTTP方法
+            url: 请求地址
+            name: 指标和熔断的分组名，默认为主机名
+            retries: 重试次数，默认按RetryPolicy（幂等方法使用全局重试次数，其他方法不重试）
+            circuit: 是否使用熔断（逐个探测大量不同IP时应关闭）
+            **kwargs: 传给requests的其他参数
+
+        Returns:
+            响应对象（重试用尽后返回最后一次的响应）
+
+        Raises:
+            CircuitOpenError: 主机熔断中
+            requests.RequestException: 重试用尽后仍然失败
+        """
+        name = name or urlsplit(url).netloc
+        retries = self.retry.retries_for(method) if retries is None else retries
+        breaker = self._breaker(name) if circuit else None
+        counters = self._counters(name)
+        target, send_kwargs = self.replay.route(method, url, kwargs) if self.replay else (url, kwargs)
+
+        attempt = 0
+        while True:
+            if breaker and not breaker.allow():
+                counters.incr('rejected')
+                raise CircuitOpenError(name, breaker.retry_after())
+
+            counters.incr('requests')
+            start_time = time.monotonic()
+            try:
+                response = self.session.request(method, target, **send_kwargs)
+            except requests.exceptions.RequestException as e:
+                counters.incr('latency_total', time.monotonic() - start_time)
+                counters.incr('errors')
+                if breaker:
+                    breaker.record_failure()
+                if attempt >= retries or not self.retry.is_retryable_error(e):
+                    raise
+                logger.debug(f"{name} 请求失败，准备重试 ({attempt + 1}/{retries}): {e}")
+            else:
+                elapsed = time.monotonic() - start_time
+                counters.incr('latency_total', elapsed)
+                if response.status_code not in self.retry.RETRY_STATUSES:
+                    if breaker:
+                        breaker.record_success()
+                    self._record(method, url, kwargs, response, elapsed)
+                    return response
+
+                counters.incr('errors')
+                if breaker:
+                    breaker.record_failure()
+                if attempt >= retries:
+                    self._record(method, url, kwargs, response, elapsed)
+                    return response
+                response.close()
+                logger.debug(f"{name} 返回 {response.status_code}，准备重试 ({attempt + 1}/{retries})")
+
+            counters.incr('retries')
+            time.sleep(self.retry.delay(attempt))
+            attempt += 1
+
+    def _record(self, method: str, url: str, kwargs: Dict, response, elapsed: float):
+        """录制模式下写入返回给调用方的响应（流式响应不录制）"""
+        if self.recorder is None:
+            return
+        try:
+            content = None if kwargs.get('stream') else response.content
+            self.recorder.record(method, url, kwargs, response.status_code, response.headers, content, elapsed)
+        except Exception as e:
+            logger.warning(f"录制响应失败: {url}, {e}")
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """发送GET请求"""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """发送POST请求"""
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        """发送DELETE请求"""
+        return self.request('DELETE', url, **kwargs)
+
+    def get_stats(self, names: Optional[Iterable[str]] = None) -> Dict[str, Dict]:
+        """
+        获取各主机的请求指标
+
+        Args:
+            names: 只返回这些分组，默认全部
+
+        Returns:
+            {分组名: {'requests', 'errors', 'retries', 'rejected', 'avg_latency_ms', 'circuit'}}
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            breakers = dict(self._breakers)
+
+        stats = {}
+        for name, counters in metrics.items():
+            if names is not None and name not in names:
+                continue
+            values = counters.snapshot()
+            latency_total = values.pop('latency_total')
+            values['avg_latency_ms'] = round(latency_total / values['requests'] * 1000, 1) if values['requests'] else 0.0
+            values['circuit'] = breakers[name].state if name in breakers else CircuitBreaker.CLOSED
+            stats[name] = values
+        return stats
+
+    def close(self):
+        """关闭所有连接池（回放模式下同时停止回放服务器）"""
+        self.session.close()
+        if self.replay is not None:
+            self.replay.stop()
+            self.replay = None
+
+
+class AsyncResponse:
+    """异步请求的响应（已读取完整内容），提供与requests.Response相同的常用属性"""
+
+    def __init__(self, status_code: int, headers, content: bytes, url: str):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        """状态码表示错误时抛出requests.HTTPError"""
+        if not self.ok:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class AsyncHTTPClient:
+    """
+    异步HTTP客户端
+
+    在一个事件循环上并发发出大量请求，所有请求共用一个aiohttp连接池（keep-alive）。
+    重试策略、熔断器和请求指标与同步的HTTPClient共用；aiohttp的异常转换为对应的requests异常，
+    调用方可以沿用同步代码的异常处理。需在事件循环中以 async with 使用。
+    """
+
+    def __init__(self, client: Optional[HTTPClient] = None, limit: int = 100, limit_per_host: int = 0):
+        """
+        初始化异步HTTP客户端
+
+        Args:
+            client: 共用重试策略、熔断器和指标的同步客户端，默认为全局客户端
+            limit: 连接池的最大连接数
+            limit_per_host: 每个主机的最大连接数，0表示不单独限制
+        """
+        if not AIOHTTP_AVAILABLE:
+            raise ImportError("请安装aiohttp库: pip install aiohttp")
+
+        self.client = client or get_http_client()
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self._session = None
+
+    async def __aenter__(self) -> 'AsyncHTTPClient':
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers={'User-Agent': self.client.session.headers.get('User-Agent', 'python-requests')}
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        self._session = None
+
+    async def _send(self, method: str, url: str, timeout: Optional[float] = None,
+                    verify: bool = True, **kwargs) -> AsyncResponse:
+        """发出一次请求并读取完整响应，aiohttp异常转换为requests异常"""
+        kwargs.pop('proxies', None)  # aiohttp默认不使用环境变量中的代理
+        if timeout:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        if not verify:
+            kwargs['ssl'] = False
+        try:
+            async with self._session.request(method, url, **kwargs) as response:
+                content = await response.read()
+                return AsyncResponse(response.status, response.headers, content, str(response.url))
+        except asyncio.TimeoutError as e:
+            raise requests.exceptions.Timeout(f"{url} 请求超时") from e
+        except aiohttp.ClientSSLError as e:
+            raise requests.exceptions.SSLError(str(e)) from e
+        except aiohttp.ClientConnectionError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        except aiohttp.ClientError as e:
+            raise requests.exceptions.RequestException(str(e)) from e
+
+    async def request(self, method: str, url: str, name: Optional[str] = None,
+                      retries: Optional[int] = None, circuit: bool = True, **kwargs) -> AsyncResponse:
+        """
+        发送异步请求（参数和重试、熔断规则与HTTPClient.request相同）
+
+        Returns:
+            响应对象（重试用尽后返回最后一次的响应）
+
+        Raises:
+            CircuitOpenError: 主机熔断中
+            requests.RequestException: 重试用尽后仍然失败
+        """
+        client = self.client
+        name = name or urlsplit(url).netloc
+        retries = client.retry.retries_for(method) if retries is None else retries
+        breaker = client._breaker(name) if circuit else None
+        counters = client._counters(name)
+        target, send_kwargs = client.replay.route(method, url, kwargs) if client.replay else (url, kwargs)
+
+        attempt = 0
+        while True:
+            if breaker and not breaker.allow():
+                counters.incr('rejected')
+                raise CircuitOpenError(name, breaker.retry_after())
+
+            counters.incr('requests')
+            start_time = time.monotonic()
+            try:
+                response = await self._send(method, target, **send_kwargs)
+            except requests.exceptions.RequestException as e:
+                counters.incr('latency_total', time.monotonic() - start_time)
+                counters.incr('errors')
+                if breaker:
+                    breaker.record_failure()
+                if attempt >= retries or not client.retry.is_retryable_error(e):
+                    raise
+                logger.debug(f"{name} 请求失败，准备重试 ({attempt + 1}/{retries}): {e}")
+            else:
+                elapsed = time.monotonic() - start_time
+                counters.incr('latency_total', elapsed)
+                if response.status_code not in client.retry.RETRY_STATUSES:
+                    if breaker:
+                        breaker.record_success()
+                    client._record(method, url, kwargs, response, elapsed)
+                    return response
+
+                counters.incr('errors')
+                if breaker:
+                    breaker.record_failure()
+                if attempt >= retries:
+                    client._record(method, url, kwargs, response, elapsed)
+                    return response
+                logger.debug(f"{name} 返回 {response.status_code}，准备重试 ({attempt + 1}/{retries})")
+
+            counters.incr('retries')
+            await asyncio.sleep(client.retry.delay(attempt))
+            attempt += 1
+
+    async def get(self, url: str, **kwargs) -> AsyncResponse:
+        """发送GET请求"""
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> AsyncResponse:
+        """发送POST请求"""
+        return await self.request('POST', url, **kwargs)
+
+
+# 全局客户端实例
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> HTTPClient:
+    """
+    获取全局HTTP客户端（首次调用时按配置创建）
+
+    Returns:
+        HTTPClient实例
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                from .config import Config
+                config = Config()
+
+                # 连接池大小与最大的并发数一致，避免并发线程因连接池不足而反复新建连接
+                pool_size = getattr(config, 'http_pool_size', 0) or max(
+                    10,
+                    getattr(config, 'detection_max_workers', 10),
+                    getattr(config, 'cf_ray_max_workers', 5),
+                    getattr(config, 'cache_refresh_workers', 4)
+                )
+                _http_client = HTTPClient(
+                    pool_size=pool_size,
+                    pool_hosts=getattr(config, 'http_pool_hosts', 32),
+                    max_retries=getattr(config, 'api_max_retries', 2),
+                    backoff=getattr(config, 'http_retry_backoff', 0.5),
+                    failure_threshold=getattr(config, 'http_circuit_threshold', 5),
+                    reset_timeout=getattr(config, 'http_circuit_reset', 30)
+                )
+
+                replay_file = getattr(config, 'http_replay_file', '')
+                record_file = getattr(config, 'http_record_file', '')
+                if replay_file:
+                    from .http_replay import enable_replay
+                    enable_replay(_http_client, replay_file, getattr(config, 'http_replay_profile', ''))
+                elif record_file:
+                    from .http_replay import enable_recording
+                    enable_recording(_http_client, record_file)
+    return _http_client
@@ -0,0 +1,449 @@
+"""
+HTTP录制/回放模块
+录制模式下，共享HTTP客户端把真实响应写入夹具文件（JSON Lines）；
+回放模式下，所有请求改发到本机回环地址上的回放服务器，由其按夹具返回响应，
+并可按主机配置延迟、错误和限流，使 获取 → 检测 的完整流程可以离线、以接近真实的速度运行
+"""
+
+import json
+import time
+import base64
+import random
+import hashlib
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .concurrency import AtomicCounters
+
+logger = logging.getLogger(__name__)
+
+# 回放时通过这些请求头把原始请求信息传给回放服务器
+URL_HEADER = 'X-Replay-Url'
+HOST_HEADER = 'X-Replay-Host'
+BODY_HEADER = 'X-Replay-Body'
+
+# 不写入夹具的响应头（内容已解压，长度和连接由回放服务器重新生成）
+SKIPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive', 'date'}
+
+
+def body_digest(kwargs: Dict) -> str:
+    """
+    请求体的摘要（录制和回放按相同的请求参数计算）
+
+    Args:
+        kwargs: 传给HTTP客户端的请求参数
+
+    Returns:
+        摘要字符串，没有请求体时为空字符串
+    """
+    if kwargs.get('json') is not None:
+        raw = json.dumps(kwargs['json'], sort_keys=True, ensure_ascii=False).encode('utf-8')
+    elif kwargs.get('data') is not None:
+        data = kwargs['data']
+        raw = data if isinstance(data, bytes) else str(data).encode('utf-8')
+    else:
+        return ''
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+
+def _explicit_host(kwargs: Dict) -> str:
+    """调用方显式指定的Host请求头（如CF-RAY检测对同一IP尝试多个Host）"""
+    for key, value in (kwargs.get('headers') or {}).items():
+        if key.lower() == 'host':
+            return value
+    return ''
+
+
+class FixtureStore:
+    """
+    录制的响应
+
+    每条记录以 (方法, URL, Host, 请求体摘要) 为键；同一个键录制了多次时按顺序轮流返回。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        初始化夹具存储
+
+        Args:
+            path: 夹具文件路径（JSON Lines），None则为空
+        """
+        self._records: Dict[Tuple[str, str, str, str], list] = {}
+        self._cursor: Dict[Tuple[str, str, str, str], int] = {}
+        self._lock = threading.Lock()
+        if path and Path(path).exists():
+            self.load(path)
+
+    @staticmethod
+    def key(method: str, url: str, host: str = '', body: str = '') -> Tuple[str, str, str, str]:
+        return (method.upper(), url, host, body)
+
+    def load(self, path: str):
+        """加载夹具文件"""
+        count = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"跳过无效的夹具记录: {line[:80]}")
+                    continue
+                self.add(record)
+                count += 1
+        logger.info(f"已加载HTTP夹具: {path}, {count} 条, {len(self._records)} 个请求")
+
+    def add(self, record: Dict):
+        """添加一条记录"""
+        key = self.key(record['method'], record['url'], record.get('host', ''), record.get('body', ''))
+        with self._lock:
+            self._records.setdefault(key, []).append(record)
+
+    def find(self, method: str, url: str, host: str = '', body: str = '') -> Optional[Dict]:
+        """
+        查找录制的响应
+
+        Returns:
+            夹具记录，没有录制时返回None
+        """
+        key = self.key(method, url, host, body)
+        with self._lock:
+            records = self._records.get(key)
+            if not records:
+                return None
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            return records[index % len(records)]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(records) for records in self._records.values())
+
+
+class HTTPRecorder:
+    """把真实响应追加写入夹具文件"""
+
+    def __init__(self, path: str, max_body: int = 5 * 1024 * 1024):
+        """
+        初始化录制器
+
+        Args:
+            path: 夹具文件路径（JSON Lines，追加写入）
+            max_body: 录制的最大响应体字节数，更大的响应（如数据库下载）不录制
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_body = max_body
+        self._lock = threading.Lock()
+        self.stats = AtomicCounters({'recorded': 0, 'skipped': 0})
+
+    def record(self, method: str, url: str, kwargs: Dict, status_code: int, headers, content: Optional[bytes],
+               elapsed: float):
+        """
+        记录一次响应
+
+        Args:
+            method: HTTP方法
+            url: 原始请求地址
+            kwargs: 请求参数（用于计算Host和请求体摘要）
+            status_code: 响应状态码
+            headers: 响应头
+            content: 响应体，None表示流式响应（不录制）
+            elapsed: 请求耗时（秒）
+        """
+        if content is None or len(content) > self.max_body:
+            self.stats.incr('skipped')
+            return
+
+        record = {
+            'method': method.upper(),
+            'url': url,
+            'host': _explicit_host(kwargs),
+            'body': body_digest(kwargs),
+            'status': status_code,
+            'headers': {k: v for k, v in headers.items() if k.lower() not in SKIPPED_HEADERS},
+            'elapsed': round(elapsed, 4),
+        }
+        try:
+            record['text'] = content.decode('utf-8')
+        except UnicodeDecodeError:
+            record['base64'] = base64.b64encode(content).decode('ascii')
+
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        self.stats.incr('recorded')
+
+
+class ReplayProfile:
+    """
+    一个主机的回放行为
+
+    延迟默认使用录制时的耗时乘以latency_scale；设置latency_ms后改为按正态分布随机（jitter_ms为标准差）。
+    error_rate的请求返回503，reset_rate的请求直接断开连接，timeout_rate的请求在timeout_delay后才返回；
+    设置rate_limit后按固定窗口计数，超出时返回429并带上Retry-After和X-RateLimit-*响应头。
+    """
+
+    def __init__(self, latency_scale: float = 1.0, latency_ms: Optional[float] = None, jitter_ms: float = 0,
+                 error_rate: float = 0, reset_rate: float = 0, timeout_rate: float = 0,
+                 timeout_delay: float = 30, rate_limit: Optional[int] = None, rate_window: float = 60,
+                 miss_latency_ms: float = 50):
+        """
+        初始化回放行为
+
+        Args:
+            latency_scale: 录制耗时的倍数
+            latency_ms: 固定的平均延迟（毫秒）
+            jitter_ms: 延迟的标准差（毫秒）
+            error_rate: 返回503的比例
+            reset_rate: 断开连接的比例
+            timeout_rate: 超时的比例
+            timeout_delay: 超时请求的响应延迟（秒）
+            rate_limit: 每个窗口允许的请求数
+            rate_window: 限流窗口（秒）
+            miss_latency_ms: 没有录制的请求返回404前的延迟（毫秒）
+        """
+        self.latency_scale = latency_scale
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_delay = timeout_delay
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.miss_latency_ms = miss_latency_ms
+
+        self._window_start = 0.0
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ReplayProfile':
+        return cls(**data)
+
+    def latency(self, record: Optional[Dict]) -> float:
+        """本次响应的延迟（秒）"""
+        if record is None:
+            return self.miss_latency_ms / 1000
+        if self.latency_ms is not None:
+            return max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        return record.get('elapsed', 0) * self.latency_scale
+
+    def take(self) -> Tuple[bool, int, float]:
+        """
+        按限流窗口计数
+
+        Returns:
+            (是否允许, 窗口内剩余请求数, 距离窗口重置的秒数)
+        """
+        if not self.rate_limit:
+            return True, -1, 0.0
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.rate_window:
+                self._window_start = now
+                self._window_count = 0
+            reset_in = self.rate_window - (now - self._window_start)
+            if self._window_count >= self.rate_limit:
+                return False, 0, reset_in
+            self._window_count += 1
+            return True, self.rate_limit - self._window_count, reset_in
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        server: ReplayServer = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+
+        url = self.headers.get(URL_HEADER, '')
+        host = urlsplit(url).hostname or ''
+        profile = server.profile_for(host)
+        server.stats.incr('requests')
+
+        allowed, remaining, reset_in = profile.take()
+        if not allowed:
+            server.stats.incr('rate_limited')
+            self._reply(429, {'Retry-After': str(max(1, round(reset_in))), 'X-RateLimit-Remaining': '0',
+                              'X-RateLimit-Reset': str(round(reset_in))}, b'Too Many Requests')
+            return
+
+        roll = random.random()
+        if roll < profile.reset_rate:
+            server.stats.incr('resets')
+            self.close_connection = True
+            self.connection.close()
+            return
+        if roll < profile.reset_rate + profile.timeout_rate:
+            server.stats.incr('timeouts')
+            time.sleep(profile.timeout_delay)
+        elif roll < profile.reset_rate + profile.timeout_rate + profile.error_rate:
+            server.stats.incr('errors')
+            self._reply(503, {}, b'Service Unavailable')
+            return
+
+        record = server.store.find(self.command, url, self.headers.get(HOST_HEADER, ''),
+                                   self.headers.get(BODY_HEADER, ''))
+        time.sleep(profile.latency(record))
+        if record is None:
+            server.stats.incr('misses')
+            logger.debug(f"没有录制的请求: {self.command} {url}")
+            self._reply(404, {'Content-Type': 'application/json'}, b'{"error": "not recorded"}')
+            return
+
+        server.stats.incr('hits')
+        headers = dict(record.get('headers') or {})
+        if remaining >= 0:
+            headers['X-RateLimit-Remaining'] = str(remaining)
+            headers['X-RateLimit-Reset'] = str(round(reset_in))
+        body = base64.b64decode(record['base64']) if 'base64' in record else record.get('text', '').encode('utf-8')
+        self._reply(record['status'], headers, body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+    def _reply(self, status: int, headers: Dict, body: bytes):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    本机回环地址上的回放服务器
+
+    共享HTTP客户端（同步和异步）在回放模式下把所有请求改发到这里，
+    原始URL、显式的Host和请求体摘要放在X-Replay-*请求头中。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, store: FixtureStore, profiles: Optional[Dict[str, ReplayProfile]] = None):
+        """
+        初始化回放服务器
+
+        Args:
+            store: 录制的响应
+            profiles: {主机名: 回放行为}，'default' 用于其他主机
+        """
+        super().__init__(('127.0.0.1', 0), _ReplayHandler)
+        self.store = store
+        self.profiles = dict(profiles or {})
+        self.profiles.setdefault('default', ReplayProfile())
+        self.stats = AtomicCounters({
+            'requests': 0, 'hits': 0, 'misses': 0, 'errors': 0, 'resets': 0, 'timeouts': 0, 'rate_limited': 0
+        })
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def profile_for(self, host: str) -> ReplayProfile:
+        """主机对应的回放行为"""
+        return self.profiles.get(host) or self.profiles['default']
+
+    def start(self) -> 'ReplayServer':
+        """在后台线程中运行"""
+        self._thread = threading.Thread(target=self.serve_forever, name='http-replay', daemon=True)
+        self._thread.start()
+        logger.info(f"HTTP回放服务器已启动: {self.base_url}, {len(self.store)} 条录制")
+        return self
+
+    def stop(self):
+        """停止服务器"""
+        self.shutdown()
+        self.server_close()
+
+    def route(self, method: str, url: str, kwargs: Dict) -> Tuple[str, Dict]:
+        """
+        把请求改发到回放服务器
+
+        Args:
+            method: HTTP方法
+            url: 原始请求地址
+            kwargs: 请求参数
+
+        Returns:
+            (回放服务器地址, 新的请求参数)
+        """
+        kwargs = dict(kwargs)
+        headers = dict(kwargs.get('headers') or {})
+        headers[URL_HEADER] = url
+        headers[HOST_HEADER] = _explicit_host(kwargs)
+        headers[BODY_HEADER] = body_digest(kwargs)
+        kwargs['headers'] = headers
+        kwargs['proxies'] = {'http': None, 'https': None}
+        kwargs.pop('verify', None)
+        return self.base_url + '/', kwargs
+
+
+def load_profiles(path: Optional[str]) -> Dict[str, ReplayProfile]:
+    """
+    从JSON文件加载回放行为
+
+    文件格式: {"default": {"latency_scale": 1.0}, "ip-api.com": {"rate_limit": 45, "rate_window": 60}}
+
+    Args:
+        path: JSON文件路径，为空时使用默认行为
+
+    Returns:
+        {主机名: 回放行为}
+    """
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {host: ReplayProfile.from_dict(profile) for host, profile in data.items()}
+
+
+def enable_recording(client, path: str) -> HTTPRecorder:
+    """
+    让HTTP客户端录制真实响应
+
+    Args:
+        client: HTTPClient实例
+        path: 夹具文件路径
+
+    Returns:
+        录制器
+    """
+    client.recorder = HTTPRecorder(path)
+    logger.info(f"HTTP录制已开启: {path}")
+    return client.recorder
+
+
+def enable_replay(client, path: str, profile_path: Optional[str] = None) -> ReplayServer:
+    """
+    让HTTP客户端从夹具回放响应（启动回放服务器）
+
+    Args:
+        client: HTTPClient实例
+        path: 夹具文件路径
+        profile_path: 回放行为JSON文件路径
+
+    Returns:
+        已启动的回放服务器
+    """
+    if not Path(path).exists():
+        logger.warning(f"HTTP夹具文件不存在: {path}，所有请求将返回404")
+    client.replay = ReplayServer(FixtureStore(path), load_profiles(profile_path)).start()
+    return client.replay
@@ -12,12 +12,14 @@ API优先级（根据用户反馈优化）：
 import time
 import logging
 import ipaddress
-from typing import Dict, Optional, List
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from typing import Dict, Optional, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
 # 导入现有模块
 from .cf_ray_detector import get_cloudflare_colo
 from .ip_location import GeoIPDatabase
+from .cf_ranges import get_cf_range_index
 
 # 导入新模块
 from .api_providers import (
@@ -28,22 +30,32 @@ from .api_providers import (
     APIManager
 )
 from .detection_cache import DetectionCache, FailureCache
+from .cache_compactor import CacheCompactor
+from .cache_warmer import SightingLog
+from .endpoint_history import EndpointHistory
+from .http_client import get_http_client
+from .verification import VerificationPolicy, results_agree
+from .tier_planner import TierPlan, TierPlanner
+from .concurrency import AtomicCounters, SingleFlight
 
 logger = logging.getLogger(__name__)
 
-# Cloudflare的主要IP段
-CLOUDFLARE_IP_RANGES = [
-    '104.16.0.0/12',    # 104.16.0.0 - 104.31.255.255 (合并官方范围)
-    '172.64.0.0/13',    # 172.64.0.0 - 172.71.255.255
-    '162.159.0.0/16',   # 162.159.0.0 - 162.159.255.255
-    '108.162.192.0/18', # 108.162.192.0 - 108.162.255.255
-    '198.41.128.0/17',  # 198.41.128.0 - 198.41.255.255
-    '173.245.48.0/20',  # 173.245.48.0 - 173.245.63.255
-    '188.114.96.0/20',  # 188.114.96.0 - 188.114.111.255
-    '190.93.240.0/20',  # 190.93.240.0 - 190.93.255.255
-    '197.234.240.0/22', # 197.234.240.0 - 197.234.243.255
-    '131.0.72.0/22',    # 131.0.72.0 - 131.0.75.255
-]
+
+def _address_key(ip: str) -> Tuple[int, int]:
+    """IP地址的排序键（无效地址排在最前）"""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return (0, 0)
+    return (address.version, int(address))
+
+
+def _in_network(ip: str, network) -> bool:
+    """IP是否属于网段"""
+    try:
+        return ipaddress.ip_address(ip) in network
+    except ValueError:
+        return False
 
 
 class IPDetectorV2:
@@ -65,19 +77,96 @@ class IPDetectorV2:
         
         # 初始化缓存
         cache_enabled = getattr(config, 'cache_enabled', True)
-        self.cache = DetectionCache(enabled=cache_enabled)
+        history = None
+        if cache_enabled and getattr(config, 'cache_adaptive_ttl', True):
+            history = EndpointHistory(
+                min_factor=getattr(config, 'cache_adaptive_ttl_min_factor', 0.25),
+                max_factor=getattr(config, 'cache_adaptive_ttl_max_factor', 4.0),
+                backend=getattr(config, 'cache_backend', 'sqlite'),
+                db_path=getattr(config, 'cache_db_path', 'cache/ip_detection.db')
+            )
+        self.cache = DetectionCache(
+            enabled=cache_enabled,
+            backend=getattr(config, 'cache_backend', 'sqlite'),
+            db_path=getattr(config, 'cache_db_path', 'cache/ip_detection.db'),
+            default_ttl={
+                'cf_ray': getattr(config, 'cache_ttl_cf_ray', 86400),
+                'api': getattr(config, 'cache_ttl_api', 43200),
+                'geoip': getattr(config, 'cache_ttl_geoip', 604800)
+            },
+            memory_max_entries=getattr(config, 'cache_memory_max_entries', 10000),
+            memory_max_bytes=getattr(config, 'cache_memory_max_bytes', 16 * 1024 * 1024),
+            memory_sweep_interval=getattr(config, 'cache_memory_sweep_interval', 300),
+            stale_grace=getattr(config, 'cache_stale_grace', 0),
+            history=history,
+            prefix_cache=getattr(config, 'cache_prefix_enabled', True),
+            prefix_min_length={
+                4: getattr(config, 'cache_prefix_min_length_v4', 16),
+                6: getattr(config, 'cache_prefix_min_length_v6', 32)
+            }
+        )
         self.failure_cache = FailureCache(
-            retry_delay=getattr(config, 'failure_retry_delay', 3600)
+            retry_delay=getattr(config, 'failure_retry_delay', 3600),
+            max_retry_delay=getattr(config, 'failure_max_retry_delay', 604800),
+            jitter=getattr(config, 'failure_backoff_jitter', 0.2),
+            persistent=cache_enabled and getattr(config, 'failure_persistent', True),
+            backend=getattr(config, 'cache_backend', 'sqlite'),
+            db_path=getattr(config, 'cache_db_path', 'cache/ip_detection.db')
         )
         
+        # 记录数据源中出现的端点，供空闲时预热
+        self.sightings = None
+        if cache_enabled:
+            self.sightings = SightingLog(
+                backend=getattr(config, 'cache_backend', 'sqlite'),
+                db_path=getattr(config, 'cache_db_path', 'cache/ip_detection.db')
+            )
+        
+        # 过期记录增量清理（每次有界，由调度器或运行结束时触发）
+        self.compactor = CacheCompactor(batch_size=getattr(config, 'cache_compact_batch_size', 500))
+        self.compactor.register('detection', self.cache.backend)
+        self.compactor.register('prefixes', self.cache.prefix_backend)
+        self.compactor.register('failures', self.failure_cache.backend)
+        if history:
+            self.compactor.register('history', history.backend)
+        if self.sightings:
+            self.compactor.register('sightings', self.sightings.backend)
+        
         # 初始化API管理器
         self.api_manager = self._init_api_manager()
         
         # 初始化GeoIP数据库
         self.geoip_db = GeoIPDatabase()
         
-        # 统计信息
-        self.stats = {
+        # 低成本层级先给出结果，高成本层级抽样复核
+        self.verification = None
+        if getattr(config, 'verification_enabled', True):
+            self.verification = VerificationPolicy(
+                sample_rate=getattr(config, 'verification_sample_rate', 0.05),
+                min_confidence=getattr(config, 'verification_min_confidence', 0.8),
+                max_rate=getattr(config, 'verification_max_rate', 1.0),
+                ramp=getattr(config, 'verification_ramp', 4.0)
+            )
+        
+        # 按各层级的实测成本为每批检测确定层级顺序
+        self.planner = TierPlanner(
+            dynamic=getattr(config, 'tier_planner_enabled', True),
+            alpha=getattr(config, 'tier_planner_alpha', 0.2)
+        )
+        
+        # 最近一次完成的批量检测各阶段的耗时 {阶段: {'ips', 'found', 'seconds', 'runs'}}
+        self.last_batch_passes: Dict[str, Dict] = {}
+        
+        # 同一端点的并发检测合并为一次
+        self._inflight = SingleFlight()
+        
+        # 宽限期内的过期结果先返回，由后台线程有限并发地重新检测
+        self._refresh_executor = None
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        
+        # 统计信息（批量检测时多线程并发更新）
+        self.stats = AtomicCounters({
             'total': 0,
             'success': 0,
             'cf_ray_success': 0,
@@ -85,8 +174,13 @@ class IPDetectorV2:
             'geoip_success': 0,
             'failed': 0,
             'cached': 0,
-            'response_times': []
-        }
+            'coalesced': 0,
+            'stale_served': 0,
+            'refreshed': 0,
+            'warmed': 0,
+            'response_time_total': 0.0,
+            'response_time_count': 0
+        })
         
         self.start_time = time.time()
         
@@ -96,13 +190,28 @@ class IPDetectorV2:
         """
         初始化API管理器
         
-        按优先级顺序注册API：
+        注册已启用的API，查询顺序由APIManager按耗时、成功率和剩余额度动态排列，
+        配置的优先级（默认如下）只在评分相同时决定先后，或用于固定的API：
         1. IPInfo.IO Widget（主要）- 速度最快，准确度高
         2. IP-API.COM（备用）- 用户确认准确
         3. IPWhois（备用）- 稳定可靠
         4. IP2Location（辅助）- 按需使用
         """
-        manager = APIManager()
+        pinned = [
+            name.strip() for name in getattr(self.config, 'api_pinned_providers', '').split(',') if name.strip()
+        ]
+        manager = APIManager(
+            hedge=getattr(self.config, 'api_hedge_enabled', True),
+            hedge_ratio=getattr(self.config, 'api_hedge_ratio', 0.1),
+            hedge_burst=getattr(self.config, 'api_hedge_burst', 10),
+            hedge_default_delay=getattr(self.config, 'api_hedge_default_delay', 1.0),
+            hedge_min_delay=getattr(self.config, 'api_hedge_min_delay', 0.05),
+            hedge_workers=2 * getattr(self.config, 'detection_max_workers', 10),
+            dynamic_ranking=getattr(self.config, 'api_dynamic_ranking', True),
+            pinned=pinned,
+            ewma_alpha=getattr(self.config, 'api_ranking_alpha', 0.2),
+            async_concurrency=getattr(self.config, 'api_async_concurrency', 200)
+        )
         
         # 获取API配置
         api_enabled = getattr(self.config, 'api_enabled', True)
@@ -112,17 +221,17 @@ class IPDetectorV2:
         
         api_timeout = getattr(self.config, 'api_timeout', 5)
         
-        # 注册IPInfo.IO（备用API - 优先级2，因为对CF IP不准确）
-        if getattr(self.config, 'api_ipinfo_enabled', True):
+        # 注册IPInfo.IO Widget（主要API - 优先级1）
+        if getattr(self.config, 'api_ipinfo_widget_enabled', True):
             ipinfo = IPInfoProvider(timeout=api_timeout)
-            priority = getattr(self.config, 'api_ipinfo_priority', 2)
+            priority = getattr(self.config, 'api_ipinfo_widget_priority', 1)
             manager.register_api(ipinfo, priority)
             logger.info(f"已注册IPInfo.IO API（优先级: {priority}）")
         
-        # 注册IP-API.COM（主要API - 优先级1，对CF IP更准确）
+        # 注册IP-API.COM（备用API - 优先级2）
         if getattr(self.config, 'api_ipapi_enabled', True):
             ipapi = IPAPIProvider(timeout=api_timeout)
-            priority = getattr(self.config, 'api_ipapi_priority', 1)
+            priority = getattr(self.config, 'api_ipapi_priority', 2)
             manager.register_api(ipapi, priority)
             logger.info(f"已注册IP-API.COM（优先级: {priority}）")
         
@@ -152,21 +261,15 @@ class IPDetectorV2:
         Returns:
             bool: 是否为Cloudflare IP
         """
-        try:
-            ip_obj = ipaddress.ip_address(ip)
-            
-            for range_str in CLOUDFLARE_IP_RANGES:
-                if ip_obj in ipaddress.ip_network(range_str):
-                    return True
-            return False
-        except Exception as e:
-            logger.debug(f"判断Cloudflare IP失败: {ip}, {e}")
-            return False
+        return get_cf_range_index().contains(ip)
     
     def detect(self, ip: str, port: int = 443) -> Optional[Dict]:
         """
         检测单个IP的位置信息
         
+        同一端点的并发检测会被合并：第一个调用者执行检测，
+        其余调用者等待并共享同一个结果
+        
         Args:
             ip: IP地址
             port: 端口号，默认443
@@ -175,96 +278,286 @@ class IPDetectorV2:
             位置信息字典，失败返回None
         """
         start_time = time.time()
-        self.stats['total'] += 1
+        self.stats.incr('total')
+        if self.sightings:
+            self.sightings.observe(ip, port)
         
         try:
-            # 第0层：检查缓存
-            cached = self.cache.get(ip, port)
-            if cached:
-                self.stats['cached'] += 1
-                self.stats['success'] += 1
-                logger.debug(f"缓存命中: {ip}:{port}")
-                return cached
-            
-            # 检查失败记录
-            if self.failure_cache.should_skip(ip):
-                logger.debug(f"跳过失败IP: {ip}")
-                self.stats['failed'] += 1
-                return None
-            
-            # 判断是否为Cloudflare IP
-            is_cf = self.is_cloudflare_ip(ip)
+            (result, outcome), shared = self._inflight.do(
+                (ip, port),
+                lambda: self._detect_endpoint(ip, port, start_time)
+            )
+        except Exception as e:
+            logger.error(f"检测异常: {ip}:{port}, {e}")
+            self.stats.incr('failed')
+            return None
+        
+        if shared:
+            self.stats.incr('coalesced')
+            logger.debug(f"合并并发检测: {ip}:{port}")
+        if outcome in ('cached', 'stale'):
+            self.stats.incr('cached')
+        if outcome == 'stale':
+            self.stats.incr('stale_served')
+        self.stats.incr('success' if result else 'failed')
+        return result
+    
+    def _detect_endpoint(self, ip: str, port: int, start_time: float) -> Tuple[Optional[Dict], str]:
+        """
+        执行单个端点的检测（缓存 → 检测链）
+        
+        Returns:
+            (位置信息, 结果类型)，结果类型为 'cached'/'stale'/'detected'/'skipped'/'failed'
+        """
+        # 判断是否为Cloudflare IP
+        is_cf = self.is_cloudflare_ip(ip)
+        
+        # 第0层：检查缓存（任意层级的有效结果都可复用）
+        cached, stale = self.cache.lookup(ip, port, min_tier=self._cache_min_tier(is_cf))
+        if cached and stale:
+            # 宽限期内的过期结果：立即返回，后台重新检测
+            self._schedule_refresh(ip, port, is_cf)
+            return dict(cached, stale=True), 'stale'
+        if cached:
+            logger.debug(f"缓存命中: {ip}:{port}")
+            return cached, 'cached'
+        
+        # 检查失败记录
+        if self.failure_cache.should_skip(ip, port):
+            logger.debug(f"跳过失败端点: {ip}:{port}")
+            return None, 'skipped'
+        
+        result, _ = self._run_detection_chain(ip, port, is_cf, start_time)
+        return result, ('detected' if result else 'failed')
+    
+    def _run_detection_chain(self, ip: str, port: int, is_cf: bool,
+                             start_time: float) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        按检测计划的层级顺序尝试检测，第一个成功的结果按复核策略抽样复核后写入缓存
+        
+        Returns:
+            (位置信息, 检测层级)，全部失败返回 (None, None)
+        """
+        plan = self.plan_tiers(is_cf)
+        order = plan.order
+        if is_cf and order and order[0] == 'cf_ray':
+            logger.info(f"检测到Cloudflare IP: {ip}，优先使用CF-RAY检测")
+        
+        for tier in order:
+            result = self._try_tier(tier, ip, port, is_cf)
+            if not result:
+                if is_cf and tier == 'cf_ray':
+                    logger.warning(f"CF-RAY检测失败: {ip}:{port}，尝试备用方法")
+                continue
             
-            if is_cf:
-                # Cloudflare IP：必须优先使用CF-RAY检测
-                logger.info(f"检测到Cloudflare IP: {ip}，优先使用CF-RAY检测")
-                result = self._try_cf_ray(ip, port)
-                if result:
-                    response_time = time.time() - start_time
-                    self._cache_and_record(ip, port, result, 'cf_ray', response_time)
-                    return result
-                
-                # CF-RAY失败，记录警告
-                logger.warning(f"CF-RAY检测失败: {ip}:{port}，尝试备用方法")
-                
-                # 尝试GeoIP数据库（优先，因为可能比第三方API准确）
-                result = self._try_geoip(ip)
-                if result:
-                    response_time = time.time() - start_time
-                    logger.warning(f"使用GeoIP检测CF IP: {ip} -> {result['city']}, {result['country']}（可能不准确）")
-                    self._cache_and_record(ip, port, result, 'geoip', response_time)
-                    return result
-                
-                # GeoIP也失败，最后尝试第三方API（会返回旧金山，但总比没有好）
-                result = self._try_api(ip)
-                if result:
-                    response_time = time.time() - start_time
-                    logger.warning(f"使用第三方API检测CF IP: {ip}，结果可能不准确（可能显示旧金山） -> {result['city']}, {result['country']}")
-                    self._cache_and_record(ip, port, result, 'api', response_time)
-                    return result
-            else:
-                # 非Cloudflare IP：先尝试第三方API
-                result = self._try_api(ip)
-                if result:
-                    response_time = time.time() - start_time
-                    self._cache_and_record(ip, port, result, 'api', response_time)
-                    return result
-                
-                # API失败，尝试CF-RAY（可能是未知的CF IP段）
-                result = self._try_cf_ray(ip, port)
-                if result:
-                    response_time = time.time() - start_time
-                    logger.info(f"非CF IP段但CF-RAY检测成功: {ip}:{port}")
-                    self._cache_and_record(ip, port, result, 'cf_ray', response_time)
-                    return result
+            reason = self._verification_reason(plan, result, tier)
+            if reason:
+                reference = self._try_tier(plan.verifier, ip, port, is_cf)
+                result, tier = self._reconcile(ip, result, tier, reference, plan.verifier, reason)
+            self._accept(ip, port, is_cf, result, tier)
+            self._cache_and_record(ip, port, result, tier, time.time() - start_time)
+            return result, tier
+        
+        # 所有方法都失败
+        self.failure_cache.record_failure(ip, port)
+        logger.warning(f"所有检测方法都失败: {ip}:{port}")
+        return None, None
+    
+    def plan_tiers(self, is_cf: bool) -> TierPlan:
+        """
+        按当前成本确定一类IP的检测计划
+        
+        准确性规则：
+        - Cloudflare IP默认必须优先使用CF-RAY检测（第三方API/GeoIP只有注册地）；关闭PREFER_CFRAY_FOR_CF_IPS
+          并启用复核时按成本排序，由CF-RAY抽样复核。GeoIP对CF IP只能给出占位标记，始终排在最后。
+        - 非Cloudflare IP启用复核时按成本排序，由第三方API抽样复核；否则第三方API排在最前面。
+        - 其余层级按成本排序：第三方API的剩余额度、CF-RAY的超时率、GeoIP数据库是否已加载都反映在成本中。
+        
+        Args:
+            is_cf: 是否为Cloudflare IP
             
-            # 第三层：GeoIP数据库
+        Returns:
+            检测计划
+        """
+        available = [tier for tier in ('cf_ray', 'api', 'geoip') if self._tier_available(tier, is_cf)]
+        budgets = {'api': self.api_manager.remaining_budget()} if 'api' in available else {}
+        
+        if is_cf:
+            if self.verification is None or getattr(self.config, 'prefer_cfray_for_cf_ips', True):
+                return self.planner.plan(True, available, budgets, first='cf_ray', last=('geoip',))
+            return self.planner.plan(True, available, budgets, last=('geoip',), verifier='cf_ray')
+        if self.verification is None:
+            return self.planner.plan(False, available, budgets, first='api')
+        return self.planner.plan(False, available, budgets, verifier='api')
+    
+    def _tier_available(self, tier: str, is_cf: bool) -> bool:
+        """层级是否可用（已启用，GeoIP数据库已加载）"""
+        if tier == 'cf_ray':
+            return getattr(self.config, 'cf_ray_detection_enabled', True)
+        if tier == 'api':
+            return getattr(self.config, 'api_enabled', True) and bool(self.api_manager.providers)
+        # CF IP的GeoIP查询不需要数据库（返回占位标记）
+        return is_cf or self.geoip_db.reader_city is not None or self.geoip_db.reader_country is not None
+    
+    def _try_tier(self, tier: str, ip: str, port: int, is_cf: bool) -> Optional[Dict]:
+        """尝试指定层级的检测，并记录耗时和结果供规划器估算成本"""
+        start_time = time.monotonic()
+        if tier == 'cf_ray':
+            result = self._try_cf_ray(ip, port)
+        elif tier == 'api':
+            result = self._try_api(ip)
+        else:
             result = self._try_geoip(ip)
+        self.planner.record(is_cf, tier, result is not None, time.monotonic() - start_time)
+        return result
+    
+    def _verification_reason(self, plan: TierPlan, result: Dict, tier: str) -> Optional[str]:
+        """
+        按复核策略判断结果是否需要由计划的复核层级复核
+        
+        Returns:
+            复核原因，不需要复核时返回None
+        """
+        if not plan.verifier or plan.order.index(plan.verifier) <= plan.order.index(tier):
+            return None
+        return self.verification.should_verify(tier, result.get('source'), result.get('confidence'))
+    
+    def _reconcile(self, ip: str, result: Dict, tier: str, reference: Optional[Dict], verifier: str,
+                   reason: str) -> Tuple[Dict, str]:
+        """
+        比较复核结果并记录一致性
+        
+        Returns:
+            (采用的结果, 结果层级)，复核成功时采用复核层级的结果
+        """
+        if not reference:
+            # 复核层级不可用，保留原结果
+            return result, tier
+        
+        source = result.get('source')
+        agreed = results_agree(result, reference)
+        self.verification.record(tier, source, agreed, reason)
+        if not agreed:
+            logger.info(
+                f"复核不一致: {ip} {tier}/{source} {result.get('country')}-{result.get('city')} "
+                f"≠ {verifier} {reference.get('country')}-{reference.get('city')}"
+            )
+        return reference, verifier
+    
+    def _accept(self, ip: str, port: int, is_cf: bool, result: Dict, tier: str):
+        """采用检测结果前的标记和日志"""
+        if is_cf and tier != 'cf_ray':
+            # CF IP没有CF-RAY结果时明确标记为低置信度
+            result['low_confidence'] = True
+        self._log_fallback(ip, port, is_cf, tier, result)
+    
+    def _log_fallback(self, ip: str, port: int, is_cf: bool, tier: str, result: Dict):
+        """记录使用了非首选层级的检测结果"""
+        if is_cf and tier == 'geoip':
+            logger.warning(f"使用GeoIP检测CF IP: {ip} -> {result['city']}, {result['country']}（可能不准确）")
+        elif is_cf and tier == 'api':
+            logger.warning(f"使用第三方API检测CF IP: {ip}，结果可能不准确（可能显示旧金山） -> {result['city']}, {result['country']}")
+        elif not is_cf and tier == 'cf_ray':
+            logger.info(f"非CF IP段但CF-RAY检测成功: {ip}:{port}")
+    
+    def _schedule_refresh(self, ip: str, port: int, is_cf: bool):
+        """提交过期结果的后台刷新（同一端点只排队一次）"""
+        key = (ip, port)
+        
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            
+            if self._refresh_executor is None:
+                self._refresh_executor = ThreadPoolExecutor(
+                    max_workers=getattr(self.config, 'cache_refresh_workers', 4),
+                    thread_name_prefix='cache-refresh'
+                )
+            executor = self._refresh_executor
+        
+        logger.debug(f"返回过期结果并安排后台刷新: {ip}:{port}")
+        executor.submit(self._refresh_endpoint, ip, port, is_cf)
+    
+    def _refresh_endpoint(self, ip: str, port: int, is_cf: bool):
+        """后台重新检测一个端点，成功后覆盖缓存中的过期结果"""
+        try:
+            result, tier = self._run_detection_chain(ip, port, is_cf, time.time())
             if result:
-                response_time = time.time() - start_time
-                self._cache_and_record(ip, port, result, 'geoip', response_time)
-                return result
+                self.stats.incr('refreshed')
+                logger.debug(f"后台刷新完成: {ip}:{port} ({tier})")
+        except Exception as e:
+            logger.error(f"后台刷新异常: {ip}:{port}, {e}")
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard((ip, port))
+    
+    def warm(self, ip: str, port: int = 443) -> bool:
+        """
+        预热一个端点：忽略缓存重新检测，结果写入缓存（不计入检测统计）
+        
+        Args:
+            ip: IP地址
+            port: 端口号
             
-            # 所有方法都失败
-            self.failure_cache.record_failure(ip)
-            self.stats['failed'] += 1
-            logger.warning(f"所有检测方法都失败: {ip}:{port}")
-            return None
+        Returns:
+            是否检测成功
+        """
+        if self.failure_cache.should_skip(ip, port):
+            return False
+        
+        is_cf = self.is_cloudflare_ip(ip)
+        
+        def run():
+            result, _ = self._run_detection_chain(ip, port, is_cf, time.time())
+            return result, ('detected' if result else 'failed')
         
+        try:
+            (result, _), _ = self._inflight.do((ip, port), run)
         except Exception as e:
-            logger.error(f"检测异常: {ip}:{port}, {e}")
-            self.stats['failed'] += 1
-            return None
+            logger.error(f"预热异常: {ip}:{port}, {e}")
+            return False
+        
+        if result:
+            self.stats.incr('warmed')
+        return result is not None
+    
+    def wait_for_refresh(self):
+        """等待已安排的后台刷新全部完成"""
+        with self._refresh_lock:
+            executor, self._refresh_executor = self._refresh_executor, None
+        
+        if executor is not None:
+            executor.shutdown(wait=True)
+    
+    def _cache_min_tier(self, is_cf: bool) -> Optional[str]:
+        """
+        缓存查询的最低可接受层级
+        
+        Cloudflare IP的第三方API/GeoIP结果通常只是注册地，
+        启用PREFER_CFRAY_FOR_CF_IPS时只复用CF-RAY结果
+        """
+        if is_cf and getattr(self.config, 'prefer_cfray_for_cf_ips', True):
+            return 'cf_ray'
+        return None
     
     def detect_batch(self, ip_list: List[str], port: int = 443, 
                      max_workers: Optional[int] = None) -> Dict[str, Optional[Dict]]:
         """
         批量检测IP位置信息
         
+        按层级分阶段处理整批IP：批量读取缓存 → 各层级的批量检测 → 批量写入缓存。
+        每一轮按检测计划把未完成的IP分配到各自的下一个层级，每个层级只执行一次批量检测
+        （CF-RAY并发检测、第三方API批量查询、GeoIP按网段复用的顺序查询），
+        需要复核的结果在下一轮并入复核层级的批量检测。各阶段的耗时在批次完成后记录在last_batch_passes中。
+        
+        需要检测的端点与并发的detect()和其他批次合并：本批登记的端点由本批检测，
+        同时到达的detect()等待本批的结果；已由其他调用检测中的端点等待其结果，不重复检测。
+        
         Args:
             ip_list: IP地址列表
             port: 端口号，默认443
-            max_workers: 最大并发数，None则使用配置值
+            max_workers: CF-RAY检测的最大并发数，None则使用配置值
             
         Returns:
             IP到位置信息的映射字典
@@ -272,41 +565,267 @@ class IPDetectorV2:
         if max_workers is None:
             max_workers = getattr(self.config, 'detection_max_workers', 10)
         
-        results = {}
-        total = len(ip_list)
+        ips = list(dict.fromkeys(ip_list))
+        batch_start = time.time()
+        passes: Dict[str, Dict] = {}
+        logger.info(f"开始批量检测: {len(ips)} 个IP, 并发数: {max_workers}")
         
-        logger.info(f"开始批量检测: {total} 个IP, 并发数: {max_workers}")
+        # 整批使用同一个检测计划
+        plans = {is_cf: self.plan_tiers(is_cf) for is_cf in (True, False)}
+        logger.info(f"检测计划: CF IP {plans[True].describe()}; 其他IP {plans[False].describe()}")
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_ip = {
-                executor.submit(self.detect, ip, port): ip
-                for ip in ip_list
-            }
+        is_cf = {ip: self.is_cloudflare_ip(ip) for ip in ips}
+        results, pending = self._cache_read_pass(ips, port, is_cf, passes)
+        
+        owned, waiting = self._inflight.claim([(ip, port) for ip in pending])
+        claimed = [ip for ip in pending if (ip, port) in owned]
+        error = None
+        try:
+            accepted = self._detection_passes(claimed, port, is_cf, plans, max_workers, results, batch_start, passes)
+            self._cache_write_pass(accepted, port, [ip for ip in claimed if results.get(ip) is None], passes)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            for ip in claimed:
+                result = results.get(ip)
+                self._inflight.resolve((ip, port), (result, 'detected' if result else 'failed'), error)
+        
+        # 本批的端点全部结束后再等待其他调用，避免两个批次互相等待
+        for (ip, _), future in waiting.items():
+            try:
+                results[ip], _ = future.result()
+            except Exception as e:
+                logger.error(f"检测异常: {ip}:{port}, {e}")
+                results[ip] = None
+        if waiting:
+            self.stats.incr('coalesced', len(waiting))
+            logger.debug(f"合并并发检测: {len(waiting)} 个IP")
+        
+        self.stats.incr('total', len(ips))
+        self.stats.incr('success', sum(1 for result in results.values() if result))
+        self.stats.incr('failed', sum(1 for result in results.values() if not result))
+        self.last_batch_passes = passes
+        
+        summary = ', '.join(f"{name} {item['seconds']:.2f}秒" for name, item in passes.items())
+        logger.info(f"批量检测完成: {len(ips)} 个IP, 总耗时 {time.time() - batch_start:.2f}秒 ({summary})")
+        
+        # 按本批的API表现重新排列查询顺序
+        if self.api_manager.dynamic_ranking:
+            self.api_manager.rerank()
+        
+        # 输出统计摘要
+        logger.info(self.get_summary())
+        
+        return results
+    
+    def _record_pass(self, passes: Dict[str, Dict], name: str, start_time: float, ips: int, found: int):
+        """记录一个批量检测阶段的耗时到本批的阶段统计中（同一阶段多次执行时累加）"""
+        elapsed = time.monotonic() - start_time
+        item = passes.setdefault(name, {'ips': 0, 'found': 0, 'seconds': 0.0, 'runs': 0})
+        item['ips'] += ips
+        item['found'] += found
+        item['seconds'] += elapsed
+        item['runs'] += 1
+        logger.info(f"批量检测阶段 {name}: {ips} 个IP, 得到结果 {found}, 耗时 {elapsed:.2f}秒")
+    
+    def _cache_read_pass(self, ips: List[str], port: int, is_cf: Dict[str, bool],
+                         passes: Dict[str, Dict]) -> Tuple[Dict[str, Optional[Dict]], List[str]]:
+        """
+        批量读取缓存，并排除失败记录中的端点
+        
+        宽限期内的过期结果与detect()相同，直接采用并安排后台刷新
+        
+        Returns:
+            (已有结果 {ip: 位置信息或None}, 需要检测的IP列表)
+        """
+        start_time = time.monotonic()
+        if self.sightings:
+            for ip in ips:
+                self.sightings.observe(ip, port)
+        
+        hits = {}
+        for cf in (True, False):
+            endpoints = [(ip, port) for ip in ips if is_cf[ip] == cf]
+            if endpoints:
+                hits.update(self.cache.get_many(endpoints, min_tier=self._cache_min_tier(cf)))
+        
+        results: Dict[str, Optional[Dict]] = {}
+        pending = []
+        stale_served = 0
+        for ip in ips:
+            cached, stale = hits.get(f"{ip}:{port}", (None, False))
+            if cached and stale:
+                # 宽限期内的过期结果：直接采用，后台重新检测
+                self._schedule_refresh(ip, port, is_cf[ip])
+                results[ip] = dict(cached, stale=True)
+                stale_served += 1
+            elif cached:
+                results[ip] = cached
+            elif self.failure_cache.should_skip(ip, port):
+                logger.debug(f"跳过失败端点: {ip}:{port}")
+                results[ip] = None
+            else:
+                pending.append(ip)
+        
+        self.stats.incr('cached', len(hits))
+        self.stats.incr('stale_served', stale_served)
+        self._record_pass(passes, 'cache_read', start_time, len(ips), len(hits))
+        return results, pending
+    
+    def _detection_passes(self, pending: List[str], port: int, is_cf: Dict[str, bool], plans: Dict[bool, TierPlan],
+                          max_workers: int, results: Dict[str, Optional[Dict]], batch_start: float,
+                          passes: Dict[str, Dict]) -> Dict[str, Dict[str, Dict]]:
+        """
+        按检测计划分轮执行各层级的批量检测
+        
+        Args:
+            pending: 需要检测的IP
+            port: 端口号
+            is_cf: {ip: 是否为CF IP}
+            plans: {是否为CF IP: 检测计划}
+            max_workers: CF-RAY检测的最大并发数
+            results: 检测结果（原地更新）
+            batch_start: 批量检测开始时间
+            passes: 本批的阶段统计（原地更新）
             
-            # 收集结果
-            completed = 0
-            for future in as_completed(future_to_ip):
-                ip = future_to_ip[future]
+        Returns:
+            待写入缓存的结果 {层级: {ip: 位置信息}}
+        """
+        position = {ip: 0 for ip in pending if plans[is_cf[ip]].order}
+        answers: Dict[str, Tuple[Dict, str, str]] = {}  # 等待复核的结果 {ip: (结果, 层级, 复核原因)}
+        accepted: Dict[str, Dict[str, Dict]] = {}
+        
+        def accept(ip: str, result: Dict, tier: str):
+            self._accept(ip, port, is_cf[ip], result, tier)
+            results[ip] = result
+            accepted.setdefault(tier, {})[ip] = result
+            self.stats.incr('response_time_total', time.time() - batch_start)
+            self.stats.incr('response_time_count')
+        
+        while position or answers:
+            wanted = {'cf_ray': [], 'api': [], 'geoip': []}
+            for ip, index in position.items():
+                wanted[plans[is_cf[ip]].order[index]].append(ip)
+            for ip in answers:
+                wanted[plans[is_cf[ip]].verifier].append(ip)
+            
+            for tier, tier_ips in wanted.items():
+                if not tier_ips:
+                    continue
+                found = self._run_pass(tier, tier_ips, port, is_cf, max_workers, passes)
                 
-                try:
-                    result = future.result()
-                    results[ip] = result
-                    completed += 1
+                for ip in tier_ips:
+                    result = found.get(ip)
+                    if ip in answers:
+                        answer, answer_tier, reason = answers.pop(ip)
+                        accept(ip, *self._reconcile(ip, answer, answer_tier, result, tier, reason))
+                        continue
                     
-                    # 每10个IP报告一次进度
-                    if completed % 10 == 0 or completed == total:
-                        logger.info(f"检测进度: {completed}/{total}")
-                
-                except Exception as e:
-                    logger.error(f"检测异常: {ip}, {e}")
-                    results[ip] = None
+                    plan = plans[is_cf[ip]]
+                    if not result:
+                        if is_cf[ip] and tier == 'cf_ray':
+                            logger.warning(f"CF-RAY检测失败: {ip}:{port}，尝试备用方法")
+                        position[ip] += 1
+                        if position[ip] >= len(plan.order):
+                            del position[ip]
+                            results[ip] = None
+                        continue
+                    
+                    del position[ip]
+                    reason = self._verification_reason(plan, result, tier)
+                    if reason:
+                        answers[ip] = (result, tier, reason)
+                    else:
+                        accept(ip, result, tier)
         
-        # 输出统计摘要
-        logger.info(self.get_summary())
+        for ip in pending:
+            results.setdefault(ip, None)
+        return accepted
+    
+    def _run_pass(self, tier: str, ips: List[str], port: int, is_cf: Dict[str, bool], max_workers: int,
+                  passes: Dict[str, Dict]) -> Dict[str, Optional[Dict]]:
+        """执行一个层级的批量检测"""
+        start_time = time.monotonic()
+        try:
+            if tier == 'cf_ray':
+                found = self._cf_ray_pass(ips, port, is_cf, max_workers)
+            elif tier == 'api':
+                found = self._api_pass(ips, is_cf)
+            else:
+                found = self._geoip_pass(ips, is_cf)
+        except Exception as e:
+            logger.error(f"批量检测阶段异常: {tier}, {e}")
+            found = {}
+        self._record_pass(passes, tier, start_time, len(ips), sum(1 for result in found.values() if result))
+        return found
+    
+    def _cf_ray_pass(self, ips: List[str], port: int, is_cf: Dict[str, bool],
+                     max_workers: int) -> Dict[str, Optional[Dict]]:
+        """并发执行一批CF-RAY检测"""
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ips))),
+                                thread_name_prefix='cf-ray-pass') as executor:
+            found = executor.map(lambda ip: self._try_tier('cf_ray', ip, port, is_cf[ip]), ips)
+            return dict(zip(ips, found))
+    
+    def _api_pass(self, ips: List[str], is_cf: Dict[str, bool]) -> Dict[str, Optional[Dict]]:
+        """一次批量查询第三方API（耗时按IP数均摊计入规划器）"""
+        start_time = time.monotonic()
+        found = self.api_manager.query_batch(ips)
+        elapsed = (time.monotonic() - start_time) / len(ips)
+        
+        results = {}
+        for ip in ips:
+            result = found.get(ip)
+            if result:
+                self.stats.incr('api_success')
+                result['ip'] = ip
+            results[ip] = result or None
+            self.planner.record(is_cf[ip], 'api', bool(result), elapsed)
+        return results
+    
+    def _geoip_pass(self, ips: List[str], is_cf: Dict[str, bool]) -> Dict[str, Optional[Dict]]:
+        """
+        按地址顺序查询一批IP的GeoIP数据库
         
+        排序后同一网段的IP相邻，网段内后续IP直接复用前一个查询结果
+        （CF IP的GeoIP查询不基于数据库记录，不复用）
+        """
+        results = {}
+        network, shared = None, None
+        for ip in sorted(ips, key=_address_key):
+            start_time = time.monotonic()
+            if network is not None and not is_cf[ip] and _in_network(ip, network):
+                result = dict(shared, ip=ip)
+                self.stats.incr('geoip_success')
+            else:
+                result = self._try_geoip(ip)
+                network, shared = None, None
+                if result and not is_cf[ip] and result.get('network'):
+                    network, shared = ipaddress.ip_network(result['network'], strict=False), result
+            self.planner.record(is_cf[ip], 'geoip', result is not None, time.monotonic() - start_time)
+            results[ip] = result
         return results
     
+    def _cache_write_pass(self, accepted: Dict[str, Dict[str, Dict]], port: int, failed: List[str],
+                          passes: Dict[str, Dict]):
+        """批量写入检测结果并更新失败记录"""
+        start_time = time.monotonic()
+        with self.cache.batch():
+            for tier, items in accepted.items():
+                self.cache.set_many({(ip, port): result for ip, result in items.items()}, tier)
+        
+        written = 0
+        for items in accepted.values():
+            for ip in items:
+                self.failure_cache.clear_failure(ip, port)
+                written += 1
+        for ip in failed:
+            self.failure_cache.record_failure(ip, port)
+        if failed:
+            logger.warning(f"所有检测方法都失败: {len(failed)} 个IP")
+        self._record_pass(passes, 'cache_write', start_time, written + len(failed), written)
+    
     def _try_cf_ray(self, ip: str, port: int) -> Optional[Dict]:
         """尝试CF-RAY检测"""
         cf_ray_enabled = getattr(self.config, 'cf_ray_detection_enabled', True)
@@ -318,7 +837,7 @@ class IPDetectorV2:
             result = get_cloudflare_colo(ip, port, timeout)
             
             if result.get('success'):
-                self.stats['cf_ray_success'] += 1
+                self.stats.incr('cf_ray_success')
                 logger.info(
                     f"CF-RAY检测成功: {ip}:{port} -> "
                     f"{result['colo']} ({result['city']}, {result['country']})"
@@ -330,7 +849,8 @@ class IPDetectorV2:
                     'city': result['city'],
                     'ip': ip,
                     'source': 'cf_ray',
-                    'colo': result['colo']
+                    'colo': result['colo'],
+                    'confidence': 1.0
                 }
             
             return None
@@ -345,7 +865,7 @@ class IPDetectorV2:
             result = self.api_manager.query(ip)
             
             if result:
-                self.stats['api_success'] += 1
+                self.stats.incr('api_success')
                 logger.info(
                     f"API检测成功: {ip} -> "
                     f"{result['city']}, {result['country']} "
@@ -368,7 +888,12 @@ class IPDetectorV2:
             result = self.geoip_db.query(ip)
             
             if result:
-                self.stats['geoip_success'] += 1
+                # 只有国家级数据时降低置信度
+                confidence = getattr(self.config, 'verification_geoip_confidence', 0.8)
+                if result.get('city', 'Unknown') == 'Unknown':
+                    confidence = min(confidence, 0.5)
+                result.setdefault('confidence', confidence)
+                self.stats.incr('geoip_success')
                 logger.info(
                     f"GeoIP检测成功: {ip} -> "
                     f"{result['city']}, {result['country']}"
@@ -388,11 +913,11 @@ class IPDetectorV2:
         self.cache.set(ip, result, port, cache_type)
         
         # 清除失败记录
-        self.failure_cache.clear_failure(ip)
+        self.failure_cache.clear_failure(ip, port)
         
-        # 记录统计
-        self.stats['success'] += 1
-        self.stats['response_times'].append(response_time)
+        # 记录统计（成功数由detect()按调用统计）
+        self.stats.incr('response_time_total', response_time)
+        self.stats.incr('response_time_count')
     
     def get_summary(self) -> str:
         """
@@ -401,14 +926,15 @@ class IPDetectorV2:
         Returns:
             统计摘要字符串
         """
-        total = self.stats['total']
+        stats = self.stats.snapshot()
+        total = stats['total']
         if total == 0:
             return "暂无统计数据"
         
-        success_rate = (self.stats['success'] / total) * 100
+        success_rate = (stats['success'] / total) * 100
         avg_response_time = (
-            sum(self.stats['response_times']) / len(self.stats['response_times'])
-            if self.stats['response_times'] else 0
+            stats['response_time_total'] / stats['response_time_count']
+            if stats['response_time_count'] else 0
         )
         elapsed_time = time.time() - self.start_time
         
@@ -417,14 +943,16 @@ class IPDetectorV2:
 检测统计摘要:
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 总检测数: {total}
-成功数: {self.stats['success']} ({success_rate:.1f}%)
-失败数: {self.stats['failed']}
-缓存命中: {self.stats['cached']}
+成功数: {stats['success']} ({success_rate:.1f}%)
+失败数: {stats['failed']}
+缓存命中: {stats['cached']}
+并发合并: {stats['coalesced']}
+过期结果: {stats['stale_served']} (后台刷新成功 {stats['refreshed']})
 
 检测来源分布:
-  - CF-RAY: {self.stats['cf_ray_success']} ({self.stats['cf_ray_success']/total*100:.1f}%)
-  - 第三方API: {self.stats['api_success']} ({self.stats['api_success']/total*100:.1f}%)
-  - GeoIP库: {self.stats['geoip_success']} ({self.stats['geoip_success']/total*100:.1f}%)
+  - CF-RAY: {stats['cf_ray_success']} ({stats['cf_ray_success']/total*100:.1f}%)
+  - 第三方API: {stats['api_success']} ({stats['api_success']/total*100:.1f}%)
+  - GeoIP库: {stats['geoip_success']} ({stats['geoip_success']/total*100:.1f}%)
 
 性能指标:
   - 平均响应时间: {avg_response_time:.2f}秒
@@ -437,14 +965,86 @@ class IPDetectorV2:
         # 添加缓存统计
         cache_stats = self.cache.get_stats()
         summary += f"  - 缓存命中率: {cache_stats['hit_rate']}\n"
-        summary += f"  - 内存缓存大小: {cache_stats['memory_cache_size']}\n"
+        memory_stats = cache_stats['memory']
+        summary += (
+            f"  - 内存缓存: {memory_stats['size']}/{memory_stats['max_entries']} 条, "
+            f"{memory_stats['bytes'] / 1024:.1f}KB, 淘汰 {memory_stats['evictions']}, "
+            f"命中率 {memory_stats['hit_rate']}\n"
+        )
+        if cache_stats['prefixes']:
+            summary += f"  - 网段缓存: {cache_stats['prefixes']} 个网段, 命中 {cache_stats['prefix_hits']}\n"
+        history_stats = cache_stats['history']
+        if history_stats:
+            summary += (
+                f"  - 自适应TTL: {history_stats['endpoints']} 条历史, "
+                f"稳定 {history_stats['stable']}, 易变 {history_stats['volatile']}\n"
+            )
+        compact_stats = self.compactor.get_stats()
+        if compact_stats['entries']:
+            summary += (
+                f"  - 增量清理: {compact_stats['entries']} 条, "
+                f"{compact_stats['bytes'] / 1024:.1f}KB ({compact_stats['ticks']} 次)\n"
+            )
         
         # 添加API统计
         api_stats = self.api_manager.get_stats()
         if api_stats:
             summary += "\nAPI统计:\n"
             for api_name, stats in api_stats.items():
-                summary += f"  - {api_name}: {stats['successful_requests']}/{stats['total_requests']} ({stats['success_rate']})\n"
+                latency = f", 平均 {stats['ewma_latency'] * 1000:.0f}毫秒" if stats['ewma_latency'] is not None else ""
+                summary += (
+                    f"  - #{stats['rank']} {api_name}: {stats['successful_requests']}/{stats['total_requests']} "
+                    f"({stats['success_rate']}{latency}, 评分 {stats['score']})\n"
+                )
+            hedge_stats = self.api_manager.get_hedge_stats()
+            if hedge_stats['hedged']:
+                summary += (
+                    f"  - 对冲请求: {hedge_stats['hedged']}/{hedge_stats['queries']} 次, "
+                    f"对冲胜出 {hedge_stats['hedge_wins']}, 预算不足 {hedge_stats['budget_exhausted']}\n"
+                )
+        
+        # 添加最近一次批量检测的阶段耗时
+        if self.last_batch_passes:
+            summary += "\n批量检测阶段:\n"
+            for name, item in self.last_batch_passes.items():
+                summary += (
+                    f"  - {name}: {item['ips']} 个IP, 得到结果 {item['found']}, "
+                    f"耗时 {item['seconds']:.2f}秒 ({item['runs']} 次)\n"
+                )
+        
+        # 添加检测层级统计
+        tier_stats = {key: stats for key, stats in self.planner.get_stats().items() if stats['attempts']}
+        if tier_stats:
+            summary += "\n检测层级:\n"
+            for key, stats in tier_stats.items():
+                summary += (
+                    f"  - {key}: {stats['successes']}/{stats['attempts']}, "
+                    f"成功率 {stats['success_rate']:.0%}, 平均 {stats['latency_ms']:.0f}毫秒\n"
+                )
+        
+        # 添加抽样复核统计
+        verification_stats = self.verification.get_stats() if self.verification else {}
+        verified = {key: stats for key, stats in verification_stats.items() if stats['verified']}
+        if verified:
+            summary += "\n抽样复核:\n"
+            for key, stats in sorted(verified.items()):
+                summary += (
+                    f"  - {key}: 复核 {stats['verified']}/{stats['answered']}, 不一致 {stats['disagreed']}, "
+                    f"当前抽样比例 {stats['sample_rate']:.0%}\n"
+                )
+        
+        # 添加HTTP连接统计
+        http_stats = get_http_client().get_stats()
+        if http_stats:
+            summary += "\nHTTP请求统计:\n"
+            for host, stats in sorted(http_stats.items()):
+                summary += (
+                    f"  - {host}: {stats['requests']} 次, 失败 {stats['errors']}, 重试 {stats['retries']}, "
+                    f"平均 {stats['avg_latency_ms']:.0f}毫秒"
+                )
+                if stats['rejected'] or stats['circuit'] != 'closed':
+                    summary += f", 熔断 {stats['circuit']} (拒绝 {stats['rejected']})"
+                summary += "\n"
         
         summary += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
         
@@ -458,21 +1058,41 @@ class IPDetectorV2:
             统计信息字典
         """
         return {
-            'detection': self.stats,
+            'detection': self.stats.snapshot(),
             'cache': self.cache.get_stats(),
             'api': self.api_manager.get_stats(),
-            'failure': self.failure_cache.get_stats()
+            'failure': self.failure_cache.get_stats(),
+            'verification': self.verification.get_stats() if self.verification else {},
+            'tiers': self.planner.get_stats(),
+            'batch_passes': self.last_batch_passes,
+            'http': get_http_client().get_stats()
         }
     
+    def compact_cache(self) -> Dict:
+        """
+        增量清理一批过期缓存记录
+        
+        Returns:
+            本次清理结果 {'entries', 'bytes', 'stores', 'oldest_expiry', 'elapsed'}
+        """
+        return self.compactor.tick()
+    
     def close(self):
         """关闭检测器，释放资源"""
+        # 先完成后台刷新，刷新结果需要写入缓存
+        self.wait_for_refresh()
         if self.geoip_db:
             self.geoip_db.close()
+        self.cache.close()
+        self.failure_cache.close()
+        if self.sightings:
+            self.sightings.close()
         logger.info("IPDetectorV2已关闭")
 
 
 # 便捷函数
 _detector = None
+_detector_lock = threading.Lock()
 
 
 def get_detector(config=None) -> IPDetectorV2:
@@ -488,7 +1108,9 @@ def get_detector(config=None) -> IPDetectorV2:
     global _detector
     
     if _detector is None:
-        _detector = IPDetectorV2(config)
+        with _detector_lock:
+            if _detector is None:
+                _detector = IPDetectorV2(config)
     
     return _detector
 
@@ -527,9 +1149,10 @@ def close_detector():
     """关闭全局检测器"""
     global _detector
     
-    if _detector is not None:
-        _detector.close()
-        _detector = None
+    with _detector_lock:
+        if _detector is not None:
+            _detector.close()
+            _detector = None
 
 
 if __name__ == '__main__':
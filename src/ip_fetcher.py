@@ -4,11 +4,11 @@
 """
 import re
 import logging
-import time
 from typing import List, Dict, Optional
 import requests
 
 from .config import get_config
+from .http_client import get_http_client
 from .utils import (
     setup_logging,
     format_node_list,
@@ -31,27 +31,28 @@ class IPFetcher:
         """
         self.config = config
         self.logger = logging.getLogger(__name__)
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.http = get_http_client()
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Content-Type': 'application/json'
-        })
+        }
+        # 失败重试由共享HTTP客户端按统一的退避策略处理
+        self.retries = max(0, self.config.max_retries - 1)
     
-    def fetch_countries(self, retry: int = 0) -> List[Dict[str, str]]:
+    def fetch_countries(self) -> List[Dict[str, str]]:
         """
         获取可用国家列表
         
-        Args:
-            retry: 当前重试次数
-        
         Returns:
             List[Dict]: 国家列表
         """
         try:
             self.logger.info(f"正在获取国家列表: {self.config.api_countries_url}")
-            response = self.session.get(
+            response = self.http.get(
                 self.config.api_countries_url,
-                timeout=self.config.request_timeout
+                headers=self.headers,
+                timeout=self.config.request_timeout,
+                retries=self.retries
             )
             response.raise_for_status()
             
@@ -60,17 +61,10 @@ class IPFetcher:
             return countries
             
         except requests.exceptions.RequestException as e:
-            self.logger.error(f"获取国家列表失败 (尝试 {retry + 1}/{self.config.max_retries}): {e}")
-            
-            if retry < self.config.max_retries - 1:
-                wait_time = (retry + 1) * 2
-                self.logger.info(f"等待 {wait_time} 秒后重试...")
-                time.sleep(wait_time)
-                return self.fetch_countries(retry + 1)
-            
+            self.logger.error(f"获取国家列表失败 (已重试 {self.retries} 次): {e}")
             return []
     
-    def fetch_proxies(self, country_code: str, port: str = '', limit: int = 100, retry: int = 0) -> List[Dict[str, str]]:
+    def fetch_proxies(self, country_code: str, port: str = '', limit: int = 100) -> List[Dict[str, str]]:
         """
         查询代理IP
         
@@ -78,7 +72,6 @@ class IPFetcher:
             country_code: 国家代码 (如: JP, US, SG)
             port: 端口号 (可选)
             limit: 返回数量限制
-            retry: 当前重试次数
         
         Returns:
             List[Dict]: 代理列表
@@ -91,10 +84,13 @@ class IPFetcher:
             }
             
             self.logger.info(f"正在查询代理: 国家={country_code}, 端口={port or '任意'}, 限制={limit}")
-            response = self.session.post(
+            # 查询接口没有副作用，POST也可以安全重试
+            response = self.http.post(
                 self.config.api_query_url,
                 json=payload,
-                timeout=self.config.request_timeout
+                headers=self.headers,
+                timeout=self.config.request_timeout,
+                retries=self.retries
             )
             response.raise_for_status()
             
@@ -123,14 +119,7 @@ class IPFetcher:
             return nodes
             
         except requests.exceptions.RequestException as e:
-            self.logger.error(f"查询代理失败 (尝试 {retry + 1}/{self.config.max_retries}): {e}")
-            
-            if retry < self.config.max_retries - 1:
-                wait_time = (retry + 1) * 2
-                self.logger.info(f"等待 {wait_time} 秒后重试...")
-                time.sleep(wait_time)
-                return self.fetch_proxies(country_code, port, limit, retry + 1)
-            
+            self.logger.error(f"查询代理失败 (已重试 {self.retries} 次): {e}")
             return []
 
 
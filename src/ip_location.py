@@ -6,14 +6,17 @@ IP地理位置查询模块
 
 import json
 import logging
+import threading
 import gzip
 import shutil
-import requests
 from pathlib import Path
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List
 import ipaddress
 
+from .cf_ranges import get_cf_range_index
+from .http_client import get_http_client
+
 # 导入CF-RAY检测模块
 try:
     from . import cf_ray_detector
@@ -97,7 +100,7 @@ class GeoIPDatabase:
         try:
             logger.info(f"正在下载 {db_type} 数据库: {url}")
             
-            response = requests.get(url, stream=True, timeout=300)
+            response = get_http_client().get(url, stream=True, timeout=300)
             response.raise_for_status()
             
             # 保存到临时文件
@@ -148,35 +151,7 @@ class GeoIPDatabase:
         检查是否为Cloudflare IP段
         Cloudflare使用Anycast，这些IP在全球多个位置都有
         """
-        try:
-            ip_obj = ipaddress.ip_address(ip)
-            
-            # Cloudflare的主要IP段
-            cloudflare_ranges = [
-                '173.245.48.0/20',
-                '103.21.244.0/22',
-                '103.22.200.0/22',
-                '103.31.4.0/22',
-                '141.101.64.0/18',
-                '108.162.192.0/18',
-                '190.93.240.0/20',
-                '188.114.96.0/20',
-                '197.234.240.0/22',
-                '198.41.128.0/17',
-                '162.158.0.0/15',
-                '104.16.0.0/13',
-                '104.24.0.0/14',
-                '172.64.0.0/13',
-                '131.0.72.0/22',
-            ]
-            
-            for cidr in cloudflare_ranges:
-                if ip_obj in ipaddress.ip_network(cidr):
-                    return True
-            
-            return False
-        except:
-            return False
+        return get_cf_range_index().contains(ip)
     
     def _detect_cf_ray_location(self, ip: str, port: int = 443) -> Optional[Dict]:
         """
@@ -268,13 +243,13 @@ class GeoIPDatabase:
                     
                     # 如果有有效数据则返回
                     if country_code:
-                        return {
+                        return self._with_network({
                             'country': country_code,
                             'country_name': country_name or 'Unknown',
                             'city': city_name or 'Unknown',
                             'ip': ip,
                             'source': 'GeoLite2-City'
-                        }
+                        }, response)
                 except Exception as e:
                     logger.debug(f"城市数据库查询失败: {ip}, {e}")
             
@@ -286,13 +261,13 @@ class GeoIPDatabase:
                     country_name = response.country.name
                     
                     if country_code:
-                        return {
+                        return self._with_network({
                             'country': country_code,
                             'country_name': country_name or 'Unknown',
                             'city': 'Unknown',
                             'ip': ip,
                             'source': 'GeoLite2-Country'
-                        }
+                        }, response)
                 except Exception as e:
                     logger.debug(f"国家数据库查询失败: {ip}, {e}")
             
@@ -306,6 +281,14 @@ class GeoIPDatabase:
             logger.error(f"查询IP地理位置失败: {ip}, {e}")
             return None
     
+    @staticmethod
+    def _with_network(result: Dict, response) -> Dict:
+        """附加数据库记录所属的网段（同一网段内的IP查询结果相同）"""
+        network = getattr(response.traits, 'network', None)
+        if network is not None:
+            result['network'] = str(network)
+        return result
+    
     def close(self):
         """关闭数据库连接"""
         if self.reader_city:
@@ -386,6 +369,19 @@ class IPLocationQuery:
 # 全局实例
 _query = None
 _detector_v2 = None
+_query_lock = threading.Lock()
+
+
+def _get_query() -> 'IPLocationQuery':
+    """获取全局V1查询实例（线程安全的延迟初始化）"""
+    global _query
+    
+    if _query is None:
+        with _query_lock:
+            if _query is None:
+                _query = IPLocationQuery()
+    
+    return _query
 
 
 def get_ip_location(ip: str, port: int = 443, use_v2: bool = True) -> Dict:
@@ -406,6 +402,7 @@ def get_ip_location(ip: str, port: int = 443, use_v2: bool = True) -> Dict:
             from .ip_detector_v2 import get_detector
             global _detector_v2
             
+            # get_detector()自身是线程安全的单例，重复赋值得到同一实例
             if _detector_v2 is None:
                 _detector_v2 = get_detector()
             
@@ -420,12 +417,7 @@ def get_ip_location(ip: str, port: int = 443, use_v2: bool = True) -> Dict:
             logger.error(f"V2检测器异常，回退到V1: {e}")
     
     # 使用V1检测器
-    global _query
-    
-    if _query is None:
-        _query = IPLocationQuery()
-    
-    return _query.query(ip, port)
+    return _get_query().query(ip, port)
 
 
 def get_ip_locations_batch(ips: List[str], port: int = 443, use_v2: bool = True) -> Dict[str, Dict]:
@@ -446,6 +438,7 @@ def get_ip_locations_batch(ips: List[str], port: int = 443, use_v2: bool = True)
             from .ip_detector_v2 import get_detector
             global _detector_v2
             
+            # get_detector()自身是线程安全的单例，重复赋值得到同一实例
             if _detector_v2 is None:
                 _detector_v2 = get_detector()
             
@@ -463,12 +456,7 @@ def get_ip_locations_batch(ips: List[str], port: int = 443, use_v2: bool = True)
             logger.error(f"V2检测器异常，回退到V1: {e}")
     
     # 使用V1检测器
-    global _query
-    
-    if _query is None:
-        _query = IPLocationQuery()
-    
-    return _query.query_batch(ips)
+    return _get_query().query_batch(ips)
 
 
 def download_geoip_database(db_type: str = 'city') -> bool:
@@ -489,9 +477,10 @@ def close_database():
     """关闭数据库连接（便捷函数）"""
     global _query, _detector_v2
     
-    if _query is not None:
-        _query.close()
-        _query = None
+    with _query_lock:
+        if _query is not None:
+            _query.close()
+            _query = None
     
     if _detector_v2 is not None:
         try:
@@ -272,6 +272,62 @@ def print_summary(logger, fetch_success: bool, upload_success: bool, api_success
     logger.info("=" * 60)
 
 
+def restore_cache_snapshot(config, logger):
+    """
+    启动时从快照恢复缓存（未配置CACHE_SNAPSHOT_FILE时跳过）
+    
+    Args:
+        config: 配置对象
+        logger: 日志对象
+    """
+    if not config.cache_snapshot_file:
+        return
+    
+    try:
+        from .cache_snapshot import import_snapshot
+        if import_snapshot(config.cache_snapshot_file) is None:
+            logger.info(f"未找到可用的缓存快照，冷启动: {config.cache_snapshot_file}")
+    except Exception as e:
+        logger.warning(f"恢复缓存快照失败: {e}")
+
+
+def save_cache_snapshot(config, logger):
+    """
+    导出缓存快照（未配置CACHE_SNAPSHOT_FILE时跳过）
+    
+    Args:
+        config: 配置对象
+        logger: 日志对象
+    """
+    if not config.cache_snapshot_file:
+        return
+    
+    try:
+        from .cache_snapshot import export_snapshot
+        from .ip_detector_v2 import get_detector
+        
+        # 等待后台刷新完成，快照包含最新结果
+        get_detector().wait_for_refresh()
+        export_snapshot(config.cache_snapshot_file)
+    except Exception as e:
+        logger.warning(f"导出缓存快照失败: {e}")
+
+
+def compact_cache(logger):
+    """
+    运行结束时增量清理一批过期缓存记录
+    
+    Args:
+        logger: 日志对象
+    """
+    try:
+        from .ip_detector_v2 import get_detector
+        result = get_detector().compact_cache()
+        logger.info(f"过期缓存清理: {result['entries']} 条, {result['bytes'] / 1024:.1f}KB")
+    except Exception as e:
+        logger.warning(f"清理过期缓存失败: {e}")
+
+
 def main() -> int:
     """
     主函数
@@ -298,6 +354,9 @@ def main() -> int:
         logger.info("=" * 60)
         logger.info(config)
         
+        # 从快照恢复缓存（CI环境每次从空的cache目录启动）
+        restore_cache_snapshot(config, logger)
+        
         # 步骤1: 获取IP数据
         logger.info("=" * 60)
         logger.info("步骤 1/3: 获取优选IP数据（多数据源模式）")
@@ -349,6 +408,10 @@ def main() -> int:
             logger.error(f"获取IP数据失败: {e}", exc_info=True)
             fetch_success = False
         
+        # 清理一批过期记录，再导出快照供下一次运行使用
+        compact_cache(logger)
+        save_cache_snapshot(config, logger)
+        
         if not fetch_success:
             logger.error("IP数据获取失败，程序终止")
             end_time = get_timestamp()
@@ -5,8 +5,8 @@
 
 import logging
 import re
-import requests
 from typing import List, Dict, Optional
+from .http_client import get_http_client
 from .ip_location import get_ip_locations_batch
 
 logger = logging.getLogger(__name__)
@@ -25,10 +25,10 @@ class DataSource:
         """
         self.name = name
         self.prefix = prefix
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.http = get_http_client()
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        }
     
     def fetch(self, **kwargs) -> List[Dict]:
         """
@@ -73,9 +73,10 @@ class SourceA(DataSource):
                     'limit': limit
                 }
                 
-                response = self.session.post(
+                response = self.http.post(
                     self.api_query_url,
                     json=payload,
+                    headers=self.headers,
                     timeout=60  # 增加超时时间以应对慢速API响应
                 )
                 response.raise_for_status()
@@ -120,7 +121,7 @@ class SourceB(DataSource):
         try:
             logger.info(f"[{self.name}] 正在获取数据: {self.url}")
             
-            response = self.session.get(self.url, timeout=30)
+            response = self.http.get(self.url, headers=self.headers, timeout=30)
             response.raise_for_status()
             
             content = response.text
@@ -207,8 +208,8 @@ class SourceB(DataSource):
                     # 兜底机制
                     return (node, 'US', 'Los Angeles')
             
-            # 并发查询所有节点
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # 并发查询所有节点（检测结果在一个事务内写入缓存）
+            with detector.cache.batch(), ThreadPoolExecutor(max_workers=max_workers) as executor:
                 futures = {executor.submit(query_location, node): node for node in nodes}
                 
                 for future in as_completed(futures):
@@ -252,7 +253,7 @@ class SourceC(DataSource):
         try:
             logger.info(f"[{self.name}] 正在获取数据: {self.url}")
             
-            response = self.session.get(self.url, timeout=30)
+            response = self.http.get(self.url, headers=self.headers, timeout=30)
             response.raise_for_status()
             
             content = response.text
@@ -339,8 +340,8 @@ class SourceC(DataSource):
                     # 兜底机制
                     return (node, 'US', 'Los Angeles')
             
-            # 并发查询所有节点
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # 并发查询所有节点（检测结果在一个事务内写入缓存）
+            with detector.cache.batch(), ThreadPoolExecutor(max_workers=max_workers) as executor:
                 futures = {executor.submit(query_location, node): node for node in nodes}
                 
                 for future in as_completed(futures):
@@ -400,7 +401,7 @@ class SourceD(DataSource):
         if self.enable_bestproxy:
             try:
                 logger.info(f"[{self.name}] 正在获取 bestproxy 数据...")
-                response = self.session.get(self.bestproxy_url, timeout=10)
+                response = self.http.get(self.bestproxy_url, headers=self.headers, timeout=10)
                 response.raise_for_status()
                 
                 lines = response.text.strip().split('\n')
@@ -427,7 +428,7 @@ class SourceD(DataSource):
         if self.enable_bestcf:
             try:
                 logger.info(f"[{self.name}] 正在获取 bestcf 数据...")
-                response = self.session.get(self.bestcf_url, timeout=10)
+                response = self.http.get(self.bestcf_url, headers=self.headers, timeout=10)
                 response.raise_for_status()
                 
                 lines = response.text.strip().split('\n')
@@ -0,0 +1,178 @@
+"""
+网段前缀表模块
+按网段存储检测结果，用最长前缀匹配回答网段内任意IP的查询
+"""
+
+import time
+import ipaddress
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 各地址族允许缓存的最宽网段（前缀长度下限），过宽的网段不做前缀缓存
+DEFAULT_MIN_PREFIX_LENGTH = {4: 16, 6: 32}
+
+
+def _address(version: int, value: int):
+    """地址整数转换为地址对象"""
+    return ipaddress.IPv4Address(value) if version == 4 else ipaddress.IPv6Address(value)
+
+
+class PrefixTable:
+    """
+    最长前缀匹配表
+
+    每个地址族、每个前缀长度一张哈希表 {网络地址整数: 值}，
+    查询时从最长的前缀长度开始依次掩码查表，复杂度与出现过的前缀长度种类数成正比。
+    """
+
+    def __init__(self, min_prefix_length: Optional[Dict[int, int]] = None):
+        """
+        初始化前缀表
+
+        Args:
+            min_prefix_length: 各地址族 (4/6) 接受的最短前缀长度
+        """
+        self.min_prefix_length = dict(DEFAULT_MIN_PREFIX_LENGTH)
+        if min_prefix_length:
+            self.min_prefix_length.update(min_prefix_length)
+
+        # {地址族: {前缀长度: {网络地址整数: (值, 过期时间)}}}
+        self._tables: Dict[int, Dict[int, Dict[int, Tuple[Dict, float]]]] = {4: {}, 6: {}}
+        # {地址族: 按从长到短排序的前缀长度}
+        self._lengths: Dict[int, List[int]] = {4: [], 6: []}
+        self._lock = threading.Lock()
+
+    def parse(self, network: str) -> Optional[ipaddress._BaseNetwork]:
+        """
+        解析并校验网段
+
+        Returns:
+            网段对象，格式无效或比允许的最宽网段更宽时返回None
+        """
+        try:
+            net = ipaddress.ip_network(network, strict=False)
+        except (TypeError, ValueError):
+            return None
+
+        if net.prefixlen < self.min_prefix_length[net.version]:
+            return None
+        return net
+
+    def put(self, network: str, value: Dict, expires_at: float) -> bool:
+        """
+        写入网段
+
+        Args:
+            network: CIDR格式的网段
+            value: 值
+            expires_at: 过期时间戳
+
+        Returns:
+            是否写入（网段无效或过宽时不写入）
+        """
+        net = self.parse(network)
+        if net is None:
+            return False
+
+        with self._lock:
+            by_length = self._tables[net.version]
+            if net.prefixlen not in by_length:
+                by_length[net.prefixlen] = {}
+                self._lengths[net.version] = sorted(by_length, reverse=True)
+            by_length[net.prefixlen][int(net.network_address)] = (value, expires_at)
+        return True
+
+    def get(self, network: str) -> Optional[Dict]:
+        """精确获取网段的值（不做前缀匹配，忽略过期）"""
+        net = self.parse(network)
+        if net is None:
+            return None
+
+        with self._lock:
+            item = self._tables[net.version].get(net.prefixlen, {}).get(int(net.network_address))
+        return item[0] if item else None
+
+    def lookup(self, ip: str) -> Optional[Tuple[str, Dict]]:
+        """
+        最长前缀匹配
+
+        Args:
+            ip: IP地址
+
+        Returns:
+            (网段, 值)，没有包含该IP的有效网段返回None
+        """
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+
+        value = int(addr)
+        bits = addr.max_prefixlen
+        now = time.time()
+
+        with self._lock:
+            by_length = self._tables[addr.version]
+            for length in self._lengths[addr.version]:
+                key = value >> (bits - length) << (bits - length)
+                item = by_length[length].get(key)
+                if item is not None and item[1] >= now:
+                    return f"{_address(addr.version, key)}/{length}", item[0]
+
+        return None
+
+    def pop(self, network: str):
+        """删除网段"""
+        net = self.parse(network)
+        if net is None:
+            return
+
+        with self._lock:
+            self._tables[net.version].get(net.prefixlen, {}).pop(int(net.network_address), None)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        删除已过期的网段
+
+        Returns:
+            删除的网段数
+        """
+        now = now or time.time()
+        removed = 0
+
+        with self._lock:
+            for version, by_length in self._tables.items():
+                for length in list(by_length):
+                    table = by_length[length]
+                    expired = [key for key, (_, expires_at) in table.items() if expires_at < now]
+                    for key in expired:
+                        del table[key]
+                    removed += len(expired)
+                    if not table:
+                        del by_length[length]
+                self._lengths[version] = sorted(by_length, reverse=True)
+
+        return removed
+
+    def items(self) -> Iterator[Tuple[str, Dict, float]]:
+        """遍历全部网段，产出 (网段, 值, 过期时间)"""
+        with self._lock:
+            snapshot = [
+                (version, length, key, value, expires_at)
+                for version, by_length in self._tables.items()
+                for length, table in by_length.items()
+                for key, (value, expires_at) in table.items()
+            ]
+
+        for version, length, key, value, expires_at in snapshot:
+            yield f"{_address(version, key)}/{length}", value, expires_at
+
+    def clear(self):
+        """清空全部网段"""
+        with self._lock:
+            self._tables = {4: {}, 6: {}}
+            self._lengths = {4: [], 6: []}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(table) for by_length in self._tables.values() for table in by_length.values())
@@ -0,0 +1,311 @@
+"""
+限流模块
+为每个第三方API提供进程内共享的令牌桶限流器，
+可根据响应头（X-Rl/X-Ttl、X-RateLimit-*、Retry-After）校准剩余额度
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """请求超出限流额度（调用方应换用其他API或稍后重试，不计为API失败）"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} 限流, {retry_after:.1f}秒后可用")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶
+
+    令牌按rate匀速补充，最多积累capacity个；每次请求消耗一个令牌。
+    服务端告知额度已用完时（剩余为0或429），在重置前不再发放令牌。
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float):
+        """
+        初始化令牌桶
+
+        Args:
+            name: 名称（用于日志）
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发请求数）
+        """
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+        self.stats = {'acquired': 0, 'waited': 0, 'rejected': 0, 'server_limited': 0}
+
+    def _refill(self, now: float):
+        """按经过的时间补充令牌（调用方需持有锁）"""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait_time(self, now: float, tokens: float) -> float:
+        """获得tokens个令牌还需等待的秒数（调用方需持有锁）"""
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """
+        获得令牌需要等待的秒数（不消耗令牌）
+
+        Returns:
+            0表示当前可立即获得
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return self._wait_time(now, tokens)
+
+    def remaining_fraction(self) -> float:
+        """
+        剩余额度占桶容量的比例
+
+        Returns:
+            0-1之间的比例，服务端限流期间为0
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._blocked_until or self.capacity <= 0:
+                return 0.0
+            return max(0.0, self._tokens / self.capacity)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """尝试立即获得令牌，不等待"""
+        return self.acquire(tokens, timeout=0)
+
+    def acquire(self, tokens: float = 1, timeout: float = 0) -> bool:
+        """
+        获得令牌，额度不足时最多等待timeout秒
+
+        Args:
+            tokens: 令牌数
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            是否获得令牌
+        """
+        deadline = time.monotonic() + timeout
+        waited = False
+
+        while True:
+            acquired, wait = self._take(tokens, deadline, waited)
+            if acquired is not None:
+                return acquired
+
+            # 在锁外等待，其他线程可以同时检查
+            waited = True
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: float = 1, timeout: float = 0) -> bool:
+        """
+        获得令牌（异步版本，等待时不阻塞事件循环）
+
+        Args:
+            tokens: 令牌数
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            是否获得令牌
+        """
+        deadline = time.monotonic() + timeout
+        waited = False
+
+        while True:
+            acquired, wait = self._take(tokens, deadline, waited)
+            if acquired is not None:
+                return acquired
+
+            waited = True
+            await asyncio.sleep(wait)
+
+    def _take(self, tokens: float, deadline: float, waited: bool) -> Tuple[Optional[bool], float]:
+        """
+        尝试在截止时间前获得令牌
+
+        Returns:
+            (是否获得令牌, 需要等待的秒数)；需要等待后再试时为 (None, 等待秒数)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._wait_time(now, tokens)
+            if wait == 0:
+                self._tokens -= tokens
+                self.stats['acquired'] += 1
+                if waited:
+                    self.stats['waited'] += 1
+                return True, 0.0
+            if now + wait > deadline:
+                self.stats['rejected'] += 1
+                return False, 0.0
+            return None, wait
+
+    def update(self, remaining: Optional[float] = None, reset_in: Optional[float] = None):
+        """
+        根据服务端返回的额度信息校准
+
+        Args:
+            remaining: 当前窗口剩余的请求数
+            reset_in: 距离额度重置的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            if remaining is not None:
+                self._tokens = min(self._tokens, float(remaining))
+                if remaining <= 0 and reset_in:
+                    self._block(now, reset_in)
+
+    def block(self, seconds: float):
+        """服务端拒绝请求（429）时，在指定时间内不再发放令牌"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = 0.0
+            self._block(now, seconds)
+
+    def _block(self, now: float, seconds: float):
+        """暂停发放令牌（调用方需持有锁）"""
+        blocked_until = now + max(0.0, seconds)
+        if blocked_until > self._blocked_until:
+            self._blocked_until = blocked_until
+            self.stats['server_limited'] += 1
+            logger.info(f"{self.name} 额度已用完，{seconds:.0f}秒后恢复")
+
+    def update_from_headers(self, headers, status_code: int = 200):
+        """
+        从响应头校准额度
+
+        支持 X-Rl/X-Ttl（ip-api.com）、X-RateLimit-Remaining/X-RateLimit-Reset 和 Retry-After（429）
+        """
+        remaining = _header_number(headers, 'X-Rl', 'X-RateLimit-Remaining')
+        reset_in = _header_number(headers, 'X-Ttl', 'X-RateLimit-Reset-After')
+
+        # X-RateLimit-Reset 可能是秒数，也可能是Unix时间戳
+        if reset_in is None:
+            reset = _header_number(headers, 'X-RateLimit-Reset')
+            if reset is not None:
+                reset_in = reset - time.time() if reset > 1e9 else reset
+
+        if status_code == 429:
+            retry_after = _header_number(headers, 'Retry-After')
+            self.block(retry_after if retry_after is not None else (reset_in or 60))
+            return
+
+        if remaining is not None:
+            self.update(remaining, reset_in)
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        with self._lock:
+            return dict(self.stats, tokens=round(self._tokens, 1), rate_per_minute=self.rate * 60)
+
+
+def _header_number(headers, *names) -> Optional[float]:
+    """读取第一个存在的数值响应头"""
+    for name in names:
+        value = headers.get(name) if headers else None
+        if value is None:
+            continue
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+# 全局限流器（同一API的所有Provider实例和线程共享）
+_limiters: Dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, per_minute: float, burst: Optional[float] = None) -> TokenBucket:
+    """
+    获取指定API的共享限流器（首次调用时创建）
+
+    Args:
+        name: API名称
+        per_minute: 每分钟请求数
+        burst: 允许的突发请求数，默认为每分钟请求数
+
+    Returns:
+        TokenBucket实例
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = TokenBucket(name, per_minute / 60, burst or per_minute)
+        return limiter
+
+
+def get_all_limiters() -> Dict[str, TokenBucket]:
+    """获取全部已创建的限流器"""
+    with _limiters_lock:
+        return dict(_limiters)
+
+
+class RequestBudget:
+    """
+    按比例发放的额外请求预算（如对冲请求）
+
+    每次正常请求存入ratio个令牌，最多积累capacity个；每次额外请求消耗一个令牌，
+    额外请求数因此不会超过正常请求数的ratio倍（加上初始的突发额度）。
+    """
+
+    def __init__(self, name: str, ratio: float = 0.1, capacity: float = 10):
+        """
+        初始化请求预算
+
+        Args:
+            name: 名称（用于日志）
+            ratio: 每次正常请求存入的令牌数
+            capacity: 最多积累的令牌数
+        """
+        self.name = name
+        self.ratio = ratio
+        self.capacity = capacity
+
+        self._tokens = float(capacity)
+        self._lock = threading.Lock()
+        self.stats = {'spent': 0, 'exhausted': 0}
+
+    def deposit(self):
+        """记录一次正常请求"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """尝试消耗一个令牌用于额外请求"""
+        with self._lock:
+            if self._tokens < 1:
+                self.stats['exhausted'] += 1
+                return False
+            self._tokens -= 1
+            self.stats['spent'] += 1
+            return True
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        with self._lock:
+            return dict(self.stats, tokens=round(self._tokens, 1))
@@ -0,0 +1,282 @@
+"""
+API Provider批量查询测试脚本
+用本地HTTP替身服务器验证ip-api批量接口的分块、限流，以及APIManager对剩余IP的单IP回退；
+并验证对冲模式在主API变慢时按p90耗时并行请求下一个API，且受预算限制，
+以及按耗时、成功率和剩余额度的动态排序，和在一个事件循环上受并发上限控制的异步查询
+"""
+
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.api_providers import APIManager, BaseAPIProvider, IPAPIProvider
+from src.concurrency import run_sync
+from src.rate_limiter import TokenBucket
+
+
+def _lookup(ip: str) -> Dict:
+    if ip.startswith('10.'):
+        return {'status': 'success', 'query': ip, 'countryCode': 'JP', 'country': '日本', 'city': 'Tokyo'}
+    return {'status': 'fail', 'query': ip}
+
+
+class _IPAPIHandler(BaseHTTPRequestHandler):
+    """模拟 ip-api.com 的单IP接口和批量接口：10.x 以外的IP返回失败"""
+
+    def do_GET(self):
+        self._reply(_lookup(self.path.split('/')[2].split('?')[0]))
+
+    def do_POST(self):
+        ips = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.batches.append(len(ips))
+        self._reply([_lookup(ip) for ip in ips])
+
+    def _reply(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class _SlowIPAPIHandler(_IPAPIHandler):
+    """单IP接口每次耗时20毫秒，并记录同时处理的最大请求数"""
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+        time.sleep(0.02)
+        with self.server.lock:
+            self.server.active -= 1
+        super().do_GET()
+
+
+class _UnavailableHandler(BaseHTTPRequestHandler):
+    """总是返回503并记录请求次数"""
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class _SingleProvider(BaseAPIProvider):
+    """只有单IP接口的Provider"""
+
+    def __init__(self):
+        super().__init__('single')
+        self.queried = []
+
+    def query(self, ip: str) -> Optional[Dict]:
+        self.queried.append(ip)
+        return {'country': 'US', 'city': 'Ashburn', 'source': 'single'}
+
+    def parse_response(self, response):
+        return None
+
+
+class _DelayedProvider(BaseAPIProvider):
+    """按设定的耗时返回结果的Provider"""
+
+    def __init__(self, name: str, delay: float, result: bool = True):
+        super().__init__(name)
+        self.delay = delay
+        self.result = result
+        self.queried = 0
+
+    def query(self, ip: str) -> Optional[Dict]:
+        self.queried += 1
+        time.sleep(self.delay)
+        return {'country': 'JP', 'city': 'Tokyo', 'source': self.name} if self.result else None
+
+    def parse_response(self, response):
+        return None
+
+
+def test_hedged_query():
+    """测试主API超过p90耗时后对冲到下一个API，预算用完后不再对冲"""
+    slow = _DelayedProvider('slow', 0.5)
+    fast = _DelayedProvider('fast', 0.01)
+    for _ in range(20):
+        slow.record_latency(0.05)
+
+    manager = APIManager(hedge=True, hedge_ratio=0, hedge_burst=1)
+    manager.register_api(slow, 1)
+    manager.register_api(fast, 2)
+
+    start_time = time.time()
+    assert manager.query('10.0.0.1')['source'] == 'fast'
+    assert time.time() - start_time < 0.4
+    assert manager.get_hedge_stats() == {'queries': 1, 'hedged': 1, 'hedge_wins': 1, 'budget_exhausted': 0}
+
+    # 预算用完：等待主API返回，不再发出额外请求
+    assert manager.query('10.0.0.2')['source'] == 'slow'
+    assert fast.queried == 1 and manager.get_hedge_stats()['budget_exhausted'] == 1
+
+    # 主API失败时立即换下一个API，不消耗对冲预算
+    failing = _DelayedProvider('failing', 0.01, result=False)
+    manager = APIManager(hedge=True, hedge_ratio=0, hedge_burst=0)
+    manager.register_api(failing, 1)
+    manager.register_api(fast, 2)
+    assert manager.query('10.0.0.3')['source'] == 'fast'
+    assert manager.get_hedge_stats()['hedged'] == 0
+    print("  ✓ 对冲查询正常")
+
+
+def test_dynamic_ranking():
+    """测试按加权平均的耗时、成功率和额度排序，优先级只决定同分时的先后，固定的API始终在前"""
+    first = _DelayedProvider('first', 0)
+    second = _DelayedProvider('second', 0)
+    third = _DelayedProvider('third', 0)
+    for provider in (first, second, third):
+        provider.rate_limiter = TokenBucket(provider.name, 1, 10)
+
+    manager = APIManager()
+    manager.register_api(third, 3)
+    manager.register_api(second, 2)
+    manager.register_api(first, 1)
+    assert [p.name for p, _ in manager.providers] == ['first', 'second', 'third']
+
+    # first变慢、second频繁失败后，third排到最前面
+    for _ in range(10):
+        first.record_latency(2.0)
+        second.record_latency(0.1)
+        second.mark_failure()
+        third.record_latency(0.2)
+    manager.rerank()
+    assert [p.name for p, _ in manager.providers] == ['third', 'second', 'first']
+
+    # 额度用完的API排到后面
+    third.rate_limiter.block(60)
+    manager.rerank()
+    assert manager.providers[-1][0].name == 'third'
+    assert manager.get_stats()['third']['rank'] == 3
+
+    # 固定的API不参与动态排序
+    pinned = APIManager(pinned=['first'])
+    for provider, priority in ((third, 3), (second, 2), (first, 1)):
+        pinned.register_api(provider, priority)
+    assert pinned.providers[0][0].name == 'first'
+    print("  ✓ 动态排序正常")
+
+
+def test_async_fan_out():
+    """测试异步批量查询在一个事件循环上并发执行，且不超过API的并发上限"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SlowIPAPIHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.active = server.peak = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        ip_api = IPAPIProvider()
+        ip_api.supports_batch = False
+        ip_api.max_concurrency = 8
+        ip_api.rate_limiter = TokenBucket('test_async', 1000, 1000)
+        ip_api.url_template = f"http://127.0.0.1:{server.server_address[1]}" + '/json/{ip}'
+
+        manager = APIManager()
+        manager.register_api(ip_api, 1)
+
+        ips = [f'10.2.{i // 250}.{i % 250}' for i in range(200)] + ['192.0.2.9']
+        start_time = time.time()
+        results = run_sync(manager.query_many_async(ips))
+        elapsed = time.time() - start_time
+
+        assert len(results) == 201 and results['10.2.0.5']['city'] == 'Tokyo'
+        assert results['192.0.2.9'] is None
+        assert 1 < server.peak <= 8
+        assert elapsed < 200 * 0.02  # 明显快于逐个查询
+        assert ip_api.get_stats()['successful_requests'] == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(f"  ✓ 异步查询正常: 最大并发 {server.peak}, 耗时 {elapsed:.2f}秒")
+
+
+def test_query_batch():
+    """测试批量接口按100个IP分块，未解析的IP回退到单IP Provider"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _IPAPIHandler)
+    server.batches = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        ip_api = IPAPIProvider()
+        # 使用独立的限流器，不影响全局共享的额度
+        ip_api.rate_limiter = TokenBucket('test_single', 1, 45)
+        ip_api.batch_rate_limiter = TokenBucket('test_batch', 1 / 60, 3)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        ip_api.url_template = base_url + '/json/{ip}'
+        ip_api.batch_url = base_url + '/batch'
+        single = _SingleProvider()
+
+        manager = APIManager()
+        manager.register_api(ip_api, 1)
+        manager.register_api(single, 2)
+
+        ips = [f'10.0.{i // 250}.{i % 250}' for i in range(250)] + ['192.0.2.1', '192.0.2.2']
+        results = manager.query_batch(ips + ips[:10])
+
+        assert server.batches == [100, 100, 52]
+        assert len(results) == 252
+        assert results['10.0.0.1']['city'] == 'Tokyo' and results['10.0.0.1']['source'] == 'ip_api_com'
+        assert results['192.0.2.1']['source'] == 'single'
+        assert sorted(single.queried) == ['192.0.2.1', '192.0.2.2']
+
+        # 批量接口额度用完后剩余IP全部走单IP查询
+        single.queried.clear()
+        results = manager.query_batch(['10.1.0.1', '192.0.2.3'])
+        assert server.batches == [100, 100, 52]
+        assert results['10.1.0.1']['source'] == 'ip_api_com' and single.queried == ['192.0.2.3']
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(f"  ✓ 批量查询正常: {server.batches}")
+
+
+def test_no_client_retries():
+    """测试Provider请求不在HTTP客户端内重试：每次查询只发出一个请求、只消耗一个令牌"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _UnavailableHandler)
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        ip_api = IPAPIProvider()
+        ip_api.rate_limiter = TokenBucket('test_retries', 1 / 60, 2)
+        ip_api.url_template = f"http://127.0.0.1:{server.server_address[1]}" + '/json/{ip}'
+
+        manager = APIManager()
+        manager.register_api(ip_api, 1)
+
+        assert ip_api.query('10.0.0.1') is None
+        assert server.requests == 1
+        assert run_sync(manager.query_async('10.0.0.2')) is None
+        assert server.requests == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("  ✓ Provider请求不重试正常")
+
+
+if __name__ == '__main__':
+    test_query_batch()
+    test_hedged_query()
+    test_dynamic_ranking()
+    test_async_fan_out()
+    test_no_client_retries()
@@ -0,0 +1,173 @@
+"""
+分阶段批量检测测试脚本
+用桩函数代替各检测层级，验证批量读取缓存、每个层级每轮只执行一次批量检测、GeoIP按网段复用、
+复核并入API批量查询，以及批量写入缓存
+"""
+
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.ip_detector_v2 import IPDetectorV2
+
+CF_IPS = ['104.16.0.1', '104.16.0.2', '104.16.0.3']
+OTHER_IPS = ['8.8.8.1', '8.8.8.2', '8.8.8.3', '9.9.9.9']
+
+
+def _detector(tmp_path, sample_rate: float = 0.0) -> IPDetectorV2:
+    """各层级由桩函数代替的检测器：104.16.0.3 只能失败，9.9.9.9 不在GeoIP数据库中"""
+    config = SimpleNamespace(
+        cache_db_path=str(tmp_path / 'cache.db'),
+        verification_sample_rate=sample_rate,
+        detection_max_workers=4,
+        cache_stale_grace=3600
+    )
+    detector = IPDetectorV2(config)
+    detector._tier_available = lambda tier, is_cf: True
+    detector.calls = {'cf_ray': [], 'api': [], 'geoip': []}
+
+    def cf_ray(ip, port):
+        detector.calls['cf_ray'].append(ip)
+        if ip == '104.16.0.3':
+            return None
+        return {'country': 'JP', 'city': 'Tokyo', 'source': 'cf_ray', 'colo': 'NRT', 'ip': ip, 'confidence': 1.0}
+
+    def geoip(ip):
+        detector.calls['geoip'].append(ip)
+        if not ip.startswith('8.8.8.'):
+            return None
+        return {'country': 'US', 'city': 'Ashburn', 'source': 'GeoLite2-City', 'network': '8.8.8.0/24',
+                'ip': ip, 'confidence': 0.8}
+
+    def query_batch(ips, max_workers=5):
+        detector.calls['api'].append(sorted(ips))
+        return {
+            ip: None if ip.startswith('104.16.') else
+            {'country': 'US', 'city': 'Mountain View', 'source': 'ip-api', 'confidence': 0.95}
+            for ip in ips
+        }
+
+    detector._try_cf_ray = cf_ray
+    detector._try_geoip = geoip
+    detector.api_manager.query_batch = query_batch
+    return detector
+
+
+def test_tier_passes(tmp_path):
+    """测试各层级按轮批量执行，结果批量写入缓存"""
+    detector = _detector(tmp_path)
+    try:
+        results = detector.detect_batch(CF_IPS + OTHER_IPS + ['8.8.8.1'])
+
+        assert results['104.16.0.1']['colo'] == 'NRT' and results['104.16.0.3'] is None
+        assert results['8.8.8.2']['city'] == 'Ashburn' and results['8.8.8.2']['ip'] == '8.8.8.2'
+        assert results['9.9.9.9']['source'] == 'ip-api' and results['9.9.9.9']['ip'] == '9.9.9.9'
+
+        # GeoIP同一网段只查询一次；失败的CF IP和9.9.9.9在同一次API批量查询中
+        assert detector.calls['geoip'] == ['8.8.8.1', '9.9.9.9', '104.16.0.3']
+        assert detector.calls['api'] == [['104.16.0.3', '9.9.9.9']]
+        assert sorted(detector.calls['cf_ray']) == CF_IPS
+
+        passes = detector.get_stats()['batch_passes']
+        assert list(passes) == ['cache_read', 'cf_ray', 'geoip', 'api', 'cache_write']
+        assert passes['geoip']['runs'] == 2 and passes['api']['ips'] == 2
+        assert passes['cache_write']['found'] == 6
+
+        stats = detector.stats.snapshot()
+        assert stats['total'] == 7 and stats['success'] == 6 and stats['failed'] == 1
+
+        # 第二批全部命中缓存或跳过失败端点，不再调用任何层级
+        for calls in detector.calls.values():
+            calls.clear()
+        results = detector.detect_batch(CF_IPS + OTHER_IPS)
+        assert results['9.9.9.9']['source'] == 'ip-api' and results['104.16.0.3'] is None
+        assert not any(detector.calls.values())
+        assert detector.last_batch_passes['cache_read']['found'] == 6
+    finally:
+        detector.close()
+    print("  ✓ 分阶段批量检测正常")
+
+
+def test_stale_hits_served(tmp_path):
+    """测试宽限期内的过期结果在批量读取时直接采用，由后台刷新而不是重新批量检测"""
+    detector = _detector(tmp_path)
+    try:
+        detector.cache.set('8.8.8.1', {'country': 'US', 'city': 'Dallas', 'source': 'ip-api'}, 443, 'api', ttl=-10)
+        results = detector.detect_batch(['8.8.8.1', '8.8.8.2'])
+        assert results['8.8.8.1']['city'] == 'Dallas' and results['8.8.8.1']['stale'] is True
+        assert detector.last_batch_passes['cache_read']['found'] == 1
+        assert detector.last_batch_passes['geoip']['ips'] == 1
+        assert detector.stats.snapshot()['stale_served'] == 1
+
+        detector.wait_for_refresh()
+        assert detector.stats.snapshot()['refreshed'] == 1
+        assert detector.cache.get('8.8.8.1', 443)['city'] == 'Ashburn'
+    finally:
+        detector.close()
+    print("  ✓ 批量读取过期结果正常")
+
+
+def test_coalesced_with_detect(tmp_path):
+    """测试批量检测与并发的detect()、其他批次合并同一端点的检测，阶段统计在批次完成后发布"""
+    detector = _detector(tmp_path)
+    started, release = threading.Event(), threading.Event()
+    geoip = detector._try_geoip
+
+    def blocking_geoip(ip):
+        if ip == '8.8.8.1':
+            started.set()
+            release.wait(5)
+        return geoip(ip)
+
+    detector._try_geoip = blocking_geoip
+    try:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            batch = executor.submit(detector.detect_batch, ['8.8.8.1', '9.9.9.9'])
+            assert started.wait(5)
+            single = executor.submit(detector.detect, '8.8.8.1')
+            other_batch = executor.submit(detector.detect_batch, ['8.8.8.1', '8.8.4.4'])
+            time.sleep(0.1)
+            assert detector.last_batch_passes == {}  # 批次完成前不发布
+            release.set()
+
+            results = batch.result()
+            assert single.result() is results['8.8.8.1']
+            assert other_batch.result()['8.8.8.1'] is results['8.8.8.1']
+
+        # 8.8.8.1 只检测一次，另一批只检测自己的端点
+        assert sorted(detector.calls['geoip']) == ['8.8.4.4', '8.8.8.1', '9.9.9.9']
+        assert detector.stats.snapshot()['coalesced'] == 2
+        assert detector.last_batch_passes['cache_read']['ips'] == 2
+    finally:
+        release.set()
+        detector.close()
+    print("  ✓ 批量检测合并并发检测正常")
+
+
+def test_verification_joins_api_pass(tmp_path):
+    """测试需要复核的GeoIP结果并入同一次API批量查询"""
+    detector = _detector(tmp_path, sample_rate=1.0)
+    try:
+        results = detector.detect_batch(OTHER_IPS)
+        assert detector.calls['api'] == [OTHER_IPS]
+        assert all(results[ip]['source'] == 'ip-api' for ip in OTHER_IPS)
+
+        stats = detector.get_stats()['verification']['geoip/GeoLite2-City']
+        assert stats['verified'] == 3 and stats['disagreed'] == 3
+    finally:
+        detector.close()
+    print("  ✓ 复核并入批量查询正常")
+
+
+if __name__ == '__main__':
+    import tempfile
+    for test in (test_tier_passes, test_stale_hits_served, test_coalesced_with_detect,
+                 test_verification_joins_api_pass):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test(Path(temp_dir))
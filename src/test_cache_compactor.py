@@ -0,0 +1,65 @@
+"""
+缓存增量清理测试脚本
+验证每次清理有上限、按过期时间从早到晚清理，以及JSON后端索引的分批建立
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.cache_backends import JSONFileBackend, SQLiteBackend
+from src.cache_compactor import CacheCompactor
+
+
+def _fill(backend, now):
+    """写入30条已过期（过期时间各不相同）和10条未过期的记录"""
+    records = {f"10.0.0.{i}:443": ({'tiers': {}}, now - 1000 + i) for i in range(30)}
+    records.update({f"10.0.1.{i}:443": ({'tiers': {}}, now + 3600) for i in range(10)})
+    backend.set_many(records)
+
+
+def test_bounded_compaction(tmp_path):
+    """测试每次tick最多清理batch_size条，最早过期的记录先清理"""
+    now = time.time()
+    sqlite = SQLiteBackend(str(tmp_path / 'cache.db'))
+    json_backend = JSONFileBackend(str(tmp_path / 'json'))
+    _fill(sqlite, now)
+
+    compactor = CacheCompactor(batch_size=12)
+    compactor.register('sqlite', sqlite)
+    compactor.register('json', None)
+
+    result = compactor.tick(now)
+    assert result['entries'] == 12 and result['bytes'] > 0
+    assert sqlite.oldest_expiry() == now - 1000 + 12
+    assert sqlite.count() == 28
+
+    while compactor.tick(now)['entries']:
+        pass
+    assert sqlite.count() == 10
+    assert compactor.get_stats()['entries'] == 30
+    sqlite.close()
+
+    # JSON后端：已有文件在多次tick中分批进入索引
+    _fill(json_backend, now)
+    restarted = JSONFileBackend(str(tmp_path / 'json'))
+    assert restarted.oldest_expiry() == 0.0
+
+    compactor = CacheCompactor(batch_size=12)
+    compactor.register('json', restarted)
+    ticks = 0
+    while compactor.tick(now)['entries'] or restarted.oldest_expiry() == 0.0:
+        ticks += 1
+        assert ticks < 10
+    assert restarted.count() == 10
+    assert restarted.oldest_expiry() == now + 3600
+    print(f"  ✓ 增量清理正常: JSON后端 {ticks} 次完成")
+
+
+if __name__ == '__main__':
+    import tempfile
+    with tempfile.TemporaryDirectory() as temp_dir:
+        test_bounded_compaction(Path(temp_dir))
@@ -0,0 +1,91 @@
+"""
+缓存快照测试脚本
+验证快照导出、校验、合并恢复和过期丢弃
+"""
+
+import sys
+import gzip
+import json
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.cache_snapshot import export_snapshot, import_snapshot, load_snapshot
+from src.detection_cache import DetectionCache, FailureCache
+from src.endpoint_history import EndpointHistory
+
+
+def make_detector(root: Path):
+    """创建只包含缓存组件的检测器替身"""
+    db_path = str(root / 'cache.db')
+    return SimpleNamespace(
+        cache=DetectionCache(cache_dir=str(root / 'ip_detection'), db_path=db_path,
+                             history=EndpointHistory(db_path=db_path)),
+        failure_cache=FailureCache(db_path=db_path)
+    )
+
+
+def test_snapshot_roundtrip(tmp_path):
+    """测试导出后在空缓存中恢复"""
+    source = make_detector(tmp_path / 'run1')
+    source.cache.set('1.1.1.1', {'country': 'JP', 'city': 'Tokyo', 'colo': 'NRT'}, 443, 'cf_ray')
+    source.cache.set('8.8.8.8', {'country': 'US', 'city': 'Mountain View'}, 443, 'api')
+    source.cache.set('9.9.9.9', {'country': 'CH'}, 443, 'api', ttl=-10)  # 已过期，不导出
+    source.failure_cache.record_failure('10.0.0.1', 443)
+    
+    snapshot_path = tmp_path / 'snapshot.json.gz'
+    counts = export_snapshot(str(snapshot_path), source)
+    assert counts['detection'] == 2 and counts['failures'] == 1 and counts['history'] == 2
+    
+    target = make_detector(tmp_path / 'run2')
+    # 目标中已有更新的结果，合并时保留
+    target.cache.set('8.8.8.8', {'country': 'US', 'city': 'Ashburn'}, 443, 'api')
+    
+    counts = import_snapshot(str(snapshot_path), target)
+    assert counts['detection'] == 1 and counts['failures'] == 1
+    assert target.cache.get('1.1.1.1', 443, min_tier='cf_ray')['city'] == 'Tokyo'
+    assert target.cache.get('8.8.8.8', 443)['city'] == 'Ashburn'
+    assert target.failure_cache.should_skip('10.0.0.1', 443)
+    assert target.cache.history.get('1.1.1.1:443', 'cf_ray') is not None
+    print(f"  ✓ 快照导出恢复正常: {counts}")
+
+
+def test_snapshot_validation(tmp_path):
+    """测试无效快照和过期记录被拒绝"""
+    bad_path = tmp_path / 'bad.json.gz'
+    bad_path.write_bytes(b'not gzip')
+    assert load_snapshot(str(bad_path)) is None
+    assert load_snapshot(str(tmp_path / 'missing.json.gz')) is None
+    
+    old_path = tmp_path / 'old.json.gz'
+    with gzip.open(old_path, 'wt', encoding='utf-8') as f:
+        json.dump({'format': 'cf-ip-cache-snapshot', 'version': 999, 'sections': {}}, f)
+    assert load_snapshot(str(old_path)) is None
+    
+    expired_path = tmp_path / 'expired.json.gz'
+    with gzip.open(expired_path, 'wt', encoding='utf-8') as f:
+        json.dump({
+            'format': 'cf-ip-cache-snapshot',
+            'version': 1,
+            'created_at': time.time(),
+            'sections': {
+                'detection': [
+                    ['1.1.1.1:443', {'tiers': {}}, time.time() - 1],
+                    ['broken'],
+                ]
+            }
+        }, f)
+    
+    target = make_detector(tmp_path / 'run')
+    assert import_snapshot(str(expired_path), target)['detection'] == 0
+    print("  ✓ 快照校验正常")
+
+
+if __name__ == '__main__':
+    import tempfile
+    for test in (test_snapshot_roundtrip, test_snapshot_validation):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test(Path(temp_dir))
@@ -0,0 +1,88 @@
+"""
+缓存预热测试脚本
+验证端点出现记录的运行计数，以及预热候选的选择和排序
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.cache_warmer import CacheWarmer, SightingLog
+from src.detection_cache import DetectionCache, FailureCache
+
+
+class _Detector:
+    """只包含预热所需接口的检测器，warm直接写入缓存"""
+
+    def __init__(self, tmp_path):
+        db_path = str(tmp_path / 'cache.db')
+        self.cache = DetectionCache(cache_dir=str(tmp_path / 'ip_detection'), db_path=db_path)
+        self.failure_cache = FailureCache(db_path=db_path)
+        self.sightings = SightingLog(db_path=db_path)
+        self.warmed = []
+
+    def is_cloudflare_ip(self, ip):
+        return False
+
+    def _cache_min_tier(self, is_cf):
+        return None
+
+    def warm(self, ip, port=443):
+        self.warmed.append((ip, port))
+        self.cache.set(ip, {'ip': ip, 'country': 'US'}, port, 'api')
+        return True
+
+
+def test_sighting_runs(tmp_path):
+    """测试同一次运行内多次出现只计一次，且记录持久化"""
+    log = SightingLog(run_gap=3600, db_path=str(tmp_path / 'cache.db'))
+    log.observe('1.1.1.1', 443)
+    log.observe('1.1.1.1', 443)
+    assert log.recent(0)[0][2]['runs'] == 1
+
+    log._records['1.1.1.1:443']['last_seen'] -= 7200
+    log.observe('1.1.1.1', 443)
+    assert log.recent(0)[0][2]['runs'] == 2
+    log.close()
+
+    reloaded = SightingLog(db_path=str(tmp_path / 'cache.db'))
+    assert reloaded.recent(time.time() - 60) == [('1.1.1.1', 443, reloaded.recent(0)[0][2])]
+    reloaded.close()
+    print("  ✓ 端点出现记录正常")
+
+
+def test_warm_plan(tmp_path):
+    """测试只预热下一次运行前会过期的端点，出现次数多的优先"""
+    detector = _Detector(tmp_path)
+    next_run = time.time() + 3600
+
+    for ip, runs in (('10.0.0.1', 1), ('10.0.0.2', 5), ('10.0.0.3', 3), ('10.0.0.4', 2)):
+        detector.sightings.observe(ip, 443)
+        detector.sightings._records[f'{ip}:443']['runs'] = runs
+
+    # 10.0.0.3 的结果在下一次运行后才过期；10.0.0.4 在下一次运行前过期；10.0.0.1 被失败退避跳过
+    detector.cache.set('10.0.0.3', {'country': 'JP'}, 443, 'api', ttl=7200)
+    detector.cache.set('10.0.0.4', {'country': 'JP'}, 443, 'api', ttl=60)
+    detector.failure_cache.record_failure('10.0.0.1', 443)
+
+    warmer = CacheWarmer(detector, batch_size=1, pause=0)
+    assert warmer.plan(next_run) == [('10.0.0.2', 443), ('10.0.0.4', 443)]
+
+    result = warmer.run(next_run)
+    assert result == dict(result, candidates=2, warmed=1, failed=0)
+    assert warmer.plan(next_run) == [('10.0.0.4', 443)]
+
+    assert warmer.run(next_run, should_stop=lambda: True)['warmed'] == 0
+    assert detector.warmed == [('10.0.0.2', 443)]
+    detector.cache.close()
+    print("  ✓ 预热候选选择正常")
+
+
+if __name__ == '__main__':
+    import tempfile
+    for test in (test_sighting_runs, test_warm_plan):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test(Path(temp_dir))
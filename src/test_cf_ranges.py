@@ -0,0 +1,85 @@
+"""
+Cloudflare IP段索引测试脚本
+验证单个查询与批量查询结果一致
+"""
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.cf_ranges import CloudflareRangeIndex, CloudflareRangeProvider
+
+
+def test_range_index():
+    """测试IP段索引"""
+    index = CloudflareRangeIndex()
+    
+    cases = [
+        ('104.16.132.229', True),
+        ('104.31.255.255', True),
+        ('103.21.244.10', True),
+        ('141.101.64.1', True),
+        ('162.158.1.1', True),
+        ('162.159.45.47', True),
+        ('2606:4700::1111', True),
+        ('8.8.8.8', False),
+        ('104.32.0.1', False),
+        ('2001:4860::8888', False),
+        ('not-an-ip', False),
+    ]
+    
+    print("\nCloudflare IP段索引测试:")
+    for ip, expected in cases:
+        is_cf = index.contains(ip)
+        status = "✓" if is_cf == expected else "✗"
+        print(f"  {status} {ip}: {'Cloudflare' if is_cf else '非Cloudflare'}")
+        assert is_cf == expected
+    
+    batch = index.contains_many([ip for ip, _ in cases])
+    assert batch == [expected for _, expected in cases]
+    print(f"  ✓ 批量查询结果一致 ({len(cases)} 个IP, {len(index)} 个区间)")
+
+
+
+def test_range_provider_fallback(tmp_path):
+    """测试IP段提供者的本地缓存加载和离线回退"""
+    cache_file = tmp_path / 'cf_ranges.json'
+    
+    # 无缓存文件时使用内置列表
+    provider = CloudflareRangeProvider(cache_file=str(cache_file))
+    assert provider.source == 'bundled'
+    assert provider.index.contains('104.16.132.229')
+    
+    # 从本地缓存文件加载
+    cache_file.write_text('{"ipv4": ["192.0.2.0/24"], "ipv6": [], "updated_at": 0}', encoding='utf-8')
+    provider = CloudflareRangeProvider(cache_file=str(cache_file))
+    assert provider.source == 'cache'
+    assert provider.index.contains('192.0.2.1')
+    assert not provider.index.contains('104.16.132.229')
+    assert provider.is_stale()
+    print("  ✓ IP段提供者缓存加载正常")
+
+
+def test_legacy_ranges_survive_refresh(tmp_path):
+    """测试刷新为官方列表后，历史IP段仍归为Cloudflare且不写入缓存文件"""
+    provider = CloudflareRangeProvider(cache_file=str(tmp_path / 'cf_ranges.json'))
+    published = {'ipv4': ['104.16.0.0/13', '104.24.0.0/14'], 'ipv6': ['2606:4700::/32']}
+    provider._fetch_list = lambda family: (published[family], {'etag': family})
+    
+    assert provider.refresh() and provider.source == 'remote'
+    assert provider.index.contains('104.28.162.74')
+    assert provider.index.ipv4_ranges == published['ipv4']
+    
+    reloaded = CloudflareRangeProvider(cache_file=str(tmp_path / 'cf_ranges.json'))
+    assert reloaded.source == 'cache' and reloaded.index.contains('104.28.162.74')
+    print("  ✓ 历史IP段在刷新后保留")
+
+
+if __name__ == '__main__':
+    import tempfile
+    test_range_index()
+    for test in (test_range_provider_fallback, test_legacy_ranges_survive_refresh):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test(Path(temp_dir))
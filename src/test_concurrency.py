@@ -0,0 +1,101 @@
+"""
+并发工具测试脚本
+验证请求合并与原子计数器在多线程下的行为
+"""
+
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.concurrency import AtomicCounters, SingleFlight
+
+
+def test_single_flight():
+    """测试同一个键的并发调用只执行一次"""
+    flight = SingleFlight()
+    calls = AtomicCounters({'calls': 0})
+    started = threading.Event()
+    
+    def slow_detect():
+        calls.incr('calls')
+        started.set()
+        time.sleep(0.2)
+        return {'ip': '1.1.1.1', 'source': 'cf_ray'}
+    
+    def worker(_):
+        return flight.do(('1.1.1.1', 443), slow_detect)
+    
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(worker, range(8)))
+    
+    assert calls['calls'] == 1
+    assert all(result == {'ip': '1.1.1.1', 'source': 'cf_ray'} for result, _ in results)
+    assert sum(1 for _, shared in results if shared) == 7
+    assert flight.in_flight() == 0
+    
+    # 调用结束后同一个键重新执行
+    flight.do(('1.1.1.1', 443), slow_detect)
+    assert calls['calls'] == 2
+    print(f"  ✓ 请求合并正常: 8个并发调用执行 1 次")
+
+
+def test_single_flight_error():
+    """测试执行异常会传递给所有等待者"""
+    flight = SingleFlight()
+    
+    def failing():
+        time.sleep(0.1)
+        raise RuntimeError('timeout')
+    
+    def worker(_):
+        try:
+            flight.do('key', failing)
+        except RuntimeError:
+            return True
+        return False
+    
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert all(executor.map(worker, range(4)))
+    
+    assert flight.in_flight() == 0
+    print("  ✓ 异常传递正常")
+
+
+def test_single_flight_claim():
+    """测试批量登记的键与do()相互合并"""
+    flight = SingleFlight()
+    owned, waiting = flight.claim(['a', 'b', 'a'])
+    assert list(owned) == ['a', 'b'] and not waiting
+    
+    # 已登记的键由do()等待批量执行的结果
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(flight.do, 'a', lambda: 'single')
+        time.sleep(0.05)
+        
+        # 另一批登记时只得到未在执行中的键
+        other_owned, other_waiting = flight.claim(['b', 'c'])
+        assert list(other_owned) == ['c'] and list(other_waiting) == ['b']
+        
+        flight.resolve('a', 'batch')
+        flight.resolve('b', error=RuntimeError('timeout'))
+        flight.resolve('c', 'batch')
+        assert future.result() == ('batch', True)
+    
+    try:
+        other_waiting['b'].result()
+        assert False
+    except RuntimeError:
+        pass
+    assert flight.in_flight() == 0
+    print("  ✓ 批量登记合并正常")
+
+
+if __name__ == '__main__':
+    test_single_flight()
+    test_single_flight_error()
+    test_single_flight_claim()
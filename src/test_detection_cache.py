@@ -0,0 +1,252 @@
+"""
+检测缓存测试脚本
+验证SQLite后端、批量读写和旧版JSON缓存迁移
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.cache_backends import JSONFileBackend, SQLiteBackend
+from src.detection_cache import DetectionCache, FailureCache, LRUMemoryCache
+
+
+def test_sqlite_backend(tmp_path):
+    """测试SQLite后端读写与批量事务"""
+    cache = DetectionCache(cache_dir=str(tmp_path / 'ip_detection'), db_path=str(tmp_path / 'cache.db'))
+    
+    cache.set('8.8.8.8', {'country': 'US', 'city': 'Mountain View'}, 443, 'api')
+    assert cache.get('8.8.8.8', 443)['country'] == 'US'
+    
+    with cache.batch():
+        cache.set('1.1.1.1', {'country': 'JP', 'city': 'Tokyo'}, 443, 'cf_ray')
+        cache.set('1.0.0.1', {'country': 'HK', 'city': 'Hong Kong'}, 443, 'cf_ray')
+        # 批量模式下尚未写入持久化存储
+        assert cache.backend.count() == 1
+    
+    assert cache.backend.count() == 3
+    
+    hits = cache.get_many([('1.1.1.1', 443), ('1.0.0.1', 443), ('9.9.9.9', 443)])
+    assert set(hits) == {'1.1.1.1:443', '1.0.0.1:443'}
+    assert hits['1.1.1.1:443'] == ({'country': 'JP', 'city': 'Tokyo'}, False)
+    print(f"  ✓ SQLite后端读写正常: {cache.get_stats()}")
+    cache.close()
+
+
+def test_json_migration(tmp_path):
+    """测试旧版JSON文件缓存迁移"""
+    cache_dir = tmp_path / 'ip_detection'
+    legacy = JSONFileBackend(str(cache_dir))
+    now = time.time()
+    legacy.set('104.16.132.229:443:cf_ray', {
+        'data': {'ip': '104.16.132.229', 'country': 'JP', 'city': 'Tokyo', 'source': 'cf_ray'},
+        'timestamp': now, 'ttl': 3600, 'cache_type': 'cf_ray'
+    }, now + 3600)
+    legacy.set('8.8.8.8:443:api', {
+        'data': {'ip': '8.8.8.8', 'country': 'US'},
+        'timestamp': now - 7200, 'ttl': 3600, 'cache_type': 'api'
+    }, now - 3600)
+    
+    cache = DetectionCache(cache_dir=str(cache_dir), db_path=str(tmp_path / 'cache.db'))
+    
+    # 有效记录已迁移，过期记录被丢弃，旧文件已删除
+    assert cache.backend.count() == 1
+    assert cache.get('104.16.132.229', 443)['city'] == 'Tokyo'
+    assert not list(cache_dir.glob('*.json'))
+    print("  ✓ JSON缓存迁移正常")
+    cache.close()
+
+
+def test_json_migration_failure(tmp_path):
+    """测试写入新后端失败时保留旧文件，下次启动重试；没有IP字段的记录不从文件名猜测"""
+    cache_dir = tmp_path / 'ip_detection'
+    legacy = JSONFileBackend(str(cache_dir))
+    now = time.time()
+    legacy.set('1.2.3.4:443:api', {
+        'data': {'ip': '1.2.3.4', 'country': 'US'},
+        'timestamp': now, 'ttl': 3600, 'cache_type': 'api'
+    }, now + 3600)
+    legacy.set('2606:4700::1:443:api', {
+        'data': {'country': 'US'},
+        'timestamp': now, 'ttl': 3600, 'cache_type': 'api'
+    }, now + 3600)
+    files = sorted(cache_dir.glob('*.json'))
+    assert len(files) == 2
+    
+    original = SQLiteBackend.set_many
+    
+    def failing_set_many(self, records):
+        raise OSError('disk full')
+    
+    SQLiteBackend.set_many = failing_set_many
+    try:
+        cache = DetectionCache(cache_dir=str(cache_dir), db_path=str(tmp_path / 'cache.db'))
+    finally:
+        SQLiteBackend.set_many = original
+    assert sorted(cache_dir.glob('*.json')) == files
+    cache.close()
+    
+    cache = DetectionCache(cache_dir=str(cache_dir), db_path=str(tmp_path / 'cache.db'))
+    assert cache.get('1.2.3.4', 443)['country'] == 'US'
+    assert cache.backend.count() == 1
+    assert not list(cache_dir.glob('*.json'))
+    cache.close()
+    print("  ✓ 迁移失败保留旧文件正常")
+
+
+
+def test_tier_selection(tmp_path):
+    """测试按层级选择最优有效结果"""
+    cache = DetectionCache(cache_dir=str(tmp_path / 'ip_detection'), db_path=str(tmp_path / 'cache.db'))
+    
+    cache.set('104.16.132.229', {'country': 'US', 'source': 'GeoLite2-City'}, 443, 'geoip')
+    assert cache.get('104.16.132.229', 443)['source'] == 'GeoLite2-City'
+    # CF IP只接受CF-RAY结果
+    assert cache.get('104.16.132.229', 443, min_tier='cf_ray') is None
+    
+    cache.set('104.16.132.229', {'country': 'JP', 'source': 'cf_ray'}, 443, 'cf_ray')
+    assert cache.get('104.16.132.229', 443)['source'] == 'cf_ray'
+    assert cache.get('104.16.132.229', 443, cache_type='geoip')['source'] == 'GeoLite2-City'
+    
+    # 高层级过期后回退到仍有效的低层级
+    cache.set('104.16.132.229', {'country': 'JP', 'source': 'cf_ray'}, 443, 'cf_ray', ttl=-1)
+    assert cache.get('104.16.132.229', 443)['source'] == 'GeoLite2-City'
+    
+    # 每个端点只有一条持久化记录
+    assert cache.backend.count() == 1
+    print("  ✓ 层级选择正常")
+    cache.close()
+
+
+
+def test_lru_memory_cache():
+    """测试内存缓存的LRU淘汰和惰性过期"""
+    memory = LRUMemoryCache(max_entries=2, max_bytes=1024 * 1024)
+    now = time.time()
+    
+    memory.put('a', {'v': 1}, now + 60)
+    memory.put('b', {'v': 2}, now + 60)
+    assert memory.get('a') == {'v': 1}  # a 变为最近使用
+    memory.put('c', {'v': 3}, now + 60)  # 淘汰 b
+    assert 'b' not in memory and 'a' in memory and 'c' in memory
+    
+    memory.put('d', {'v': 4}, now - 1)
+    assert memory.get('d') is None
+    
+    # 字节数上限
+    small = LRUMemoryCache(max_entries=100, max_bytes=64)
+    for i in range(10):
+        small.put(f"k{i}", {'value': 'x' * 20}, now + 60)
+    assert small.get_stats()['bytes'] <= 64
+    
+    stats = memory.get_stats()
+    assert stats['evictions'] >= 1 and stats['expired'] == 1
+    print(f"  ✓ 内存缓存LRU正常: {stats}")
+
+
+
+def test_concurrent_writes(tmp_path):
+    """测试多线程并发写入同一端点的不同层级不会互相覆盖"""
+    cache = DetectionCache(cache_dir=str(tmp_path / 'ip_detection'), db_path=str(tmp_path / 'cache.db'))
+    endpoints = [(f"10.0.{i // 256}.{i % 256}", 443) for i in range(200)]
+    
+    def write(tier):
+        with cache.batch():
+            for ip, port in endpoints:
+                cache.set(ip, {'ip': ip, 'source': tier}, port, tier)
+                cache.get(ip, port)
+    
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(write, ['geoip', 'api', 'cf_ray'] * 2))
+    
+    for ip, port in endpoints:
+        for tier in ('geoip', 'api', 'cf_ray'):
+            assert cache.get(ip, port, cache_type=tier)['source'] == tier
+    
+    stats = cache.get_stats()
+    assert stats['sets'] == len(endpoints) * 6
+    cache.close()
+    print(f"  ✓ 并发写入正常: {stats['sets']} 次写入")
+
+
+
+def test_failure_backoff(tmp_path):
+    """测试失败记录的指数退避和跨实例持久化"""
+    db_path = str(tmp_path / 'cache.db')
+    failures = FailureCache(retry_delay=100, max_retry_delay=350, jitter=0, db_path=db_path)
+    
+    # 首次失败即跳过
+    failures.record_failure('10.0.0.1', 443)
+    assert failures.should_skip('10.0.0.1', 443)
+    assert not failures.should_skip('10.0.0.1', 8443)
+    
+    delays = []
+    for _ in range(3):
+        failures.failures['10.0.0.1:443']['retry_after'] = 0  # 模拟到达重试时间
+        assert not failures.should_skip('10.0.0.1', 443)
+        failures.record_failure('10.0.0.1', 443)
+        info = failures.failures['10.0.0.1:443']
+        delays.append(round(info['retry_after'] - info['last_failure']))
+    assert delays == [200, 350, 350]  # 翻倍直到上限
+    failures.close()
+    
+    # 新实例（下一次运行）加载持久化的记录
+    reloaded = FailureCache(retry_delay=100, max_retry_delay=350, jitter=0, db_path=db_path)
+    assert reloaded.should_skip('10.0.0.1', 443)
+    assert reloaded.failures['10.0.0.1:443']['count'] == 4
+    
+    reloaded.clear_failure('10.0.0.1', 443)
+    reloaded.close()
+    assert FailureCache(db_path=db_path).get_stats()['total_failures'] == 0
+    print(f"  ✓ 失败退避正常: {delays}")
+
+
+
+def test_stale_while_revalidate(tmp_path):
+    """测试宽限期内的过期结果可被lookup返回并标记为过期"""
+    cache = DetectionCache(cache_dir=str(tmp_path / 'ip_detection'), db_path=str(tmp_path / 'cache.db'),
+                           stale_grace=3600)
+    
+    cache.set('1.1.1.1', {'country': 'JP', 'source': 'cf_ray'}, 443, 'cf_ray', ttl=-10)
+    assert cache.get('1.1.1.1', 443) is None
+    assert cache.lookup('1.1.1.1', 443) == ({'country': 'JP', 'source': 'cf_ray'}, True)
+    # 读取过期结果不计为过期淘汰
+    assert cache.get_stats()['expired'] == 0
+    
+    # 新鲜的低层级结果优先于过期的高层级结果
+    cache.set('1.1.1.1', {'country': 'US', 'source': 'api'}, 443, 'api')
+    assert cache.lookup('1.1.1.1', 443) == ({'country': 'US', 'source': 'api'}, False)
+    assert cache.lookup('1.1.1.1', 443, min_tier='cf_ray')[1] is True
+    
+    # 超出宽限期的结果不再返回
+    cache.set('1.0.0.1', {'country': 'HK'}, 443, 'cf_ray', ttl=-7200)
+    assert cache.lookup('1.0.0.1', 443) == (None, False)
+    
+    # 批量读取同样返回宽限期内的过期结果
+    hits = cache.get_many([('1.1.1.1', 443), ('1.0.0.1', 443)], min_tier='cf_ray')
+    assert hits == {'1.1.1.1:443': ({'country': 'JP', 'source': 'cf_ray'}, True)}
+    assert cache.get_many([('1.1.1.1', 443)], min_tier='cf_ray', allow_stale=False) == {}
+    
+    assert cache.get_stats()['stale_hits'] == 3
+    # 超出宽限期的记录在第一次读取时删除，多次读取只计一次过期
+    assert cache.get_stats()['expired'] == 1 and cache.backend.get('1.0.0.1:443') is None
+    
+    # 超出宽限期的层级在写入时被丢弃，计为过期
+    cache.set('1.1.1.1', {'country': 'JP', 'source': 'cf_ray'}, 443, 'cf_ray', ttl=-7200)
+    cache.set('1.1.1.1', {'country': 'US', 'source': 'GeoLite2-City'}, 443, 'geoip')
+    assert cache.get_stats()['expired'] == 2
+    cache.close()
+    print("  ✓ 过期结果宽限期正常")
+
+
+if __name__ == '__main__':
+    import tempfile
+    test_lru_memory_cache()
+    for test in (test_sqlite_backend, test_json_migration, test_json_migration_failure, test_tier_selection,
+                 test_concurrent_writes, test_failure_backoff, test_stale_while_revalidate):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test(Path(temp_dir))
@@ -0,0 +1,63 @@
+"""
+端点历史测试脚本
+验证自适应TTL随结果稳定性变化，以及历史在缓存过期后的保留
+"""
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.detection_cache import DetectionCache
+from src.endpoint_history import EndpointHistory
+
+
+def test_adaptive_ttl(tmp_path):
+    """测试稳定端点TTL增长、变化端点TTL缩短"""
+    history = EndpointHistory(min_factor=0.25, max_factor=4, db_path=str(tmp_path / 'cache.db'))
+    tokyo = {'country': 'JP', 'city': 'Tokyo', 'colo': 'NRT'}
+    osaka = {'country': 'JP', 'city': 'Osaka', 'colo': 'KIX'}
+    
+    ttls = [history.observe('1.1.1.1:443', 'cf_ray', tokyo, 100) for _ in range(5)]
+    assert ttls == [100, 200, 400, 400, 400]
+    
+    ttls = [history.observe('1.1.1.1:443', 'cf_ray', data, 100) for data in (osaka, tokyo, osaka, tokyo)]
+    assert ttls == [200, 100, 50, 25]
+    assert history.get('1.1.1.1:443', 'cf_ray')['changes'] == 4
+    history.close()
+    
+    # 历史持久化，下一次运行继续使用
+    reloaded = EndpointHistory(min_factor=0.25, max_factor=4, db_path=str(tmp_path / 'cache.db'))
+    assert reloaded.observe('1.1.1.1:443', 'cf_ray', tokyo, 100) == 50
+    reloaded.close()
+    print(f"  ✓ 自适应TTL正常: {ttls}")
+
+
+def test_cache_uses_history(tmp_path):
+    """测试检测缓存按端点历史设置TTL，显式TTL不受影响"""
+    db_path = str(tmp_path / 'cache.db')
+    cache = DetectionCache(cache_dir=str(tmp_path / 'ip_detection'), db_path=db_path,
+                           default_ttl={'api': 1000}, history=EndpointHistory(db_path=db_path))
+    
+    for _ in range(3):
+        cache.set('8.8.8.8', {'country': 'US', 'city': 'Mountain View'}, 443, 'api')
+    entry = cache._load_entry('8.8.8.8:443')
+    assert entry['tiers']['api']['ttl'] == 4000
+    
+    cache.set('8.8.8.8', {'country': 'US', 'city': 'Ashburn'}, 443, 'api')
+    assert cache._load_entry('8.8.8.8:443')['tiers']['api']['ttl'] == 2000
+    
+    cache.set('8.8.4.4', {'country': 'US'}, 443, 'api', ttl=60)
+    assert cache._load_entry('8.8.4.4:443')['tiers']['api']['ttl'] == 60
+    
+    assert cache.get_stats()['history']['endpoints'] == 1
+    cache.close()
+    print("  ✓ 检测缓存自适应TTL正常")
+
+
+if __name__ == '__main__':
+    import tempfile
+    for test in (test_adaptive_ttl, test_cache_uses_history):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test(Path(temp_dir))
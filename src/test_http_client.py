@@ -0,0 +1,130 @@
+"""
+共享HTTP客户端测试脚本
+用本地HTTP替身服务器验证连接复用、网关错误重试、非幂等请求不重试，以及按主机熔断
+"""
+
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.http_client import CircuitBreaker, CircuitOpenError, HTTPClient
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """/flaky/N 前N次返回503，/down 总是返回503，其他路径返回200"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            hits = server.hits[self.path]
+            server.connections.add(self.client_address)
+
+        if self.path == '/down' or (self.path.startswith('/flaky/') and hits <= int(self.path.split('/')[2])):
+            self._reply(503)
+        else:
+            self._reply(200)
+
+    do_POST = do_GET
+
+    def _reply(self, status: int):
+        if self.command == 'POST':
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        data = b'ok'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.daemon_threads = True
+    server.hits = {}
+    server.connections = set()
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_keep_alive_and_retry():
+    """测试连接复用和503重试"""
+    server = _start_server()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    client = HTTPClient(pool_size=4, max_retries=2, backoff=0.01)
+    try:
+        for _ in range(5):
+            assert client.get(f"{base}/ok", timeout=5).status_code == 200
+        assert len(server.connections) == 1
+
+        # 前两次503，第三次成功
+        assert client.get(f"{base}/flaky/2", timeout=5).status_code == 200
+        assert server.hits['/flaky/2'] == 3
+
+        # 非幂等请求默认不重试，显式指定后重试
+        assert client.post(f"{base}/flaky/1", data=b'x', timeout=5).status_code == 503
+        assert client.post(f"{base}/flaky/1", data=b'x', timeout=5).status_code == 200
+        assert client.post(f"{base}/flaky/3", data=b'x', timeout=5, retries=3).status_code == 200
+
+        stats = client.get_stats()[f"127.0.0.1:{server.server_address[1]}"]
+        assert stats['requests'] == 5 + 3 + 2 + 4
+        assert stats['retries'] == 5 and stats['errors'] == 6
+        assert stats['circuit'] == 'closed'
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+    print("  ✓ 连接复用和重试正常")
+
+
+def test_circuit_breaker():
+    """测试连续失败后熔断，冷却后半开探测"""
+    server = _start_server()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    client = HTTPClient(max_retries=0, failure_threshold=3, reset_timeout=0.2)
+    try:
+        for _ in range(3):
+            assert client.get(f"{base}/down", timeout=5).status_code == 503
+        try:
+            client.get(f"{base}/ok", timeout=5)
+            assert False, "熔断中的主机不应发出请求"
+        except CircuitOpenError as e:
+            assert e.retry_after > 0
+        assert server.hits.get('/ok') is None
+
+        # 关闭熔断的请求不受影响
+        assert client.get(f"{base}/ok", timeout=5, name='probe', circuit=False).status_code == 200
+
+        # 冷却结束后探测成功，关闭熔断
+        time.sleep(0.25)
+        assert client.get(f"{base}/ok", timeout=5).status_code == 200
+        stats = client.get_stats()
+        host = f"127.0.0.1:{server.server_address[1]}"
+        assert stats[host]['circuit'] == 'closed' and stats[host]['rejected'] == 1
+        assert stats['probe']['requests'] == 1
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+    breaker = CircuitBreaker('example.com', failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow() and not breaker.allow()  # 半开状态只放行一个探测请求
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    print("  ✓ 按主机熔断正常")
+
+
+if __name__ == '__main__':
+    test_keep_alive_and_retry()
+    test_circuit_breaker()
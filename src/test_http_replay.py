@@ -0,0 +1,163 @@
+"""
+HTTP录制/回放测试脚本
+先从本地HTTP替身服务器录制响应，关闭替身后由回放服务器返回，验证内容一致以及延迟、错误和限流配置
+"""
+
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.concurrency import run_sync
+from src.http_client import AIOHTTP_AVAILABLE, AsyncHTTPClient, HTTPClient
+from src.http_replay import FixtureStore, ReplayProfile, ReplayServer, enable_recording
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """GET返回路径和Host，POST返回请求体的长度，/slow 延迟0.2秒"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.2)
+        self._reply({'path': self.path, 'host': self.headers.get('Host')})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._reply({'path': self.path, 'length': len(body)})
+
+    def _reply(self, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Rl', '44')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def _record(fixture: Path) -> str:
+    """从替身服务器录制一组响应，返回替身服务器地址"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    client = HTTPClient(max_retries=0)
+    recorder = enable_recording(client, str(fixture))
+    try:
+        client.get(f"{base}/json/1.1.1.1", timeout=5)
+        client.get(f"{base}/cdn-cgi/trace", headers={'Host': 'a.example.com'}, timeout=5)
+        client.get(f"{base}/cdn-cgi/trace", headers={'Host': 'b.example.com'}, timeout=5)
+        client.post(f"{base}/batch", json=[{'query': '1.1.1.1'}, {'query': '8.8.8.8'}], timeout=5)
+        client.get(f"{base}/slow", timeout=5)
+        client.get(f"{base}/stream", stream=True, timeout=5).close()
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+    assert recorder.stats.snapshot() == {'recorded': 5, 'skipped': 1}
+    return base
+
+
+def test_record_and_replay(tmp_path):
+    """测试录制的响应在替身服务器关闭后可以原样回放"""
+    fixture = tmp_path / 'fixtures.jsonl'
+    base = _record(fixture)
+    records = [json.loads(line) for line in fixture.read_text(encoding='utf-8').splitlines()]
+    assert records[0]['status'] == 200 and 'Content-Length' not in records[0]['headers']
+
+    client = HTTPClient(max_retries=0)
+    client.replay = ReplayServer(FixtureStore(str(fixture))).start()
+    try:
+        response = client.get(f"{base}/json/1.1.1.1", timeout=5)
+        assert response.json()['path'] == '/json/1.1.1.1'
+        assert response.headers['X-Rl'] == '44'
+
+        # 同一URL按显式Host和请求体区分
+        response = client.get(f"{base}/cdn-cgi/trace", headers={'Host': 'b.example.com'}, timeout=5)
+        assert response.json()['host'] == 'b.example.com'
+        response = client.post(f"{base}/batch", json=[{'query': '1.1.1.1'}, {'query': '8.8.8.8'}], timeout=5)
+        assert response.json()['path'] == '/batch'
+        assert client.post(f"{base}/batch", json=[], timeout=5).status_code == 404
+
+        # 默认按录制时的耗时返回
+        start = time.monotonic()
+        client.get(f"{base}/slow", timeout=5)
+        assert time.monotonic() - start >= 0.15
+
+        # 指标按原始主机统计
+        assert client.get_stats()[f"127.0.0.1:{base.rsplit(':', 1)[1]}"]['requests'] == 5
+        stats = client.replay.stats.snapshot()
+        assert stats['hits'] == 4 and stats['misses'] == 1
+    finally:
+        client.close()
+    print("  ✓ 录制和回放正常")
+
+
+def test_replay_profiles(tmp_path):
+    """测试按主机配置的延迟、错误和限流"""
+    fixture = tmp_path / 'fixtures.jsonl'
+    base = _record(fixture)
+
+    profiles = {
+        '127.0.0.1': ReplayProfile(latency_ms=0, rate_limit=3, rate_window=60),
+        'default': ReplayProfile(error_rate=1.0),
+    }
+    client = HTTPClient(max_retries=0, failure_threshold=100)
+    client.replay = ReplayServer(FixtureStore(str(fixture)), profiles).start()
+    try:
+        statuses = [client.get(f"{base}/json/1.1.1.1", timeout=5) for _ in range(4)]
+        assert [r.status_code for r in statuses] == [200, 200, 200, 429]
+        assert statuses[1].headers['X-RateLimit-Remaining'] == '1'
+        assert int(statuses[3].headers['Retry-After']) > 0
+
+        # 其他主机使用default配置（全部返回503）
+        assert client.get('http://api.example.com/json', timeout=5).status_code == 503
+        stats = client.replay.stats.snapshot()
+        assert stats['rate_limited'] == 1 and stats['errors'] == 1
+    finally:
+        client.close()
+    print("  ✓ 回放延迟、错误和限流配置正常")
+
+
+def test_async_replay(tmp_path):
+    """测试异步客户端同样经过回放服务器"""
+    if not AIOHTTP_AVAILABLE:
+        print("  - 未安装aiohttp，跳过")
+        return
+
+    fixture = tmp_path / 'fixtures.jsonl'
+    base = _record(fixture)
+    client = HTTPClient(max_retries=0)
+    client.replay = ReplayServer(FixtureStore(str(fixture))).start()
+
+    async def fetch():
+        async with AsyncHTTPClient(client) as http:
+            response = await http.get(f"{base}/cdn-cgi/trace", headers={'Host': 'a.example.com'}, timeout=5)
+            batch = await http.post(f"{base}/batch", json=[{'query': '1.1.1.1'}, {'query': '8.8.8.8'}], timeout=5)
+            return response.json(), batch.json()
+
+    try:
+        trace, batch = run_sync(fetch())
+        assert trace['host'] == 'a.example.com' and batch['path'] == '/batch'
+    finally:
+        client.close()
+    print("  ✓ 异步客户端回放正常")
+
+
+if __name__ == '__main__':
+    import tempfile
+    for test in (test_record_and_replay, test_replay_profiles, test_async_replay):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test(Path(temp_dir))
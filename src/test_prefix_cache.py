@@ -0,0 +1,72 @@
+"""
+网段缓存测试脚本
+验证最长前缀匹配、过宽网段过滤，以及检测缓存按网段命中同网段的其他IP
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.detection_cache import DetectionCache
+from src.prefix_cache import PrefixTable
+
+
+def test_longest_prefix_match():
+    """测试最长前缀匹配、过期跳过和过宽网段"""
+    table = PrefixTable()
+    expires_at = time.time() + 3600
+
+    assert table.put('104.16.0.0/16', {'city': 'A'}, expires_at)
+    assert table.put('104.16.128.5/24', {'city': 'B'}, expires_at)
+    assert table.put('2606:4700::/32', {'city': 'C'}, expires_at)
+    assert not table.put('104.0.0.0/8', {'city': 'D'}, expires_at)
+    assert not table.put('not-a-network', {'city': 'E'}, expires_at)
+
+    assert table.lookup('104.16.128.77') == ('104.16.128.0/24', {'city': 'B'})
+    assert table.lookup('104.16.1.1') == ('104.16.0.0/16', {'city': 'A'})
+    assert table.lookup('2606:4700:10::1') == ('2606:4700::/32', {'city': 'C'})
+    assert table.lookup('104.17.0.1') is None
+
+    # 过期的更长网段不再命中，回退到更短的网段
+    table.put('104.16.128.0/24', {'city': 'B'}, time.time() - 1)
+    assert table.lookup('104.16.128.77') == ('104.16.0.0/16', {'city': 'A'})
+    assert table.sweep() == 1
+    assert len(table) == 2
+    print("  ✓ 最长前缀匹配正常")
+
+
+def test_cache_prefix_hit(tmp_path):
+    """测试带网段的结果命中同网段的其他IP，并随缓存持久化"""
+    db_path = str(tmp_path / 'cache.db')
+    cache = DetectionCache(cache_dir=str(tmp_path / 'ip_detection'), db_path=db_path)
+
+    data = {'ip': '1.0.0.1', 'country': 'AU', 'city': 'Sydney', 'source': 'geoip', 'network': '1.0.0.0/24'}
+    cache.set('1.0.0.1', data, 443, 'geoip')
+
+    hit = cache.get('1.0.0.200', 443)
+    assert hit['ip'] == '1.0.0.200' and hit['city'] == 'Sydney'
+    assert cache.get('1.0.1.1', 443) is None
+
+    # 要求更高层级时不使用网段结果
+    assert cache.get('1.0.0.200', 443, min_tier='cf_ray') is None
+    assert cache.get_stats()['prefix_hits'] == 1
+    cache.close()
+
+    reloaded = DetectionCache(cache_dir=str(tmp_path / 'ip_detection'), db_path=db_path)
+    assert reloaded.get('1.0.0.9', 8443)['ip'] == '1.0.0.9'
+    assert any(key == 'net:1.0.0.0/24' for key, _, _ in reloaded.export_records())
+
+    reloaded.clear('geoip')
+    assert reloaded.get('1.0.0.9', 8443) is None
+    reloaded.close()
+    print("  ✓ 检测缓存网段命中正常")
+
+
+if __name__ == '__main__':
+    import tempfile
+    test_longest_prefix_match()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        test_cache_prefix_hit(Path(temp_dir))
@@ -0,0 +1,95 @@
+"""
+限流器测试脚本
+验证令牌桶在多线程下不超发、根据响应头校准，以及限流时APIManager换用其他API
+"""
+
+import sys
+import time
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.api_providers import APIManager, BaseAPIProvider
+from src.rate_limiter import RateLimitExceeded, TokenBucket
+
+
+def test_concurrent_acquire():
+    """测试多线程同时获取令牌不会超过桶容量"""
+    bucket = TokenBucket('test', rate=0.001, capacity=20)
+    acquired = []
+
+    def worker():
+        for _ in range(10):
+            if bucket.try_acquire():
+                acquired.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(acquired) == 20
+    assert bucket.get_stats()['rejected'] == 60
+
+    # 短暂等待即可获得令牌时等待，而不是失败
+    fast = TokenBucket('fast', rate=20, capacity=1)
+    assert fast.try_acquire() and not fast.try_acquire()
+    assert fast.acquire(timeout=0.5)
+    assert fast.get_stats()['waited'] == 1
+    print("  ✓ 并发获取令牌正常")
+
+
+def test_header_calibration():
+    """测试根据X-Rl/X-Ttl和Retry-After校准额度"""
+    bucket = TokenBucket('ip_api', rate=45 / 60, capacity=45)
+
+    bucket.update_from_headers({'X-Rl': '3', 'X-Ttl': '20'})
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+    bucket.update_from_headers({'X-Rl': '0', 'X-Ttl': '20'})
+    assert 19 < bucket.wait_time() <= 20
+
+    limited = TokenBucket('other', rate=1, capacity=10)
+    limited.update_from_headers({'Retry-After': '30'}, status_code=429)
+    assert 29 < limited.wait_time() <= 30 and not limited.try_acquire()
+    print("  ✓ 响应头校准正常")
+
+
+class _Provider(BaseAPIProvider):
+
+    def __init__(self, name, limiter):
+        super().__init__(name)
+        self.rate_limiter = limiter
+        self.rate_limit_wait = 0.05
+
+    def query(self, ip: str) -> Optional[Dict]:
+        if not self.rate_limiter.acquire(timeout=self.rate_limit_wait):
+            raise RateLimitExceeded(self.name, self.rate_limiter.wait_time())
+        return {'country': 'US', 'city': 'Ashburn', 'source': self.name}
+
+    def parse_response(self, response):
+        return None
+
+
+def test_manager_steers_on_limit():
+    """测试限流的API被跳过且不计为失败"""
+    first = _Provider('first', TokenBucket('first', rate=0.001, capacity=2))
+    second = _Provider('second', TokenBucket('second', rate=100, capacity=100))
+    manager = APIManager()
+    manager.register_api(first, 1)
+    manager.register_api(second, 2)
+
+    sources = [manager.query(f'10.0.0.{i}')['source'] for i in range(6)]
+    assert sources == ['first', 'first'] + ['second'] * 4
+    assert 'first' not in manager.api_status
+    print("  ✓ 限流时换用其他API正常")
+
+
+if __name__ == '__main__':
+    test_concurrent_acquire()
+    test_header_calibration()
+    test_manager_steers_on_limit()
@@ -0,0 +1,93 @@
+"""
+检测层级规划测试脚本
+验证按实测成本排序、剩余额度和超时率的影响、准确性规则，以及检测器按批次使用的计划
+"""
+
+import sys
+import time
+from types import SimpleNamespace
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.ip_detector_v2 import IPDetectorV2
+from src.tier_planner import TierPlanner
+
+
+def test_cost_ordering():
+    """测试按耗时、成功率和剩余额度排序"""
+    planner = TierPlanner()
+    tiers = ('cf_ray', 'api', 'geoip')
+
+    # 没有实测数据时按默认耗时估计
+    assert planner.plan(False, tiers).order == ('geoip', 'api', 'cf_ray')
+
+    # CF-RAY对非CF IP总是超时，成本上升
+    for _ in range(10):
+        planner.record(False, 'cf_ray', False, 5.0)
+    assert planner.cost(False, 'cf_ray') > 20
+    assert planner.cost(True, 'cf_ray') == 1.0  # CF IP单独统计
+
+    # API额度不足时成本按比例上升，用完时排在最后
+    assert planner.cost(False, 'api', budget=0.1) == planner.cost(False, 'api') * 2
+    plan = planner.plan(False, tiers, {'api': 0.0})
+    assert plan.order[-1] == 'api' and plan.costs['api'] == float('inf')
+
+    # 关闭动态规划时使用默认顺序
+    planner.dynamic = False
+    assert planner.plan(False, tiers).order == ('api', 'cf_ray', 'geoip')
+    print("  ✓ 按成本排序正常")
+
+
+def test_plan_rules():
+    """测试必须排在最前/最后的层级和复核层级"""
+    planner = TierPlanner()
+    for _ in range(10):
+        planner.record(True, 'cf_ray', False, 5.0)
+
+    plan = planner.plan(True, ('cf_ray', 'api', 'geoip'), first='cf_ray', last=('geoip',))
+    assert plan.order == ('cf_ray', 'api', 'geoip') and plan.verifier is None
+
+    plan = planner.plan(True, ('cf_ray', 'api', 'geoip'), last=('geoip',), verifier='cf_ray')
+    assert plan.order == ('api', 'cf_ray', 'geoip') and plan.verifier == 'cf_ray'
+    assert 'api(0.50s) → cf_ray' in plan.describe()
+
+    # 复核层级排在第一位或不可用时不复核
+    assert planner.plan(False, ('api',), verifier='api').verifier is None
+    assert planner.plan(False, ('geoip',), verifier='api').verifier is None
+    print("  ✓ 准确性规则正常")
+
+
+def test_detector_plan():
+    """测试检测器的计划遵循CF IP规则，没有CF-RAY结果时标记低置信度"""
+    config = SimpleNamespace(cache_enabled=False, verification_sample_rate=0.0, cf_ray_detection_enabled=False)
+    detector = IPDetectorV2(config)
+    detector._try_api = lambda ip: {'country': 'US', 'city': 'San Francisco', 'source': 'ip-api',
+                                    'confidence': 0.95, 'ip': ip}
+    # 不依赖本地是否已下载GeoIP数据库
+    tier_available = detector._tier_available
+    detector._tier_available = lambda tier, is_cf: tier != 'geoip' and tier_available(tier, is_cf)
+    detector._try_geoip = lambda ip: None
+    try:
+        plan = detector.plan_tiers(True)
+        assert 'cf_ray' not in plan.order and plan.order[0] == 'api'
+
+        result, tier = detector._run_detection_chain('104.16.0.1', 443, True, time.time())
+        assert tier == 'api' and result['low_confidence'] is True
+
+        # 实测耗时计入规划器
+        assert detector.get_stats()['tiers']['cf/api']['attempts'] == 1
+
+        # 非CF IP的API结果不标记
+        result, tier = detector._run_detection_chain('8.8.8.8', 443, False, time.time())
+        assert tier == 'api' and 'low_confidence' not in result
+    finally:
+        detector.close()
+    print("  ✓ 检测器计划正常")
+
+
+if __name__ == '__main__':
+    test_cost_ordering()
+    test_plan_rules()
+    test_detector_plan()
@@ -0,0 +1,127 @@
+"""
+抽样复核测试脚本
+验证低置信度结果总是复核、不一致率上升时复核比例提高，以及检测链先用低成本层级
+"""
+
+import sys
+import time
+from types import SimpleNamespace
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.ip_detector_v2 import IPDetectorV2
+from src.verification import VerificationPolicy, results_agree
+
+
+def test_results_agree():
+    """测试结果比较"""
+    assert results_agree({'country': 'us', 'city': 'Mountain View'}, {'country': 'US', 'city': 'mountain view'})
+    assert results_agree({'country': 'JP', 'city': 'Unknown'}, {'country': 'JP', 'city': 'Tokyo'})
+    assert not results_agree({'country': 'US', 'city': 'San Francisco'}, {'country': 'JP', 'city': 'Tokyo'})
+    assert not results_agree({'country': 'JP', 'city': 'Osaka'}, {'country': 'JP', 'city': 'Tokyo'})
+    print("  ✓ 结果比较正常")
+
+
+def test_policy_ramp():
+    """测试低置信度总是复核，抽样不一致时提高复核比例，一致后回落"""
+    policy = VerificationPolicy(sample_rate=0.05, min_confidence=0.8, ramp=4.0, alpha=0.2, seed=1)
+    assert policy.should_verify('geoip', 'GeoLite2-Country', 0.5) == 'low_confidence'
+    assert policy.should_verify('api', 'ip-api', None) == 'low_confidence'
+
+    sampled = sum(policy.should_verify('api', 'ip-api', 0.95) == 'sampled' for _ in range(2000))
+    assert 50 <= sampled <= 150
+
+    # 低置信度结果的不一致不影响抽样比例
+    policy.record('geoip', 'GeoLite2-Country', agreed=False, reason='low_confidence')
+    assert policy.rate('geoip', 'GeoLite2-Country') == 0.05
+
+    for _ in range(3):
+        policy.record('api', 'ip-api', agreed=False)
+    assert policy.rate('api', 'ip-api') > 0.5
+    assert policy.rate('ipinfo', 'ipinfo') == 0.05  # 其他来源不受影响
+
+    for _ in range(30):
+        policy.record('api', 'ip-api', agreed=True)
+    assert policy.rate('api', 'ip-api') < 0.1
+
+    stats = policy.get_stats()['api/ip-api']
+    assert stats['verified'] == 33 and stats['disagreed'] == 3 and stats['sampled'] == sampled
+    print("  ✓ 复核比例随不一致率调整正常")
+
+
+def _detector(**overrides) -> IPDetectorV2:
+    """不使用持久化缓存、各层级由桩函数代替的检测器"""
+    config = SimpleNamespace(cache_enabled=False, verification_sample_rate=0.0, **overrides)
+    detector = IPDetectorV2(config)
+    detector.calls = []
+    detector._tier_available = lambda tier, is_cf: True
+
+    def stub(tier, result):
+        def run(ip, *args):
+            detector.calls.append(tier)
+            return dict(result, ip=ip) if result else None
+        return run
+
+    detector._try_geoip = stub('geoip', {'country': 'US', 'city': 'Ashburn', 'source': 'GeoLite2-City',
+                                         'confidence': 0.8})
+    detector._try_api = stub('api', {'country': 'US', 'city': 'Mountain View', 'source': 'ip-api',
+                                     'confidence': 0.95})
+    detector._try_cf_ray = stub('cf_ray', {'country': 'JP', 'city': 'Tokyo', 'source': 'cf_ray',
+                                           'confidence': 1.0})
+    return detector
+
+
+def test_cheap_tier_first():
+    """测试非CF IP先由GeoIP给出结果，只在抽样或低置信度时调用API"""
+    detector = _detector()
+    try:
+        result, tier = detector._run_detection_chain('8.8.8.8', 443, False, time.time())
+        assert tier == 'geoip' and result['city'] == 'Ashburn' and detector.calls == ['geoip']
+
+        # 抽样复核：采用API结果并记录不一致
+        detector.verification.sample_rate = 1.0
+        detector.calls.clear()
+        result, tier = detector._run_detection_chain('8.8.4.4', 443, False, time.time())
+        assert tier == 'api' and result['city'] == 'Mountain View' and detector.calls == ['geoip', 'api']
+        stats = detector.get_stats()['verification']['geoip/GeoLite2-City']
+        assert stats['verified'] == 1 and stats['disagreed'] == 1
+
+        # CF IP默认仍必须先用CF-RAY
+        detector.calls.clear()
+        result, tier = detector._run_detection_chain('104.16.0.1', 443, True, time.time())
+        assert tier == 'cf_ray' and detector.calls == ['cf_ray']
+    finally:
+        detector.close()
+    print("  ✓ 低成本层级优先正常")
+
+
+def test_cf_sampled_verification():
+    """测试关闭CF-RAY优先后，CF IP先用API结果并由CF-RAY抽样复核"""
+    detector = _detector(prefer_cfray_for_cf_ips=False)
+    try:
+        result, tier = detector._run_detection_chain('104.16.0.1', 443, True, time.time())
+        assert tier == 'api' and detector.calls == ['api']
+
+        # 抽样发现不一致后复核比例提高
+        detector.verification.sample_rate = 1.0
+        detector._run_detection_chain('104.16.0.2', 443, True, time.time())
+        detector.verification.sample_rate = 0.0
+        assert detector.verification.rate('api', 'ip-api') > 0.3
+
+        detector.verification.min_confidence = 1.0
+        detector.calls.clear()
+        result, tier = detector._run_detection_chain('104.16.0.3', 443, True, time.time())
+        assert tier == 'cf_ray' and result['city'] == 'Tokyo'
+        assert detector.calls == ['api', 'cf_ray']
+    finally:
+        detector.close()
+    print("  ✓ CF IP抽样复核正常")
+
+
+if __name__ == '__main__':
+    test_results_agree()
+    test_policy_ramp()
+    test_cheap_tier_first()
+    test_cf_sampled_verification()
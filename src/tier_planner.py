@@ -0,0 +1,181 @@
+"""
+检测层级规划模块
+按各层级实测的耗时、成功率和剩余额度估算每个成功结果的成本，为每批检测确定层级顺序；
+准确性规则（必须排在最前/最后的层级、复核层级）由调用方给出
+"""
+
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TierPlan:
+    """一类IP的检测计划"""
+
+    __slots__ = ('order', 'verifier', 'costs')
+
+    def __init__(self, order: Tuple[str, ...], verifier: Optional[str], costs: Dict[str, float]):
+        """
+        Args:
+            order: 层级顺序
+            verifier: 复核层级，不复核时为None
+            costs: 各层级的估算成本（秒/成功结果）
+        """
+        self.order = order
+        self.verifier = verifier
+        self.costs = costs
+
+    def describe(self) -> str:
+        """计划的文字描述（用于日志）"""
+        if not self.order:
+            return "无可用层级"
+        parts = []
+        for tier in self.order:
+            cost = self.costs.get(tier, float('inf'))
+            parts.append(f"{tier}(∞)" if cost == float('inf') else f"{tier}({cost:.2f}s)")
+        text = ' → '.join(parts)
+        if self.verifier:
+            text += f", 复核 {self.verifier}"
+        return text
+
+
+class _TierStats:
+    """一类IP在一个层级上的实测表现（调用方需持有锁）"""
+
+    __slots__ = ('attempts', 'successes', 'latency', 'success')
+
+    def __init__(self, latency: float):
+        self.attempts = 0
+        self.successes = 0
+        self.latency = latency  # 耗时的指数移动平均（秒）
+        self.success = 1.0      # 成功率的指数移动平均
+
+
+class TierPlanner:
+    """
+    基于成本的检测层级规划器
+
+    成本 = 平均耗时 / 成功率 / 额度系数，即得到一个成功结果的预期耗时；
+    剩余额度低于QUOTA_LOW_WATERMARK时额度系数按比例降低，额度用完时成本为无穷大。
+    CF IP和其他IP分别统计（CF-RAY对两类IP的成功率相差很大）。
+    """
+
+    # 默认层级顺序（成本相同时的先后，也是关闭动态规划时的顺序）
+    DEFAULT_ORDER = {
+        True: ('cf_ray', 'geoip', 'api'),
+        False: ('api', 'cf_ray', 'geoip'),
+    }
+    # 没有实测数据时的耗时估计（秒）
+    DEFAULT_LATENCY = {'cf_ray': 1.0, 'api': 0.5, 'geoip': 0.01}
+    # 剩余额度低于该比例时按比例提高成本
+    QUOTA_LOW_WATERMARK = 0.2
+    # 成本计算中成功率的下限，避免除以0
+    SUCCESS_FLOOR = 0.01
+
+    def __init__(self, dynamic: bool = True, alpha: float = 0.2):
+        """
+        初始化规划器
+
+        Args:
+            dynamic: 是否按成本排序（False时使用默认顺序）
+            alpha: 耗时和成功率加权平均的平滑系数
+        """
+        self.dynamic = dynamic
+        self.alpha = alpha
+        self._stats: Dict[Tuple[bool, str], _TierStats] = {}
+        self._lock = threading.Lock()
+
+    def _tier_stats(self, is_cf: bool, tier: str) -> _TierStats:
+        """获取层级统计（调用方需持有锁）"""
+        stats = self._stats.get((is_cf, tier))
+        if stats is None:
+            stats = self._stats[(is_cf, tier)] = _TierStats(self.DEFAULT_LATENCY.get(tier, 1.0))
+        return stats
+
+    def record(self, is_cf: bool, tier: str, success: bool, elapsed: float):
+        """
+        记录一次层级检测
+
+        Args:
+            is_cf: 是否为CF IP
+            tier: 层级
+            success: 是否得到结果
+            elapsed: 耗时（秒）
+        """
+        with self._lock:
+            stats = self._tier_stats(is_cf, tier)
+            stats.attempts += 1
+            if success:
+                stats.successes += 1
+            stats.latency += self.alpha * (elapsed - stats.latency)
+            stats.success += self.alpha * ((1.0 if success else 0.0) - stats.success)
+
+    def cost(self, is_cf: bool, tier: str, budget: float = 1.0) -> float:
+        """
+        层级的估算成本
+
+        Args:
+            is_cf: 是否为CF IP
+            tier: 层级
+            budget: 剩余额度比例（0-1）
+
+        Returns:
+            得到一个成功结果的预期耗时（秒），额度用完时为无穷大
+        """
+        quota = min(1.0, budget / self.QUOTA_LOW_WATERMARK)
+        if quota <= 0:
+            return float('inf')
+        with self._lock:
+            stats = self._tier_stats(is_cf, tier)
+            return stats.latency / max(stats.success, self.SUCCESS_FLOOR) / quota
+
+    def plan(self, is_cf: bool, available: Iterable[str], budgets: Optional[Dict[str, float]] = None,
+             first: Optional[str] = None, last: Iterable[str] = (), verifier: Optional[str] = None) -> TierPlan:
+        """
+        确定一类IP的层级顺序
+
+        Args:
+            is_cf: 是否为CF IP
+            available: 可用的层级
+            budgets: {层级: 剩余额度比例}，未给出的层级视为额度充足
+            first: 必须排在最前面的层级
+            last: 必须排在最后面的层级
+            verifier: 复核层级（排在第一位时不复核）
+
+        Returns:
+            检测计划
+        """
+        budgets = budgets or {}
+        default_order = self.DEFAULT_ORDER[is_cf]
+        tiers: List[str] = [tier for tier in default_order if tier in set(available)]
+        last = tuple(last)
+        costs = {tier: self.cost(is_cf, tier, budgets.get(tier, 1.0)) for tier in tiers}
+
+        def plan_key(tier):
+            rule = 0 if tier == first else (2 if tier in last else 1)
+            return (rule, costs[tier] if self.dynamic else 0.0, default_order.index(tier))
+
+        order = tuple(sorted(tiers, key=plan_key))
+        if verifier not in order or order[0] == verifier:
+            verifier = None
+        return TierPlan(order, verifier, costs)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """
+        获取统计信息
+
+        Returns:
+            {'cf/层级' 或 'other/层级': {'attempts', 'successes', 'latency_ms', 'success_rate'}}
+        """
+        with self._lock:
+            return {
+                f"{'cf' if is_cf else 'other'}/{tier}": {
+                    'attempts': stats.attempts,
+                    'successes': stats.successes,
+                    'latency_ms': round(stats.latency * 1000, 1),
+                    'success_rate': round(stats.success, 3),
+                }
+                for (is_cf, tier), stats in sorted(self._stats.items())
+            }
@@ -0,0 +1,175 @@
+"""
+交叉验证模块
+低成本的检测层级先给出结果，高成本层级只抽样复核一部分结果以及低置信度的结果；
+按 层级/来源 统计抽样复核的不一致率，不一致率上升时自动提高复核比例
+"""
+
+import random
+import logging
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 表示未知的城市名（不参与比较）
+UNKNOWN_CITIES = {'', 'unknown', 'anycast'}
+
+
+def results_agree(result: Dict, reference: Dict) -> bool:
+    """
+    判断两个检测结果是否一致
+
+    国家必须相同；两边都有城市时城市也必须相同（不区分大小写）
+
+    Args:
+        result: 被复核的结果
+        reference: 复核层级的结果
+
+    Returns:
+        是否一致
+    """
+    if (result.get('country') or '').upper() != (reference.get('country') or '').upper():
+        return False
+    city = (result.get('city') or '').strip().lower()
+    reference_city = (reference.get('city') or '').strip().lower()
+    if city in UNKNOWN_CITIES or reference_city in UNKNOWN_CITIES:
+        return True
+    return city == reference_city
+
+
+class _SourceTracker:
+    """一个 层级/来源 的复核统计（调用方需持有锁）"""
+
+    __slots__ = ('answered', 'sampled', 'low_confidence', 'verified', 'disagreed', 'disagreement')
+
+    def __init__(self):
+        self.answered = 0
+        self.sampled = 0
+        self.low_confidence = 0
+        self.verified = 0
+        self.disagreed = 0
+        self.disagreement = 0.0  # 不一致率的指数移动平均
+
+
+class VerificationPolicy:
+    """
+    抽样复核策略
+
+    每个 层级/来源 的复核比例为 sample_rate + ramp × 不一致率（指数移动平均），最高max_rate；
+    置信度低于min_confidence（或没有置信度）的结果总是复核。
+    """
+
+    def __init__(self, sample_rate: float = 0.05, min_confidence: float = 0.8, max_rate: float = 1.0,
+                 ramp: float = 4.0, alpha: float = 0.1, seed: Optional[int] = None):
+        """
+        初始化复核策略
+
+        Args:
+            sample_rate: 基础抽样比例
+            min_confidence: 低于该置信度的结果总是复核
+            max_rate: 复核比例上限
+            ramp: 不一致率对复核比例的放大倍数
+            alpha: 不一致率移动平均的平滑系数
+            seed: 随机数种子（用于测试）
+        """
+        self.sample_rate = sample_rate
+        self.min_confidence = min_confidence
+        self.max_rate = max_rate
+        self.ramp = ramp
+        self.alpha = alpha
+
+        self._random = random.Random(seed)
+        self._trackers: Dict[str, _SourceTracker] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(tier: str, source: Optional[str]) -> str:
+        return f"{tier}/{source or tier}"
+
+    def _tracker(self, tier: str, source: Optional[str]) -> _SourceTracker:
+        """获取 层级/来源 的统计（调用方需持有锁）"""
+        key = self.key(tier, source)
+        tracker = self._trackers.get(key)
+        if tracker is None:
+            tracker = self._trackers[key] = _SourceTracker()
+        return tracker
+
+    def _rate(self, tracker: _SourceTracker) -> float:
+        return min(self.max_rate, self.sample_rate + self.ramp * tracker.disagreement)
+
+    def rate(self, tier: str, source: Optional[str] = None) -> float:
+        """当前的复核比例"""
+        with self._lock:
+            return self._rate(self._tracker(tier, source))
+
+    def should_verify(self, tier: str, source: Optional[str], confidence: Optional[float]) -> Optional[str]:
+        """
+        判断一个结果是否需要复核
+
+        Args:
+            tier: 给出结果的层级
+            source: 结果来源（如API名称）
+            confidence: 结果的置信度
+
+        Returns:
+            复核原因 'low_confidence'/'sampled'，不需要复核时返回None
+        """
+        with self._lock:
+            tracker = self._tracker(tier, source)
+            tracker.answered += 1
+            if confidence is None or confidence < self.min_confidence:
+                tracker.low_confidence += 1
+                return 'low_confidence'
+            if self._random.random() < self._rate(tracker):
+                tracker.sampled += 1
+                return 'sampled'
+            return None
+
+    def record(self, tier: str, source: Optional[str], agreed: bool, reason: str = 'sampled'):
+        """
+        记录一次复核结果
+
+        只有随机抽样的复核计入不一致率（低置信度结果的不一致不代表该来源整体变差）
+
+        Args:
+            tier: 被复核结果的层级
+            source: 被复核结果的来源
+            agreed: 是否与复核层级一致
+            reason: 复核原因
+        """
+        with self._lock:
+            tracker = self._tracker(tier, source)
+            tracker.verified += 1
+            if not agreed:
+                tracker.disagreed += 1
+            if reason != 'sampled':
+                return
+
+            before = self._rate(tracker)
+            tracker.disagreement += self.alpha * ((0.0 if agreed else 1.0) - tracker.disagreement)
+            after = self._rate(tracker)
+
+        if after >= before * 2 and after > self.sample_rate * 2:
+            logger.info(f"{self.key(tier, source)} 抽样不一致率上升，复核比例提高到 {after:.0%}")
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """
+        获取统计信息
+
+        Returns:
+            {层级/来源: {'answered', 'sampled', 'low_confidence', 'verified', 'disagreed',
+            'disagreement_rate', 'sample_rate'}}
+        """
+        with self._lock:
+            return {
+                key: {
+                    'answered': tracker.answered,
+                    'sampled': tracker.sampled,
+                    'low_confidence': tracker.low_confidence,
+                    'verified': tracker.verified,
+                    'disagreed': tracker.disagreed,
+                    'disagreement_rate': round(tracker.disagreement, 3),
+                    'sample_rate': round(self._rate(tracker), 3),
+                }
+                for key, tracker in self._trackers.items()
+            }